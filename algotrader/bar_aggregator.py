@@ -0,0 +1,237 @@
+"""
+Online aggregation of ticks into bars.
+
+:Author:
+"""
+
+import numpy as np
+
+from events import BarEvent, EventType
+
+SECONDS_IN_DAY = 86400
+NS_IN_SECOND = 10 ** 9
+
+
+def _time_ns(time):
+    """Integer nanoseconds since epoch UTC of a tick time: int epoch ns,
+    RFC3339 string as returned by Influx or numpy datetime64
+    """
+    if isinstance(time, int):
+        return time
+    if isinstance(time, str):
+        # Influx returns RFC3339 strings in UTC, numpy wants them naive
+        time = np.datetime64(time.rstrip('Z'), 'ns')
+    return int(np.datetime64(time, 'ns').astype(np.int64))
+
+
+def _bar_end(bar):
+    """End time of a BarEvent, bars are emitted in this order
+    """
+    return bar.time + np.timedelta64(bar.period, 's')
+
+
+class _OpenBar(object):
+    """Running OHLC of the bar of a symbol and period being built
+    """
+    __slots__ = ('start', 'end', 'open', 'high', 'low', 'close', 'ticks')
+
+    def __init__(self, start, end, price):
+        self.start = start
+        self.end = end
+        self.open = price
+        self.high = price
+        self.low = price
+        self.close = price
+        self.ticks = 1
+
+
+class BarAggregator(object):
+    """
+    Builds bars from ticks as they arrive. Each tick, or batch of ticks,
+    updates the open bar of its symbol for every period and a BarEvent is
+    emitted as soon as a bar closes: when a tick of any symbol reaches
+    its end time.
+
+    Same open, high, low and close as ticks2bars.ticks_to_bars: OHLC of
+    the mid price (bid + ask) / 2, bars labelled with their start time,
+    aligned to midnight UTC, no bar for periods without ticks. Volume is
+    the number of ticks in the bar.
+
+    Memory is constant: one open bar per symbol and period.
+
+    Ticks must come in time order.
+    """
+
+    def __init__(self, periods=(60,), events_queue=None):
+        """
+        :param periods: bar periods in seconds, each a divisor of a day
+        :param events_queue: if given, bars are also put onto it
+        """
+        for period in periods:
+            if period <= 0 or SECONDS_IN_DAY % period:
+                raise ValueError('Bar period {} does not divide a day, '
+                                 'bars can not be aligned to '
+                                 'midnight'.format(period))
+
+        self.periods = tuple(sorted(periods))
+        self.events_queue = events_queue
+        # {(symbol, period): _OpenBar}
+        self._open_bars = {}
+        # earliest end time of the open bars
+        self._next_close = None
+
+    def on_tick(self, event):
+        """Update the bars with a TickEvent or a TickBatchEvent.
+        The signature of a Backtester event handler.
+
+        :return: list of the BarEvents closed, by end time
+        """
+        if event.type is EventType.TICK_BATCH:
+            return self.update_batch(event)
+        return self.update(event.symbol, event.time, event.bid, event.ask)
+
+    def update(self, symbol, time, bid, ask):
+        """Update the bars with one tick
+
+        :param time: int epoch ns, RFC3339 string or datetime64
+        :param bid: bid price already parsed by the PriceParser
+        :param ask: ask price already parsed by the PriceParser
+        :return: list of the BarEvents closed, by end time
+        """
+        time = _time_ns(time)
+        closed = []
+        if self._next_close is not None and time >= self._next_close:
+            closed = self._close_bars(time)
+
+        price = (bid + ask) // 2
+        for period in self.periods:
+            bar = self._open_bars.get((symbol, period))
+            if bar is None:
+                self._open_bar(symbol, period, time, price)
+                continue
+
+            if price > bar.high:
+                bar.high = price
+            elif price < bar.low:
+                bar.low = price
+            bar.close = price
+            bar.ticks += 1
+
+        return self._emit(closed)
+
+    def update_batch(self, batch):
+        """Update the bars with all the ticks of a TickBatchEvent.
+        OHLC within the batch are computed with array operations.
+
+        :return: list of the BarEvents closed, by end time
+        """
+        if not len(batch):
+            return []
+
+        times = batch.time.astype(np.int64)
+        mids = (batch.bid + batch.ask) // 2
+        closed = []
+        for code in np.unique(batch.symbol_code).tolist():
+            symbol = batch.symbols[code]
+            mask = batch.symbol_code == code
+            symbol_times = times[mask]
+            symbol_mids = mids[mask]
+            for period in self.periods:
+                closed.extend(self._update_segments(symbol, period,
+                                                    symbol_times,
+                                                    symbol_mids))
+
+        # bars of any symbol ended before the last tick of the batch
+        closed.extend(self._close_bars(int(times[-1])))
+        closed.sort(key=_bar_end)
+        return self._emit(closed)
+
+    def flush(self):
+        """Close all open bars, at the end of the data
+
+        :return: list of the BarEvents closed, by end time
+        """
+        return self._emit(self._close_bars(None))
+
+    def _update_segments(self, symbol, period, times, mids):
+        """Fold the ticks of one symbol into its bars of one period.
+
+        :return: list of the bars closed by the ticks
+        """
+        period_ns = period * NS_IN_SECOND
+        starts = times - times % period_ns
+        # first tick of each bar
+        firsts = np.flatnonzero(np.diff(starts)) + 1
+        firsts = np.concatenate(([0], firsts))
+        opens = mids[firsts]
+        highs = np.maximum.reduceat(mids, firsts)
+        lows = np.minimum.reduceat(mids, firsts)
+        closes = mids[np.append(firsts[1:], len(mids)) - 1]
+        counts = np.diff(np.append(firsts, len(mids)))
+
+        closed = []
+        key = (symbol, period)
+        for start, o, h, l, c, n in zip(starts[firsts].tolist(),
+                                        opens.tolist(), highs.tolist(),
+                                        lows.tolist(), closes.tolist(),
+                                        counts.tolist()):
+            bar = self._open_bars.get(key)
+            if bar is not None and bar.start == start:
+                bar.high = max(bar.high, h)
+                bar.low = min(bar.low, l)
+                bar.close = c
+                bar.ticks += n
+                continue
+
+            if bar is not None:
+                closed.append(self._bar_event(symbol, period, bar))
+            bar = self._open_bar(symbol, period, start, o)
+            bar.high = h
+            bar.low = l
+            bar.close = c
+            bar.ticks = n
+
+        return closed
+
+    def _open_bar(self, symbol, period, time, price):
+        start = time - time % (period * NS_IN_SECOND)
+        bar = _OpenBar(start, start + period * NS_IN_SECOND, price)
+        self._open_bars[(symbol, period)] = bar
+        if self._next_close is None or bar.end < self._next_close:
+            self._next_close = bar.end
+        return bar
+
+    def _close_bars(self, time):
+        """Remove the open bars ended at time, all if time is None
+
+        :return: list of BarEvents by end time
+        """
+        closed = []
+        next_close = None
+        for key, bar in list(self._open_bars.items()):
+            if time is None or bar.end <= time:
+                del self._open_bars[key]
+                closed.append(self._bar_event(key[0], key[1], bar))
+            elif next_close is None or bar.end < next_close:
+                next_close = bar.end
+        self._next_close = next_close
+
+        closed.sort(key=_bar_end)
+        return closed
+
+    @staticmethod
+    def _bar_event(symbol, period, bar):
+        return BarEvent(symbol=symbol,
+                        time=np.datetime64(bar.start, 'ns'),
+                        period=period,
+                        open_price=bar.open,
+                        high_price=bar.high,
+                        low_price=bar.low,
+                        close_price=bar.close,
+                        volume=bar.ticks)
+
+    def _emit(self, closed):
+        if self.events_queue is not None:
+            for bar in closed:
+                self.events_queue.put(bar)
+        return closed
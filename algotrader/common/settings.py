@@ -1,6 +1,8 @@
+import copy
 import logging
 import os
 import pathlib
+import threading
 
 import yaml
 
@@ -15,8 +17,35 @@ FILE_SETTINGS = '/home/javier/MacroGDrive/trading/trading.conf'
 STRATEGY_SETTINGS = None
 
 
+# Parsed config files by path: {path: (mtime, settings)}
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+
+def _load_settings(config_path):
+    """Parsed settings of a config file. The file is read and parsed once,
+    and again only if its modification time changes.
+
+    :return: a copy of the parsed settings, free to modify or pickle
+    """
+    mtime = os.stat(config_path).st_mtime
+    with _settings_lock:
+        cached = _settings_cache.get(config_path)
+        if cached is None or cached[0] != mtime:
+            with open(config_path, 'rt') as stream:
+                cached = (mtime, yaml.safe_load(stream))
+            _settings_cache[config_path] = cached
+
+    # the cached settings are never handed out, callers may change theirs
+    return copy.deepcopy(cached[1])
+
+
 class AlgoSettings:
-    """General configuration options of AlgoTrader System."""
+    """General configuration options of AlgoTrader System.
+
+    The config file is parsed once per process, each instance gets its own
+    copy of the settings.
+    """
     def __init__(self, get_from='file'):
         """
         :param get_from: 'env' for environmental variable
@@ -25,6 +54,13 @@ class AlgoSettings:
         self.get_from = get_from
         self.stream = self._stream()
 
+    @staticmethod
+    def reload():
+        """Forget the parsed config files, next instances read them again
+        """
+        with _settings_lock:
+            _settings_cache.clear()
+
     # Internal functions
     def _path_from_env(self):
         try:
@@ -49,8 +85,7 @@ class AlgoSettings:
         elif self.get_from == 'file':
             self._path_from_file()
 
-        stream = open(self.config_path, 'rt')
-        return yaml.load(stream)
+        return _load_settings(self.config_path)
 
     # Broker access functions
     def oanda_connection_type(self):
@@ -76,6 +111,15 @@ class AlgoSettings:
     def store_clean_fxcm(self):
         return self.stream['fxcm_data']['store_clean']
 
+    def store_ticks_fxcm(self):
+        return self.stream['fxcm_data']['store_ticks']
+
+    def tick_cache_path(self):
+        return self.stream['tick_cache']['path']
+
+    def tick_cache_max_gb(self):
+        return self.stream['tick_cache']['max_gb']
+
     # Logging configuration
     def log_configuration(self):
         return self.stream['logging']['config']
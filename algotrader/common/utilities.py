@@ -5,6 +5,10 @@ Some utilities used across the program
 import datetime
 import os
 import pathlib
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
 from functools import wraps
 from itertools import tee, islice, chain
 
@@ -120,3 +124,75 @@ def fn_timer(function):
         return result
     return function_timer
 
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """
+    Write a file through a temp file in the same directory, renamed to path
+    when the block ends and removed on error. Readers never see half a file
+    and concurrent writers of the same path do not share the temp file.
+
+    Returns: temp file object, open in mode
+    """
+    path = pathlib.Path(path)
+    tmp_file = tempfile.NamedTemporaryFile(mode=mode, dir=str(path.parent),
+                                           suffix='.tmp', delete=False)
+    try:
+        with tmp_file:
+            yield tmp_file
+        os.replace(tmp_file.name, str(path))
+    except BaseException:
+        os.remove(tmp_file.name)
+        raise
+
+
+def threaded_prefetch(iterable, depth=1):
+    """
+    Consumes an iterable in a background thread keeping up to depth items
+    ready ahead of the consumer. The thread starts right away, so several
+    prefetchers created together work concurrently.
+
+    Exceptions in the background thread are raised to the consumer. Closing
+    the returned generator stops the background thread.
+
+    Returns: generator with the items of the iterable
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as error:
+            put((done, error))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    def consumer():
+        try:
+            while True:
+                item, error = buffer.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    return consumer()
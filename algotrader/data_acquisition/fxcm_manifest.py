@@ -0,0 +1,156 @@
+"""
+Sidecar manifest of the clean FXCM files.
+
+Next to each clean file "SYMBOL_YYYY_WW.csv.gz" a "SYMBOL_YYYY_WW.manifest"
+JSON file records its number of rows, first and last tick time, checksum
+of the csv content, and the size and mtime of the clean file when the
+manifest was written. Validations read the row count from the manifest
+instead of decompressing the whole week file.
+
+A manifest whose size or mtime no longer match the clean file is stale
+and is ignored.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import pathlib
+
+from common.utilities import atomic_write
+
+MANIFEST_SUFFIX = '.manifest'
+
+# Bytes kept from the end of the file to find the last row
+_TAIL_SIZE = 1024
+
+
+def manifest_path(clean_file_path):
+    """Filepath of the manifest of a clean file
+    """
+    clean_file_path = pathlib.Path(clean_file_path)
+    filename = clean_file_path.parts[-1][:-7]
+    return clean_file_path.parent / (filename + MANIFEST_SUFFIX)
+
+
+def _tick_time(row):
+    """ISO 8601 UTC time of a csv row 'MM/DD/YYYY HH:MM:SS.fff,bid,ask'
+    """
+    text = row.split(b',')[0].decode('utf-8')
+    try:
+        time = datetime.datetime.strptime(text, '%m/%d/%Y %H:%M:%S.%f')
+    except ValueError:
+        return text
+    return time.isoformat() + 'Z'
+
+
+class ManifestBuilder:
+    """Manifest of a clean file built from its csv content, fed in chunks
+    of bytes of any size as it is written.
+    """
+
+    def __init__(self):
+        self._newlines = 0
+        self._checksum = hashlib.sha256()
+        # first row, once the header and the first row are read
+        self._first = None
+        self._head = b''
+        self._tail = b''
+
+    def update(self, chunk):
+        """Add the next chunk of csv content
+        """
+        self._newlines += chunk.count(b'\n')
+        self._checksum.update(chunk)
+        if self._first is None:
+            self._head += chunk
+            lines = self._head.split(b'\n', 2)
+            if len(lines) == 3:
+                self._first = lines[1]
+                self._head = b''
+        self._tail = (self._tail + chunk)[-_TAIL_SIZE:]
+
+    def manifest(self):
+        """Manifest dictionary, but the clean file stats
+        """
+        # same count as iterating the lines of the file, minus the header
+        lines = self._newlines
+        if self._tail and not self._tail.endswith(b'\n'):
+            lines += 1
+        rows = max(lines - 1, 0)
+
+        first = self._first
+        if first is None:
+            # a single row without end of line
+            first = (self._head.split(b'\n')[1:] or [None])[0]
+        last = [r for r in self._tail.split(b'\n') if r][-1:]
+
+        return {'rows': rows,
+                'first': _tick_time(first) if rows and first else None,
+                'last': _tick_time(last[0]) if rows and last else None,
+                'sha256': self._checksum.hexdigest()}
+
+    def write(self, clean_file_path):
+        """Write the manifest of a clean file, already closed
+
+        :return: manifest dictionary
+        """
+        clean_file_path = pathlib.Path(clean_file_path)
+        stat = clean_file_path.stat()
+        ans = self.manifest()
+        ans.update({'filename': clean_file_path.parts[-1][:-7],
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns})
+
+        with atomic_write(manifest_path(clean_file_path), mode='wt') as f:
+            json.dump(ans, f)
+        return ans
+
+
+def build_manifest(clean_file_path, chunk_size=1024 * 1024):
+    """Scan a clean file and write its manifest, for files cleaned before
+    manifests existed
+
+    :return: manifest dictionary
+    """
+    builder = ManifestBuilder()
+    with gzip.open(clean_file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            builder.update(chunk)
+    logging.info('Manifest built for {}'.format(clean_file_path))
+    return builder.write(clean_file_path)
+
+
+def read_manifest(clean_file_path):
+    """Manifest of a clean file
+
+    :return: manifest dictionary, None if missing or stale
+    """
+    path = manifest_path(clean_file_path)
+    try:
+        with open(path, 'rt') as f:
+            ans = json.load(f)
+        stat = pathlib.Path(clean_file_path).stat()
+    except (OSError, ValueError):
+        return None
+
+    if ans.get('size') != stat.st_size or \
+            ans.get('mtime_ns') != stat.st_mtime_ns:
+        logging.warning('Stale manifest {}'.format(path))
+        return None
+    return ans
+
+
+def get_manifest(clean_file_path):
+    """Manifest of a clean file, built if missing or stale
+    """
+    ans = read_manifest(clean_file_path)
+    if ans is None:
+        ans = build_manifest(clean_file_path)
+    return ans
+
+
+def row_count(clean_file_path):
+    """Number of ticks in a clean file, from its manifest
+    """
+    return get_manifest(clean_file_path)['rows']
@@ -0,0 +1,283 @@
+"""
+Pipelined update of FXCM tick data: download, clean, parse and insert
+into the securities master in one pass.
+
+Each week file moves to the next stage as soon as it is ready, instead of
+downloading everything, then cleaning everything, then inserting. Stages
+run in their own threads, connected by bounded queues, so a slow stage
+holds back the ones before it instead of piling files up in memory.
+Downloads and database writes are I/O bound, and gzip and pandas parsing
+release the GIL for most of their work.
+
+The original and clean files are still written to their stores, as by
+fxmc.update_all.
+"""
+import datetime
+import logging
+import pathlib
+import queue
+import threading
+import time
+
+import requests
+import requests.adapters
+
+from common.settings import AlgoSettings
+from data_acquisition.fxcm_manifest import read_manifest
+from data_acquisition.fxmc import (TokenBucket, all_possible_urls,
+                                   clean_fxcm_file, download_file)
+from databases.fxcm_tick_insert import (insert_tick_data, prepare_tick_file,
+                                        row_counts_by_filename,
+                                        store_path_constructor)
+from log.log_settings import setup_logging, log_title
+
+logger = logging.getLogger('fxcm pipeline')
+
+# Marks the end of the files in a queue
+_END_OF_FILES = None
+
+
+class _Stage:
+    """Pool of threads applying function to the items of in_queue and
+    putting the results, if not None, onto out_queue. Items that fail are
+    logged and dropped.
+    """
+
+    def __init__(self, name, function, in_queue, out_queue, workers):
+        self.name = name
+        self.function = function
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.done = 0
+        self.failed = []
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        # ends the stage once all its threads finished
+        self._closer = threading.Thread(target=self._close, daemon=True)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        self._closer.start()
+
+    def join(self):
+        self._closer.join()
+
+    def _work(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _END_OF_FILES:
+                # let the other threads of the stage see it
+                self.in_queue.put(_END_OF_FILES)
+                return
+            try:
+                result = self.function(item)
+            except Exception:
+                logger.exception('{} failed for {}'.format(self.name,
+                                                           item['filename']))
+                with self._lock:
+                    self.failed.append(item['filename'])
+                continue
+
+            with self._lock:
+                self.done += 1
+            if result is not None:
+                self.out_queue.put(result)
+
+    def _close(self):
+        for thread in self._threads:
+            thread.join()
+        self.out_queue.put(_END_OF_FILES)
+
+
+class FxcmPipeline:
+    """Download, clean, parse and insert FXCM week files, each file going
+    through the stages as soon as the previous one is done with it.
+    """
+
+    def __init__(self, provider='fxcm', into_table='fx_ticks',
+                 download_workers=4, clean_workers=2, parse_workers=2,
+                 write_workers=2, max_writers=None, queue_size=4, rate=0.5,
+                 retries=3):
+        """
+        :param download_workers: max number of requests in flight
+        :param clean_workers: threads cleaning original files
+        :param parse_workers: threads parsing clean files
+        :param write_workers: threads inserting files
+        :param max_writers: max threads writing into the database at the
+                            same time, default write_workers
+        :param queue_size: max files waiting between two stages, bounds
+                           the parsed dataframes in memory
+        :param rate: max download requests per second, one every 2
+                     seconds by default as fxmc.get_files
+        :param retries: extra tries for each download
+        """
+        self.provider = provider
+        self.into_table = into_table
+        self.retries = retries
+        self.clean_store = pathlib.Path(AlgoSettings().store_clean_fxcm())
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=download_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bucket = TokenBucket(rate=rate)
+        self.db_writers = threading.BoundedSemaphore(max_writers or
+                                                     write_workers)
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(5)]
+        q = self._queues
+        self.stages = [_Stage('Download', self._download, q[0], q[1],
+                              download_workers),
+                       _Stage('Clean', self._clean, q[1], q[2],
+                              clean_workers),
+                       _Stage('Parse', self._parse, q[2], q[3],
+                              parse_workers),
+                       _Stage('Insert', self._insert, q[3], q[4],
+                              write_workers)]
+
+    def _download(self, item):
+        """Get the original file, unless already in store
+        """
+        if item['original_path'].exists():
+            return item
+
+        for attempt in range(self.retries + 1):
+            try:
+                download_file(self.session, item['url'],
+                              item['original_path'], self.bucket)
+                logger.info('Saved file at: {}'.format(item['original_path']))
+                return item
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    logger.warning('File not in server: {}'.format(item['url']))
+                    return None
+                if attempt == self.retries:
+                    raise
+            except requests.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+            logger.warning('Retry request {}'.format(item['url']))
+            time.sleep(2 ** attempt)
+
+    def _clean(self, item):
+        """Clean the original file, unless already in store
+        """
+        if not item['clean_path'].exists():
+            clean_fxcm_file(item['original_path'], item['clean_path'])
+            logger.info('Clean file: {}'.format(item['clean_path']))
+        return item
+
+    def _parse(self, item):
+        """Validate against the database row count of pending_files and
+        parse the clean file
+        """
+        tags, data, _validation = prepare_tick_file(item['clean_path'],
+                                                    self.provider,
+                                                    self.into_table,
+                                                    item['rows_in_db'])
+        if data is None:
+            return None
+        return dict(item, tags=tags, data=data)
+
+    def _insert(self, item):
+        validation = insert_tick_data(item['clean_path'], item['tags'],
+                                      item['data'], self.into_table,
+                                      self.db_writers)
+        return {'filename': item['filename'], 'validation': validation}
+
+    def pending_files(self, final_date):
+        """Week files until final date that are not completely in the
+        original store, clean store and database.
+        The database row counts are asked in bulk, once.
+
+        :return: list of items for the first stage
+        """
+        in_db = row_counts_by_filename(table=self.into_table)
+
+        ans = []
+        for file_name, url_in in all_possible_urls(final_date).items():
+            filename = file_name[:-7]
+            clean_path = store_path_constructor(filename=filename,
+                                                dir_path=self.clean_store)
+            if url_in['file_path'].exists() and clean_path.exists():
+                manifest = read_manifest(clean_path)
+                # same tolerance as fxcm_tick_insert.insert_validation
+                if manifest is not None and filename in in_db and \
+                        abs(in_db[filename] - manifest['rows']) <= 10:
+                    continue
+
+            ans.append({'filename': filename,
+                        'url': url_in['url'],
+                        'original_path': url_in['file_path'],
+                        'clean_path': clean_path,
+                        'rows_in_db': in_db.get(filename, 0)})
+        return ans
+
+    def run(self, final_date):
+        """Update all files until final date
+
+        :param final_date: str '%Y-%m-%d'
+        :return: list of filenames that failed in some stage
+        """
+        items = self.pending_files(final_date)
+        logger.info('{} files in the pipeline'.format(len(items)))
+
+        for stage in self.stages:
+            stage.start()
+
+        # collects the results so the last queue never blocks the inserts
+        inserted = []
+        out_queue = self._queues[-1]
+
+        def collect():
+            while True:
+                result = out_queue.get()
+                if result is _END_OF_FILES:
+                    return
+                inserted.append(result)
+                logger.info('Inserted {} - {} out of {}'.format(
+                    result['filename'], len(inserted), len(items)))
+
+        collector = threading.Thread(target=collect, daemon=True)
+        collector.start()
+
+        in_queue = self._queues[0]
+        for item in items:
+            in_queue.put(item)
+        in_queue.put(_END_OF_FILES)
+
+        for stage in self.stages:
+            stage.join()
+        collector.join()
+        self.session.close()
+
+        failed = []
+        for stage in self.stages:
+            logger.info('{}: {} files done, {} failed'.format(
+                stage.name, stage.done, len(stage.failed)))
+            failed.extend(stage.failed)
+        if failed:
+            logger.error('Files not updated: {}'.format(failed))
+        return failed
+
+
+def update_all_pipelined(final_date, **kwargs):
+    """Pipelined version of fxmc.update_all followed by
+    fxcm_tick_insert.multiple_file_insert
+
+    :param final_date: date to run to
+    :param kwargs: FxcmPipeline arguments
+    """
+    time0 = datetime.datetime.now()
+    log_title('FXCM PIPELINED UPDATE')
+    FxcmPipeline(**kwargs).run(final_date)
+    logger.info('TOTAL RUNNING TIME WAS: {}'.format(
+        datetime.datetime.now() - time0))
+
+
+if __name__ == '__main__':
+    setup_logging()
+    update_all_pipelined('2018-08-31')
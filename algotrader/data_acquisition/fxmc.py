@@ -5,23 +5,36 @@ check: https://github.com/FXCMAPI/FXCMTickData
 import datetime
 import gzip
 import logging
+import multiprocessing
+import os
 import pathlib
 import re
-import sys
-
-from time import sleep
-
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+import requests.adapters
 from common.settings import AlgoSettings
+from common.utilities import atomic_write
+from data_acquisition.fxcm_manifest import ManifestBuilder
 from log.log_settings import setup_logging, log_title
 
+logger = logging.getLogger('fxcm download')
+
 # Available symbols from FXCM server.
 SYMBOLS = ['AUDCAD', 'AUDCHF', 'AUDJPY', 'AUDNZD', 'CADCHF', 'EURAUD',
            'EURCHF', 'EURGBP', 'EURJPY', 'EURUSD', 'GBPCHF', 'GBPJPY',
            'GBPNZD', 'GBPUSD', 'NZDCAD', 'NZDCHF', 'NZDJPY', 'NZDUSD',
            'USDCAD', 'USDCHF', 'USDJPY']
 
+# Suffix of the files being downloaded
+PART_SUFFIX = '.part'
+
+# Bytes of an original file cleaned at a time
+CLEAN_CHUNK_SIZE = 1024 * 1024
+
 
 def in_store(store_path):
     """Return list of files that match the predefined REGEX inside the
@@ -126,64 +139,261 @@ def definitive_urls(overwrite, end_date):
     return possible_urls
 
 
-def get_files(urls):
-    """Get the files for a set of urls from fxcm server
+class TokenBucket:
+    """Rate limit shared by the download threads: rate requests per second
+    on average, bursts of up to capacity requests.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Wait until a request is allowed
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """Size of a download not the size sent by the server, worth a retry
+    """
+
+
+def _content_range_total(response):
+    """Total size in a Content-Range header 'bytes start-end/total' or
+    'bytes */total', None if missing or unknown
+    """
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _expected_size(response, resume_from):
+    """Size of the complete file as sent by the server, None if unknown
+    """
+    if response.status_code == 206:
+        start = response.headers.get('Content-Range', '').split(' ')[-1]
+        if not start.startswith('{}-'.format(resume_from)):
+            raise IncompleteDownload('Range not resumed at {}: {}'.format(
+                resume_from, response.headers.get('Content-Range')),
+                response=response)
+        return _content_range_total(response)
+
+    # a compressed body is decoded, its length is not the file size
+    length = response.headers.get('Content-Length', '')
+    if response.headers.get('Content-Encoding', 'identity') != 'identity' \
+            or not length.isdigit():
+        return None
+    return int(length)
+
+
+def download_file(session, url, file_path, bucket, timeout=60,
+                  chunk_size=64 * 1024):
+    """Download a file into a temp file, renamed to file_path when
+    complete. A temp file left by a previous try is resumed with a Range
+    request.
+
+    The temp file is renamed only if its size is the size sent by the
+    server, otherwise it is kept to be resumed and IncompleteDownload is
+    raised.
+
+    :param session: requests.Session shared by the threads
+    :param bucket: TokenBucket rate limit
+    :return: file path
+    """
+    file_path = pathlib.Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = file_path.with_suffix(PART_SUFFIX)
+
+    headers = {}
+    resume_from = part_path.stat().st_size if part_path.exists() else 0
+    if resume_from:
+        headers['Range'] = 'bytes={}-'.format(resume_from)
+
+    bucket.take()
+    with session.get(url, headers=headers, timeout=timeout,
+                     stream=True) as r:
+        if r.status_code == 416 and resume_from:
+            # the temp file may already have all the data
+            expected = _content_range_total(r)
+            if expected != resume_from:
+                os.remove(part_path)
+                raise IncompleteDownload(
+                    'Temp file of {} bytes, file of {} bytes in '
+                    'server: {}'.format(resume_from, expected, url),
+                    response=r)
+            os.replace(part_path, file_path)
+            return file_path
+        r.raise_for_status()
+
+        try:
+            expected = _expected_size(r, resume_from)
+        except IncompleteDownload:
+            if resume_from:
+                os.remove(part_path)
+            raise
+
+        # servers without Range support send the whole file again
+        mode = 'ab' if r.status_code == 206 else 'wb'
+        with open(part_path, mode) as f:
+            for chunk in r.iter_content(chunk_size):
+                f.write(chunk)
+
+    size = part_path.stat().st_size
+    if expected is not None and size != expected:
+        if size > expected:
+            # can not be resumed
+            os.remove(part_path)
+        raise IncompleteDownload('Got {} bytes out of {}: {}'.format(
+            size, expected, url))
+
+    os.replace(part_path, file_path)
+    return file_path
+
+
+def get_files(urls, workers=4, rate=0.5, retries=3):
+    """Get the files for a set of urls from fxcm server, concurrently with
+    at most workers requests in flight over one keep-alive session.
+
+    Files that fail are queued and retried after the others, up to
+    retries more times. Missing files (404) are not retried.
 
     :param urls: dic with url and saving paths
-    :return:
+    :param workers: max number of requests in flight
+    :param rate: max requests per second, all workers together, one
+                 every 2 seconds by default
+    :param retries: extra tries for each failed file
+    :return: list of keys of the files not downloaded
     """
     logger.info('Request for files started. '
                 '{} files in queue'.format(len(urls)))
 
-    # Run for every file
-    for key in urls:
-        dir_path = urls[key]['dir_path']
-        file_path = urls[key]['file_path']
-        url = urls[key]['url']
-
-        # Recursively creates the directory and does not raise an exception if
-        # the directory already exists. See: https://goo.gl/rn3q4E
-        pathlib.Path(dir_path).mkdir(parents=True, exist_ok=True)
-        # Check for the created directory.
-        if not pathlib.Path.is_dir(dir_path):
-            logger.exception("Error creating "
-                             "the directory: {}".format(dir_path))
-            sys.exit(-1)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    bucket = TokenBucket(rate=rate)
+
+    queue = list(urls)
+    failed = []
+    total = len(queue)
+    done = 0
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        for attempt in range(retries + 1):
+            if attempt:
+                logger.warning('Retrying {} files, '
+                               'try {}'.format(len(queue), attempt))
+                time.sleep(2 ** attempt)
+
+            futures = {executor.submit(download_file,
+                                       session,
+                                       urls[key]['url'],
+                                       urls[key]['file_path'],
+                                       bucket): key for key in queue}
+            retry_queue = []
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    file_path = future.result()
+                except requests.exceptions.HTTPError as e:
+                    if e.response is not None and e.response.status_code == 404:
+                        logger.warning('File not in server: {}'.format(
+                            urls[key]['url']))
+                        failed.append(key)
+                    else:
+                        logger.warning('Error requesting: {} - {}'.format(
+                            urls[key]['url'], e))
+                        retry_queue.append(key)
+                    continue
+                except (requests.exceptions.RequestException, OSError) as e:
+                    logger.warning('Error requesting: {} - {}'.format(
+                        urls[key]['url'], e))
+                    retry_queue.append(key)
+                    continue
+
+                done += 1
+                logger.info('Saved file at: {}'.format(file_path))
+                logger.info('Doing {} out of {} - '
+                            '{:.3%}'.format(done, total, done / total))
+
+            queue = retry_queue
+            if not queue:
+                break
+
+    failed.extend(queue)
+    if failed:
+        logger.error('{} files not downloaded: {}'.format(len(failed),
+                                                          failed))
+    logger.info('All files processed')
+    return failed
+
 
-        try:
-            sleep(2)
-            # make the request
-            logger.info('Requesting: {}'.format(url))
-            r = requests.get(url, timeout=60)
-            logger.info('Response status: {}'.format(r.status_code))
-
-            # Save the file
-            if r.status_code == 200:
-                logger.info('Saving file at: {}'.format(file_path))
-                # save the file in chunks
-                chunk_size = 5000
-                with open(file_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size):
-                        f.write(chunk)
-            else:
-                logger.exception('Could not get '
-                                 'file: {} - '
-                                 'status {}'.format(file_path,
-                                                    r.status_code))
-                sys.exit(-1)
-        except requests.exceptions.RequestException:
-            logger.exception('Error requesting: {}'.format(url))
-            sys.exit(-1)
+def clean_fxcm_file(original_file_path, clean_file_path,
+                    chunk_size=CLEAN_CHUNK_SIZE):
+    """Clean an original FXCM file into the clean store, chunk by chunk:
+    NUL bytes are stripped from the binary data, with no decoding and
+    without the whole file in memory. Writes the manifest of the clean
+    file.
 
-    logger.info('All files processed')
+    :return: clean file path
+    """
+    clean_file_path = pathlib.Path(clean_file_path)
+    clean_file_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # a clean file is always complete, even with other writers of it
+    manifest = ManifestBuilder()
+    with atomic_write(clean_file_path) as f, \
+            gzip.open(original_file_path, 'rb') as f_in, \
+            gzip.open(f, 'wb') as f_out:
+        for chunk in iter(lambda: f_in.read(chunk_size), b''):
+            chunk = chunk.replace(b'\x00', b'')
+            f_out.write(chunk)
+            manifest.update(chunk)
 
-def clean_fxcm_originals(original_dirpath, clean_dirpath):
+    # row count and time bounds for validations, no rescan needed
+    manifest.write(clean_file_path)
+    return clean_file_path
+
+
+def _clean_fxcm_file_worker(paths):
+    """clean_fxcm_file for the process pool, a bad file does not stop the
+    others
+
+    :return: (original file path, clean file path or None on error)
+    """
+    original_file_path, clean_file_path = paths
+    try:
+        return original_file_path, clean_fxcm_file(original_file_path,
+                                                   clean_file_path)
+    except (OSError, EOFError, zlib.error):
+        # truncated or corrupt download, nothing left in the clean store
+        logger.exception('Error cleaning {}'.format(original_file_path))
+        return original_file_path, None
+
+
+def clean_fxcm_originals(original_dirpath, clean_dirpath, workers=1):
     """
     FXCM file come with invalid characters '\x00' that you must clean first
     https://goo.gl/1zoTST
 
-    Returns: clean csv.gz file
+    Files already in the clean store are skipped. With workers > 1 files
+    are cleaned by a pool of worker processes. Files that can not be
+    cleaned are logged and skipped.
+
+    Returns: list of the original files that could not be cleaned
 
     """
     # Get the file list of the original downloads
@@ -193,44 +403,45 @@ def clean_fxcm_originals(original_dirpath, clean_dirpath):
 
     # Get the file list of the clean files, if any.
     clean_dir_path = pathlib.Path(clean_dirpath)
-    clean_files = list(clean_dir_path.glob('**/*.gz'))
+    clean_files = set(clean_dir_path.glob('**/*.gz'))
 
-    counter = 0
+    tasks = []
     for each_file in original_files:
         # get the components of the path
         path_parts = pathlib.Path(each_file).parts
         # Create a new path in clean directory
         clean_file_path = clean_dir_path / path_parts[-3] / path_parts[-2] / path_parts[-1]
-        # Get the new parent
-        new_parent_dir = pathlib.Path(clean_file_path).parent
 
         if clean_file_path not in clean_files:
-            # Recursively creates the directory and does not raise an
-            # exception if the directory already exists.
-            # See: https://goo.gl/rn3q4E
-            pathlib.Path(new_parent_dir).mkdir(parents=True, exist_ok=True)
+            tasks.append((each_file, clean_file_path))
 
-            # Open, clean and creates a new file
-            with gzip.open(each_file, 'rb') as f:
-                data = f.read()
+    logger.info('{} out of {} files already in store'.format(
+        total_original_files - len(tasks), total_original_files))
 
-            with gzip.open(clean_file_path, 'wb') as f:
-                f.write(
-                    data.decode('utf-8').replace('\x00', '').encode('utf-8'))
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap_unordered(_clean_fxcm_file_worker, tasks)
+    else:
+        pool = None
+        results = map(_clean_fxcm_file_worker, tasks)
 
-            counter += 1
+    failed = []
+    try:
+        for counter, (each_file, result) in enumerate(results, 1):
             logger.info('Doing {} out of {} - '
-                        '{:.3%}'.format(counter,
-                                        total_original_files,
-                                        counter / total_original_files))
-            logger.info('Clean file: {}'.format(clean_file_path))
-        else:
-            counter += 1
-            logger.info('Doing {} '
-                        'out of {} - '
-                        '{:.3%}'.format(counter, total_original_files,
-                                        counter / total_original_files))
-            logger.info('File {} already in store'.format(clean_file_path))
+                        '{:.3%}'.format(counter, len(tasks),
+                                        counter / len(tasks)))
+            if result is None:
+                failed.append(each_file)
+            else:
+                logger.info('Clean file: {}'.format(result))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if failed:
+        logger.error('Files not cleaned: {}'.format(failed))
+    return failed
 
 
 def update_all(final_date):
@@ -247,12 +458,12 @@ def update_all(final_date):
     get_files(urls)
 
     clean_fxcm_originals(original_dirpath=AlgoSettings().store_originals_fxcm(),
-                         clean_dirpath=AlgoSettings().store_clean_fxcm())
+                         clean_dirpath=AlgoSettings().store_clean_fxcm(),
+                         workers=multiprocessing.cpu_count())
 
 
 if __name__ == '__main__':
     setup_logging()
-    logger = logging.getLogger('fxcm download')
 
     my_date = '2018-08-31'
     update_all(my_date)
@@ -9,18 +9,22 @@ https://www.dataquest.io/blog/pandas-big-data/
 
 import datetime
 import logging
+import multiprocessing
 import pathlib
 from collections import OrderedDict
-from gzip import open as opengz
 
+import numpy as np
 import pandas as pd
 from pytz import utc
 
 import databases.influx_manager as db_man
 from common.settings import AlgoSettings
+from data_acquisition.fxcm_manifest import row_count as csv_row_count
 from data_acquisition.fxmc import in_store
 from log.log_settings import setup_logging, log_title
 
+logger = logging.getLogger('fxcm data insert')
+
 
 def series_by_filename(tag, clean_store_dirpath):
     """Returns dictionary with path for files already in database, as defined
@@ -51,6 +55,33 @@ def series_by_filename(tag, clean_store_dirpath):
     return ans
 
 
+def row_counts_by_filename(table, page_size=500):
+    """Number of rows in database of each filename tag of a table, in one
+    grouped query per page of page_size filenames.
+
+    :param table: table name
+    :param page_size: filenames per query
+    :return: {filename: row_count}
+    """
+    ans = OrderedDict()
+    offset = 0
+    while True:
+        cql = 'SELECT COUNT(bid) ' \
+              'FROM {} ' \
+              'GROUP BY filename ' \
+              'SLIMIT {} SOFFSET {}'.format(table,
+                                            page_size,
+                                            offset)
+        cql_response = db_man.influx_qry(cql).items()
+
+        for (_table, tags), points in cql_response:
+            ans[tags['filename']] = next(points)['count']
+
+        if len(cql_response) < page_size:
+            return ans
+        offset += page_size
+
+
 def series_by_filename_row(table, clean_store_dirpath, abs_tolerance=10):
     """Returns dictionary with path for files already in database, as defined
     as filename tag present and checking row_count in database vs CSV
@@ -60,25 +91,21 @@ def series_by_filename_row(table, clean_store_dirpath, abs_tolerance=10):
     :param abs_tolerance:
     :return: {filename: {row_count, filepath}
     """
-    # Get the filename tags in the database
-    tags_by_filename = \
-        series_by_filename(tag='filename',
-                           clean_store_dirpath=clean_store_dirpath)
+    # Row count of every filename in the database, in bulk
+    counts_by_filename = row_counts_by_filename(table=table)
 
     # For each series in database
-    ans = dict()
-    for each_filename, each_path in tags_by_filename.items():
-        # query row count
-        cql = 'SELECT COUNT(bid) ' \
-              'FROM {} ' \
-              'WHERE filename=\'{}\''.format(table,
-                                             each_filename)
-        cql_response = db_man.influx_qry(cql).items()
-
-        row_count_db = next(cql_response[0][1])['count']
-        # get row count in csv
-
-        row_count_csv = sum(1 for _r in opengz(each_path, 'r')) - 1
+    ans = OrderedDict()
+    for each_filename, row_count_db in counts_by_filename.items():
+        each_path = store_path_constructor(filename=each_filename,
+                                           dir_path=clean_store_dirpath)
+        # get row count in csv, from its manifest
+        try:
+            row_count_csv = csv_row_count(each_path)
+        except FileNotFoundError:
+            logger.warning('{} in database but not in store'.format(
+                each_filename))
+            continue
 
         # compare the two results
         difference = abs(row_count_db - row_count_csv)
@@ -129,19 +156,83 @@ def prepare_for_securities_master(file_path):
                          sep=',',
                          skiprows=1,
                          names=['price_datetime', 'bid', 'ask'],
-                         parse_dates=[0],
-                         date_parser=my_date_parser,
-                         index_col=[0],
                          float_precision='high',
                          engine='c')
     except OSError:
         logger.exception('Error reading file {}'.format(filename))
         raise SystemError
 
+    df.index = pd.DatetimeIndex(fxcm_datetime_parser(df.pop('price_datetime')),
+                                name='price_datetime').tz_localize(utc)
+
     logger.info('File: {} ready for insert'.format(filename))
     return df
 
 
+def fxcm_datetime_parser(column):
+    """Vectorized parse of a whole column of FXCM datetimes
+    'MM/DD/YYYY HH:MM:SS.fff' into datetime64[ns] UTC, without a Python call
+    per row. Strings are sliced as bytes into integer arrays.
+
+    Strings of any other width or format, as a longer fraction of second,
+    are parsed by pandas.to_datetime instead.
+
+    :param column: array/Series of strings
+    :return: datetime64[ns] array, naive UTC
+    """
+    values = np.asarray(column)
+    try:
+        # sized to the longest string, a fixed width would cut longer ones
+        strings = values.astype('S')
+    except UnicodeEncodeError:
+        return _fxcm_datetime_fallback(values)
+    if strings.dtype.itemsize != 23 or \
+            not _fxcm_datetime_format(strings.view(np.uint8).reshape(-1, 23)):
+        return _fxcm_datetime_fallback(values)
+
+    digits = strings.view(np.uint8).reshape(-1, 23).astype(np.int64) - 48
+
+    def number(start, end):
+        ans = digits[:, start]
+        for i in range(start + 1, end):
+            ans = ans * 10 + digits[:, i]
+        return ans
+
+    years = (number(6, 10) - 1970).astype('datetime64[Y]')
+    months = years.astype('datetime64[M]') + (number(0, 2) - 1)
+    days = months.astype('datetime64[D]') + (number(3, 5) - 1)
+
+    return (days.astype('datetime64[ns]') +
+            number(11, 13).astype('timedelta64[h]') +
+            number(14, 16).astype('timedelta64[m]') +
+            number(17, 19).astype('timedelta64[s]') +
+            number(20, 23).astype('timedelta64[ms]'))
+
+
+def _fxcm_datetime_fallback(values):
+    """Parse of FXCM datetimes not in the fixed width format
+    """
+    times = pd.to_datetime(values, format='%m/%d/%Y %H:%M:%S.%f')
+    return times.values.astype('datetime64[ns]')
+
+
+# Separators of 'MM/DD/YYYY HH:MM:SS.fff' by position, digits elsewhere
+_FXCM_SEPARATORS = {2: b'/', 5: b'/', 10: b' ', 13: b':', 16: b':', 19: b'.'}
+_FXCM_DIGITS = np.array([i not in _FXCM_SEPARATORS for i in range(23)])
+
+
+def _fxcm_datetime_format(chars):
+    """True if every row of chars, the bytes of one string each, has the
+    digits and separators of an FXCM datetime. Rows of shorter strings are
+    padded with zeros and fail.
+    """
+    for position, separator in _FXCM_SEPARATORS.items():
+        if not (chars[:, position] == ord(separator)).all():
+            return False
+    # bytes below '0' wrap around to large numbers
+    return bool((((chars - 48) < 10) == _FXCM_DIGITS).all())
+
+
 def my_date_parser(date_string):
     """Manual date parse
     from '%Y-%m-%d %H:%M:%s.%f'  to datetime UTC
@@ -158,28 +249,35 @@ def my_date_parser(date_string):
                              tzinfo=utc)
 
 
-def insert_validation(filepath, table, tags, abs_tolerance=10):
+def insert_validation(filepath, table, tags, abs_tolerance=10,
+                      rows_in_db=None):
     """Validate number of rows: CSV vs Database
-    """
-    client = db_man.influx_client(client_type='dataframe', user_type='reader')
 
+    :param rows_in_db: rows of the file in database if already known, as
+                       from row_counts_by_filename, 0 if not in database.
+                       None to ask the database.
+    """
     filename = tags['filename']
     symbol = tags['symbol']
     provider = tags['provider']
-    row_count = sum(1 for _r in opengz(filepath, 'r')) - 1
-
-    cql = 'SELECT COUNT(bid) FROM {} ' \
-          'WHERE filename=\'{}\' ' \
-          'AND symbol=\'{}\' ' \
-          'AND provider=\'{}\''.format(table,
-                                       filename,
-                                       symbol,
-                                       provider)
-
-    try:
-        rows_in_db = client.query(query=cql)[table]['count'].iloc[0]
-        client.close()
-    except KeyError:
+    row_count = csv_row_count(filepath)
+
+    if rows_in_db is None:
+        client = db_man.pooled_client(client_type='dataframe',
+                                      user_type='reader')
+        cql = 'SELECT COUNT(bid) FROM {} ' \
+              'WHERE filename=\'{}\' ' \
+              'AND symbol=\'{}\' ' \
+              'AND provider=\'{}\''.format(table,
+                                           filename,
+                                           symbol,
+                                           provider)
+        try:
+            rows_in_db = client.query(query=cql)[table]['count'].iloc[0]
+        except KeyError:
+            rows_in_db = 0
+
+    if not rows_in_db:
         logger.info('Data from {} not in database'.format(filename))
         return {'value': 'Not in DB', 'csv': row_count,
                 'sec_master': 0, 'diff': row_count}
@@ -227,8 +325,9 @@ def get_files_to_load(dir_path, table, overwrite, validation_type='fast'):
 
         # Deletes last inserted series. this is done for safety,
         # because if last time the loading function was stopped then
-        # the last series could be incomplete.
-        if already_in_db:
+        # the last series could be incomplete. The full validation already
+        # deleted every incomplete series.
+        if already_in_db and validation_type == 'fast':
             last_insert = list(already_in_db.keys())[-1]
             db_man.delete_series(tags={'filename': last_insert})
             del already_in_db[last_insert]
@@ -248,83 +347,181 @@ def get_files_to_load(dir_path, table, overwrite, validation_type='fast'):
     return files
 
 
+def prepare_tick_file(each_file, provider, into_table, rows_in_db=None):
+    """Validate and parse a .gz file with tick data from FXCM.
+
+    :param rows_in_db: see insert_validation
+    :return: (tags, dataframe ready for insert, validation dictionary),
+             dataframe is None if the data already is in database
+    """
+    # Get some basic information about the data
+    symbol = each_file.parts[-1][:6]
+    filename = each_file.parts[-1][:-7]
+    tags = {'symbol': symbol,
+            'provider': provider,
+            'filename': filename}
+    logger.info('Working on {}'.format(filename))
+
+    # Validate if data already is in securities master database.
+    # Number of data points in CSV must be similar (+/- tolerance)
+    # to database to be considered as already inserted.
+    pre_validation = insert_validation(filepath=each_file,
+                                       table=into_table,
+                                       tags=tags,
+                                       rows_in_db=rows_in_db)
+
+    if pre_validation['value'] == 'Exact' or \
+            pre_validation['value'] == 'Acceptable':
+        logger.info('Data for {} already in database:'
+                    ' {} data points with {} '
+                    'difference'.format(filename,
+                                        pre_validation['sec_master'],
+                                        pre_validation['diff']))
+        return tags, None, pre_validation
+
+    # turn the CSV into a dataframe ready for insert
+    data = prepare_for_securities_master(file_path=each_file)
+    return tags, data, pre_validation
+
+
+def insert_tick_data(each_file, tags, data, into_table, db_writers=None):
+    """Insert the parsed ticks of a file into the database and validate
+
+    :param db_writers: semaphore capping the number of writers into the
+                       database at the same time, None for no cap
+    :return: validation dictionary of the file
+    """
+    filename = tags['filename']
+    if db_writers is not None:
+        db_writers.acquire()
+    try:
+        # deletes series with same tags if already in database
+        db_man.delete_series(tags=tags)
+
+        # insert the data to sec master database
+        db_man.influx_line_writer(data=data,
+                                  tags=tags,
+                                  into_table=into_table,
+                                  field_columns=['bid', 'ask'])
+    finally:
+        if db_writers is not None:
+            db_writers.release()
+
+    # Performance post insert validation that data is ok in database
+    # Influx has some trouble with the milliseconds and sometimes
+    # drops some data. Some tolerance is acceptable.
+    # Check the validation function for info.
+    post_validation = insert_validation(filepath=each_file,
+                                        table=into_table,
+                                        tags=tags)
+
+    # Post validation of inserted data
+    if post_validation['value'] == 'Exact' or \
+            post_validation['value'] == 'Acceptable':
+        logger.info('Successful insert '
+                    'for {}: {} '
+                    'data points with {} '
+                    'difference'.format(filename,
+                                        post_validation['sec_master'],
+                                        post_validation['diff']))
+    else:
+        logger.error('Error insert for {}: {} '
+                     'difference'.format(filename,
+                                         post_validation['diff']))
+    return post_validation
+
+
+def load_tick_file(each_file, provider, into_table, db_writers=None,
+                   rows_in_db=None):
+    """Validate, parse and insert into the database a .gz file with tick
+    data from FXCM.
+
+    :param db_writers: see insert_tick_data
+    :param rows_in_db: see insert_validation
+    :return: validation dictionary of the file
+    """
+    tags, data, pre_validation = prepare_tick_file(each_file, provider,
+                                                   into_table, rows_in_db)
+    if data is None:
+        return pre_validation
+    return insert_tick_data(each_file, tags, data, into_table, db_writers)
+
+
+def _load_tick_file_worker(args):
+    """load_tick_file for the process pool, errors are logged not raised
+    so one bad file does not stop the others.
+
+    :return: validation dictionary, value 'Error' if the load failed
+    """
+    each_file, provider, into_table, db_writers, rows_in_db = args
+    try:
+        return load_tick_file(each_file, provider, into_table, db_writers,
+                              rows_in_db)
+    except Exception:
+        logger.exception('Error insert for {}'.format(each_file))
+        return {'value': 'Error', 'csv': None,
+                'sec_master': None, 'diff': None}
+
+
 def load_multiple_tick_files(dir_path, provider, into_table, overwrite=False,
-                             validation_type='fast'):
+                             validation_type='fast', workers=1,
+                             max_writers=None):
     """ Iterates over a directory and load all the .gz files with tick data
     from FXCM.
     Files must math REGEX: "^[A-Z]{6}_20\\d{1,2}_\\d{1,2}.csv.gz"
+
+    With workers > 1 the files are parsed and inserted by a pool of worker
+    processes, with at most max_writers (default: workers) of them writing
+    into the database at the same time. The cap is a manager semaphore
+    passed with each file, so it works whatever the start method of the
+    processes.
+    Files being inserted in parallel when a previous run stopped could be
+    incomplete, not only the last one, so workers > 1 needs the 'full'
+    validation: all the files in database are validated by row count, in
+    bulk, and incomplete ones deleted.
     """
+    if workers > 1 and not overwrite and validation_type != 'full':
+        raise ValueError('Parallel load needs validation_type=\'full\', '
+                         'got \'{}\''.format(validation_type))
 
     files = get_files_to_load(dir_path=dir_path,
                               overwrite=overwrite,
                               validation_type=validation_type,
                               table=into_table)
 
-    # Loop each file in directory
-    for each_file in files:
-        # Get some basic information about the data
-        symbol = each_file.parts[-1][:6]
-        filename = each_file.parts[-1][:-7]
-        tags = {'symbol': symbol,
-                'provider': provider,
-                'filename': filename}
-        logger.info('Working on {}'.format(filename))
-
-        # Validate if data already is in securities master database.
-        # Number of data points in CSV must be similar (+/- tolerance)
-        # to database to be considered as already inserted.
-        pre_validation = insert_validation(filepath=each_file,
-                                           table=into_table,
-                                           tags=tags)
-
-        if pre_validation['value'] == 'Not Acceptable' or \
-                pre_validation['value'] == 'Not in DB':
-            # deletes series with same tags if already in database
-            db_man.delete_series(tags=tags)
-            # turn the CSV into a dataframe ready for insert
-            data = prepare_for_securities_master(file_path=each_file)
-
-            # insert the data to sec master database
-            db_man.influx_writer(data=data,
-                                 tags=tags,
-                                 into_table=into_table,
-                                 field_columns=['bid', 'ask'])
-
-            # Performance post insert validation that data is ok in database
-            # Influx has some trouble with the milliseconds and sometimes
-            # drops some data. Some tolerance is acceptable.
-            # Check the validation function for info.
-            post_validation = insert_validation(filepath=each_file,
-                                                table=into_table,
-                                                tags=tags)
-
-            # Post validation of inserted data
-            if post_validation['value'] == 'Exact' or \
-                    post_validation['value'] == 'Acceptable':
-                logger.info('Successful insert '
-                            'for {}: {} '
-                            'data points with {} '
-                            'difference'.format(filename,
-                                                post_validation['sec_master'],
-                                                post_validation['diff']))
-            else:
-                logger.error('Error insert for {}: {} '
-                             'difference'.format(filename,
-                                                 post_validation['diff']))
-
-        else:
-            logger.info('Data for {} already in database:'
-                        ' {} data points with {} '
-                        'difference'.format(filename,
-                                            pre_validation['sec_master'],
-                                            pre_validation['diff']))
+    # The files left are not in the database, or their incomplete series
+    # were deleted: no need to count their rows in database again
+    rows_in_db = None if overwrite else 0
+
+    if workers > 1:
+        failed = 0
+        with multiprocessing.Manager() as manager, \
+                multiprocessing.Pool(processes=workers) as pool:
+            db_writers = manager.BoundedSemaphore(max_writers or workers)
+            tasks = [(each_file, provider, into_table, db_writers,
+                      rows_in_db) for each_file in files]
+            for counter, result in enumerate(
+                    pool.imap_unordered(_load_tick_file_worker, tasks), 1):
+                if result['value'] == 'Error':
+                    failed += 1
+                logger.info('Done {} out of {} files'.format(counter,
+                                                            len(tasks)))
+        if failed:
+            logger.error('{} files failed to insert'.format(failed))
+    else:
+        # Loop each file in directory
+        for each_file in files:
+            load_tick_file(each_file, provider, into_table,
+                           rows_in_db=rows_in_db)
 
     logger.info('All data files processed!')
 
 
-def multiple_file_insert():
+def multiple_file_insert(workers=1, max_writers=None):
     """Main function for data insert of multiple files.
 
+    :param workers: number of worker processes
+    :param max_writers: max number of workers writing at the same time
     :return:
     """
     store = pathlib.Path(AlgoSettings().store_clean_fxcm())
@@ -336,12 +533,14 @@ def multiple_file_insert():
                              provider='fxcm',
                              into_table='fx_ticks',
                              overwrite=False,
-                             validation_type='fast')
+                             validation_type=('full' if workers > 1
+                                              else 'fast'),
+                             workers=workers,
+                             max_writers=max_writers)
     time1 = datetime.datetime.now()
     logger.info('TOTAL RUNNING TIME WAS: {}'.format(time1 - time0))
 
 
 if __name__ == '__main__':
     setup_logging()
-    logger = logging.getLogger('fxcm data insert')
     multiple_file_insert()
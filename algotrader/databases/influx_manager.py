@@ -2,9 +2,16 @@
 """
 Manage the connections to Influx Server
 """
+import atexit
+import gzip
 import logging
+import os
+import threading
+import time
+import weakref
 
-
+import numpy as np
+import requests
 from influxdb import DataFrameClient
 from influxdb import InfluxDBClient
 from influxdb.exceptions import InfluxDBServerError, InfluxDBClientError
@@ -42,6 +49,117 @@ def influx_client(client_type='client', user_type='reader'):
     return client
 
 
+def _close_clients(clients):
+    """Close a dictionary of clients and empty it
+    """
+    for client in clients.values():
+        client.close()
+    clients.clear()
+
+
+class _ThreadClients:
+    """Clients of one thread. Closed when the thread ends, as its local data
+    is then dropped, so short lived threads do not leak sessions.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.finalizer = weakref.finalize(self, _close_clients, self.clients)
+
+
+class InfluxClientPool:
+    """Process wide pool of InfluxDB clients, so HTTP sessions are kept
+    alive and reused across calls instead of opened and closed each time.
+
+    There is one client by client type and user type in each thread, kept
+    in thread local data, as the underlying requests session is not shared
+    between threads. The clients of a thread are closed when it ends. A
+    forked process starts with an empty pool, the sockets of the parent are
+    never used nor closed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # _ThreadClients of the live threads
+        self._threads = weakref.WeakSet()
+        self._pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+
+    def get(self, client_type='client', user_type='reader'):
+        """Pooled client of the calling thread, instantiated on first use.
+
+        :param client_type: 'client' / 'dataframe'
+        :param user_type: 'reader' / 'writer' / 'admin'
+        """
+        key = (client_type, user_type)
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: drop the clients of the parent without closing
+                for thread_clients in self._threads:
+                    thread_clients.finalizer.detach()
+                self._local = threading.local()
+                self._threads = weakref.WeakSet()
+                self._pid = os.getpid()
+                self.opened = 0
+                self.reused = 0
+            local = self._local
+
+        thread_clients = getattr(local, 'clients', None)
+        if thread_clients is None:
+            thread_clients = _ThreadClients()
+            local.clients = thread_clients
+            with self._lock:
+                self._threads.add(thread_clients)
+
+        client = thread_clients.clients.get(key)
+        if client is not None:
+            with self._lock:
+                self.reused += 1
+            return client
+
+        client = influx_client(client_type=client_type, user_type=user_type)
+        thread_clients.clients[key] = client
+        with self._lock:
+            self.opened += 1
+        return client
+
+    def stats(self):
+        """Counters of connections opened versus reused
+        """
+        return {'opened': self.opened, 'reused': self.reused}
+
+    def close_all(self):
+        """Close the clients of all the threads
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            threads = list(self._threads)
+
+        closed = 0
+        for thread_clients in threads:
+            closed += len(thread_clients.clients)
+            _close_clients(thread_clients.clients)
+        if closed:
+            logging.info('Influx clients closed. {} opened, '
+                         '{} reused'.format(self.opened, self.reused))
+
+
+CLIENT_POOL = InfluxClientPool()
+atexit.register(CLIENT_POOL.close_all)
+
+
+def pooled_client(client_type='client', user_type='reader'):
+    """Client from the process wide pool. Do not close it.
+
+    :param client_type: 'client' / 'dataframe'
+    :param user_type: 'reader' / 'writer' / 'admin'
+    """
+    return CLIENT_POOL.get(client_type=client_type, user_type=user_type)
+
+
 def db_server_info():
     """Print out info about the Influx database
 
@@ -87,9 +205,8 @@ def influx_qry(cql, client_type='client', user_type='reader'):
 
     """
     try:
-        client = influx_client(client_type=client_type, user_type=user_type)
+        client = pooled_client(client_type=client_type, user_type=user_type)
         response = client.query(cql)
-        client.close()
     except (InfluxDBServerError, InfluxDBClientError):
         logging.exception('Can not query the database')
         raise SystemError
@@ -105,7 +222,7 @@ def influx_writer(data, field_columns, tags, into_table):
                                                       into_table))
     protocol = 'json'
     try:
-        client = influx_client(client_type='dataframe', user_type='writer')
+        client = pooled_client(client_type='dataframe', user_type='writer')
         client.write_points(dataframe=data,
                             measurement=into_table,
                             protocol=protocol,
@@ -114,22 +231,152 @@ def influx_writer(data, field_columns, tags, into_table):
                             time_precision='u',
                             numeric_precision='full',
                             batch_size=10000)
-        client.close()
         logging.info('Data insert OK!')
     except (InfluxDBServerError, InfluxDBClientError):
         logging.exception('Error data insert - {}'.format(tags.values()))
         raise SystemError
 
 
+# Time units of the line protocol precisions, in nanoseconds
+PRECISION_NS = {'n': 1, 'u': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9}
+
+
+# Characters escaped in measurement names, tag keys and tag values, the
+# backslash first
+_ESCAPES = (('\\', '\\\\'), (',', '\\,'), ('=', '\\='), (' ', '\\ '),
+            ('\n', '\\n'))
+
+
+def _escape_key(key):
+    """Escape measurement names, tag keys and tag values for line protocol
+    """
+    key = str(key)
+    for char, escaped in _ESCAPES:
+        key = key.replace(char, escaped)
+    return key
+
+
+def _escape_array(values):
+    """Escape an array of tag values for line protocol
+    """
+    values = np.asarray(values).astype(str)
+    for char, escaped in _ESCAPES:
+        values = np.char.replace(values, char, escaped)
+    return values
+
+
+def line_protocol(data, field_columns, tags, into_table, time_precision='u',
+                  tag_columns=None):
+    """Build the InfluxDB line protocol payload of a dataframe column by
+    column, without a Python dictionary per row.
+
+    :param data: dataframe with a DatetimeIndex
+    :param field_columns: columns to write as fields
+    :param tags: dictionary with the tags common to all rows
+    :param into_table: measurement
+    :param time_precision: 'n' / 'u' / 'ms' / 's'
+    :param tag_columns: columns to write as tags, one value per row
+    :return: str, one line per row. NaN and infinite values are left out of
+             their row, as Influx rejects them, and rows left without any
+             field are dropped.
+    """
+    tag_columns = tag_columns or []
+    prefix = _escape_key(into_table)
+    for key in sorted(list(tags) + list(tag_columns)):
+        if key in tag_columns:
+            prefix = np.char.add(prefix + ',{}='.format(_escape_key(key)),
+                                 _escape_array(data[key].values))
+        else:
+            prefix = np.char.add(prefix, ',{}={}'.format(_escape_key(key),
+                                                         _escape_key(tags[key])))
+    prefix = np.char.add(prefix, ' ')
+
+    fields = np.full(len(data), '')
+    for column in field_columns:
+        values = data[column].values
+        text = values.astype(str)
+        if values.dtype.kind in 'iu':
+            text = np.char.add(text, 'i')
+        text = np.char.add(_escape_key(column) + '=', text)
+        if values.dtype.kind == 'f':
+            text[~np.isfinite(values)] = ''
+        # comma only between two fields present in the row
+        separator = np.where((fields != '') & (text != ''), ',', '')
+        fields = np.char.add(np.char.add(fields, separator), text)
+
+    times = data.index.values.astype('datetime64[ns]').astype(np.int64)
+    times = (times // PRECISION_NS[time_precision]).astype(str)
+    lines = np.char.add(np.char.add(np.char.add(prefix, fields), ' '), times)
+    return '\n'.join(lines[fields != ''].tolist())
+
+
+def influx_line_writer(data, field_columns, tags, into_table,
+                       batch_size=50000, retries=3, tag_columns=None):
+    """High throughput database writer. Sends the dataframe as gzipped line
+    protocol in batches of batch_size points, retrying a batch on server or
+    connection errors.
+
+    Same parameters as influx_writer, plus tag_columns: columns written
+    as tags, one value per row.
+    """
+    logging.info('Insert {} into table \'{}\''.format(tags.values(),
+                                                      into_table))
+    time_precision = 'u'
+    params = {'db': AlgoSettings().influx_config()['database'],
+              'precision': time_precision}
+    headers = {'Content-Type': 'application/octet-stream',
+               'Content-Encoding': 'gzip'}
+
+    client = pooled_client(client_type='client', user_type='writer')
+    t0 = time.time()
+    try:
+        for start in range(0, len(data), batch_size):
+            payload = line_protocol(data=data.iloc[start:start + batch_size],
+                                    field_columns=field_columns,
+                                    tags=tags,
+                                    into_table=into_table,
+                                    time_precision=time_precision,
+                                    tag_columns=tag_columns)
+            if not payload:
+                # no finite field in the batch
+                continue
+            payload = gzip.compress(payload.encode('utf-8'), compresslevel=1)
+
+            for attempt in range(retries + 1):
+                try:
+                    client.request(url='write',
+                                   method='POST',
+                                   params=params,
+                                   data=payload,
+                                   expected_response_code=204,
+                                   headers=headers)
+                    break
+                except (InfluxDBServerError,
+                        requests.exceptions.RequestException):
+                    if attempt == retries:
+                        raise
+                    logging.warning('Retry data insert - {}'.format(tags.values()))
+                    time.sleep(2 ** attempt)
+
+    except (InfluxDBServerError, InfluxDBClientError,
+            requests.exceptions.RequestException):
+        logging.exception('Error data insert - {}'.format(tags.values()))
+        raise SystemError
+
+    elapsed = time.time() - t0
+    logging.info('Data insert OK! {} points, '
+                 '{:.0f} points/s'.format(len(data),
+                                          len(data) / max(elapsed, 1e-9)))
+
+
 def delete_series(tags):
     """Deletes series in current database
 
     """
 
     try:
-        client = influx_client(client_type='client', user_type='writer')
+        client = pooled_client(client_type='client', user_type='writer')
         client.delete_series(tags=tags)
-        client.close()
     except (InfluxDBClientError, InfluxDBServerError):
         logging.exception('Could not delete series {}'.format(tags))
 
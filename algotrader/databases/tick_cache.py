@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Local columnar cache of tick data in front of the securities master.
+
+Ticks are kept on disk partitioned by provider/symbol/day, one file per
+partition with one NumPy array per column (time, bid, ask). Partitions are
+filled lazily on a cache miss, so repeated backtests over the same window
+read local files only. Only days complete in the securities master, ended
+before its last tick of the symbol, are kept.
+
+When the cache grows over its disk budget the least recently used
+partitions are deleted.
+"""
+import datetime
+import logging
+import os
+import pathlib
+
+import numpy as np
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+
+from common.settings import AlgoSettings
+from common.utilities import atomic_write
+from databases.influx_manager import pooled_client
+from price_parser import PriceParser
+
+PARTITION_SUFFIX = '.npz'
+
+
+class TickCache:
+    """On disk tick cache partitioned by provider/symbol/day.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, table='fx_ticks'):
+        """
+        :param cache_dir: base path of the cache, from config if None
+        :param max_bytes: disk budget in bytes, from config if None
+        :param table: tick table in the securities master
+        """
+        if cache_dir is None or max_bytes is None:
+            settings = AlgoSettings()
+            if cache_dir is None:
+                cache_dir = settings.tick_cache_path()
+            if max_bytes is None:
+                max_bytes = int(settings.tick_cache_max_gb() * 1024 ** 3)
+
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.table = table
+        self._used_bytes = None
+        # {(provider, symbol): int ns time of the last tick in database}
+        self._last_ticks = {}
+
+    def partition_path(self, provider, symbol, day):
+        """Filepath of a partition
+
+        :param day: datetime.date
+        """
+        filename = day.strftime('%Y-%m-%d') + PARTITION_SUFFIX
+        return self.cache_dir / provider / symbol / filename
+
+    def read_partition(self, provider, symbol, day):
+        """Tick arrays for a symbol and day. Query the securities master
+        and store the partition if not in cache.
+
+        :return: dict with 'time' (int64 ns), 'bid' and 'ask' (int64 parsed)
+        """
+        path = self.partition_path(provider, symbol, day)
+        if path.exists():
+            # mtime is used as last access time for the eviction
+            os.utime(path)
+            with np.load(path) as partition:
+                return {k: partition[k] for k in ('time', 'bid', 'ask')}
+
+        logging.info('Tick cache miss {} {} {}'.format(provider, symbol, day))
+        partition = self._database_query(provider, symbol, day)
+
+        # Ticks are loaded week by week after the fact: only days ended
+        # before the last tick in database are complete. A day without
+        # ticks may be a day not loaded yet, never cache it.
+        day_end = np.datetime64(day + datetime.timedelta(days=1), 'ns')
+        if len(partition['time']) and \
+                day_end.astype(np.int64) <= self.last_tick_time(provider,
+                                                                symbol):
+            self._write_partition(path, partition)
+        return partition
+
+    def last_tick_time(self, provider, symbol):
+        """Time of the last tick of a symbol in the securities master,
+        asked once per cache instance
+
+        :return: int ns since epoch, 0 if no ticks
+        """
+        key = (provider, symbol)
+        if key not in self._last_ticks:
+            self._last_ticks[key] = self._database_last_tick(provider,
+                                                             symbol)
+        return self._last_ticks[key]
+
+    def ticks(self, provider, symbols_list, start_time, end_time):
+        """All ticks for the symbols between start and end time, merged
+        and sorted by time.
+
+        :param start_time: datetime object/string
+        :param end_time: datetime object/string
+        :return: dict with 'time' (datetime64[ns]), 'symbol_code',
+                 'bid' and 'ask' arrays.
+                 The symbol code is the position in symbols_list
+        """
+        start = np.datetime64(start_time, 'ns')
+        end = np.datetime64(end_time, 'ns')
+        first_day = start.astype('datetime64[D]')
+        last_day = (end - np.timedelta64(1, 'ns')).astype('datetime64[D]')
+        days = np.arange(first_day, last_day + 1).astype(datetime.date)
+
+        columns = {'time': [], 'symbol_code': [], 'bid': [], 'ask': []}
+        for code, symbol in enumerate(symbols_list):
+            for day in days:
+                partition = self.read_partition(provider, symbol, day)
+                lo, hi = np.searchsorted(partition['time'],
+                                         [start.astype(np.int64),
+                                          end.astype(np.int64)])
+                columns['time'].append(partition['time'][lo:hi])
+                columns['bid'].append(partition['bid'][lo:hi])
+                columns['ask'].append(partition['ask'][lo:hi])
+                columns['symbol_code'].append(
+                    np.full(hi - lo, code, dtype=np.int16))
+
+        ans = {k: np.concatenate(v) if v else np.empty(0, dtype=np.int64)
+               for k, v in columns.items()}
+        # stable sort keeps the database order for equal timestamps
+        order = np.argsort(ans['time'], kind='mergesort')
+        ans = {k: v[order] for k, v in ans.items()}
+        ans['time'] = ans['time'].astype('datetime64[ns]')
+        return ans
+
+    def _database_query(self, provider, symbol, day):
+        """Get one day of ticks for a symbol from the securities master
+        """
+        s_time = datetime.datetime.combine(day, datetime.time())
+        e_time = s_time + datetime.timedelta(days=1)
+        cql = 'SELECT time, bid, ask ' \
+              'FROM \"{}\" ' \
+              'WHERE provider=\'{}\' ' \
+              'AND symbol=\'{}\' ' \
+              'AND time >= \'{}\' ' \
+              'AND time < \'{}\''.format(self.table,
+                                         provider,
+                                         symbol,
+                                         s_time,
+                                         e_time)
+        try:
+            client = pooled_client(client_type='client', user_type='reader')
+            points = list(client.query(query=cql, epoch='ns').get_points())
+        except (InfluxDBClientError, InfluxDBServerError):
+            logging.exception('Can not query securities master.')
+            raise SystemError
+
+        n = len(points)
+        return {'time': np.fromiter((p['time'] for p in points),
+                                    dtype=np.int64, count=n),
+                'bid': PriceParser.parse_array([p['bid'] for p in points]),
+                'ask': PriceParser.parse_array([p['ask'] for p in points])}
+
+    def _database_last_tick(self, provider, symbol):
+        """Get the time of the last tick of a symbol from the securities
+        master
+        """
+        cql = 'SELECT LAST(bid) ' \
+              'FROM \"{}\" ' \
+              'WHERE provider=\'{}\' ' \
+              'AND symbol=\'{}\''.format(self.table, provider, symbol)
+        try:
+            client = pooled_client(client_type='client', user_type='reader')
+            points = list(client.query(query=cql, epoch='ns').get_points())
+        except (InfluxDBClientError, InfluxDBServerError):
+            logging.exception('Can not query securities master.')
+            raise SystemError
+
+        return int(points[0]['time']) if points else 0
+
+    def _write_partition(self, path, partition):
+        """Write a partition atomically and apply the disk budget
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # other threads or processes may fill the same day
+        with atomic_write(path) as f:
+            np.savez(f, **partition)
+
+        if self._used_bytes is None:
+            self._used_bytes = self._disk_usage()
+        else:
+            self._used_bytes += path.stat().st_size
+
+        if self._used_bytes > self.max_bytes:
+            self._evict()
+
+    def _disk_usage(self):
+        return sum(p.stat().st_size
+                   for p in self.cache_dir.glob('**/*' + PARTITION_SUFFIX))
+
+    def _evict(self):
+        """Delete least recently used partitions until the cache is
+        within its disk budget
+        """
+        partitions = [(p.stat().st_mtime, p.stat().st_size, p)
+                      for p in self.cache_dir.glob('**/*' + PARTITION_SUFFIX)]
+        partitions.sort()
+
+        used = sum(size for _mtime, size, _path in partitions)
+        for _mtime, size, path in partitions:
+            if used <= self.max_bytes:
+                break
+            os.remove(path)
+            used -= size
+            logging.info('Tick cache evicted {}'.format(path))
+
+        self._used_bytes = used
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Paginated queries of tick data from the securities master.
+
+Instead of one big query whose ResultSet is fully materialized before the
+first tick can be used, ticks are requested in pages of a fixed number of
+points. Each page starts at the time of the last point seen
+("time >= cursor"), so pages are cheap for Influx whatever the length of
+the period queried.
+
+Times are returned as RFC3339 strings, or as integers since epoch, UTC, in
+the precision given by epoch.
+"""
+import logging
+
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+
+from common.utilities import iter_islast
+from databases.influx_manager import pooled_client
+
+
+def _time_literal(time):
+    """InfluxQL literal for a time: integer epoch ns or datetime string
+    """
+    if isinstance(time, int):
+        return str(time)
+    return '\'{}\''.format(time)
+
+
+def tick_page_query_constructor(table, provider, symbols_list, cursor,
+                                e_time, limit):
+    """CQL statement for a page of ticks of one or more symbols
+    """
+    all_symbols = ''
+    for each_symbol, islast in iter_islast(symbols_list):
+        all_symbols += "symbol=\'{}\'".format(each_symbol)
+        if not islast:
+            all_symbols += ' OR '
+
+    return "SELECT time, ask, bid, provider, symbol " \
+           "FROM \"{}\" " \
+           "WHERE provider=\'{}\' " \
+           "AND time >= {} " \
+           "AND time < {} " \
+           "AND ({}) " \
+           "ORDER BY time ASC " \
+           "LIMIT {}".format(table,
+                             provider,
+                             _time_literal(cursor),
+                             _time_literal(e_time),
+                             all_symbols,
+                             limit)
+
+
+def tick_pages(table, provider, symbols_list, start_time, end_time,
+               page_size=10000, epoch=None):
+    """Generator of pages of ticks, lists of tick dictionaries in time
+    order, for the symbols between start and end time.
+
+    Points sharing the timestamp of the cursor were already returned in the
+    previous page, they are requested again and skipped.
+
+    :param start_time: start datetime object/string
+    :param end_time: end datetime object/string
+    :param page_size: number of ticks per page
+    :param epoch: None for RFC3339 time strings or 'ns' for integer times
+    """
+    client = pooled_client(client_type='client', user_type='reader')
+    cursor = start_time
+    skip = 0
+    while True:
+        cql = tick_page_query_constructor(table=table,
+                                          provider=provider,
+                                          symbols_list=symbols_list,
+                                          cursor=cursor,
+                                          e_time=end_time,
+                                          limit=page_size + skip)
+        try:
+            points = list(client.query(query=cql,
+                                       epoch=epoch).get_points())
+        except (InfluxDBClientError, InfluxDBServerError):
+            logging.exception('Can not query securities master.')
+            raise SystemError
+
+        page = points[skip:]
+        if page:
+            yield page
+
+        if len(points) < page_size + skip:
+            return
+
+        last_time = points[-1]['time']
+        skip = sum(1 for p in points if p['time'] == last_time)
+        cursor = last_time
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Immutable binary tick store for fast replay of FXCM ticks.
+
+Each clean FXCM week file "SYMBOL_YYYY_WW.csv.gz" is converted once into
+"SYMBOL_YYYY_WW.ticks", an array of fixed-width records (time, bid, ask)
+all as little endian int64: time in nanoseconds since epoch UTC and prices
+already parsed by the PriceParser.
+
+Files are read with numpy.memmap, so there is no parsing on replay and
+all the backtest processes reading the same file share the OS page cache.
+"""
+import datetime
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from common.settings import AlgoSettings
+from common.utilities import atomic_write
+from data_acquisition.fxmc import in_store
+from databases.fxcm_tick_insert import fxcm_datetime_parser
+from price_parser import PriceParser
+
+TICK_RECORD = np.dtype([('time', '<i8'), ('bid', '<i8'), ('ask', '<i8')])
+TICK_FILE_SUFFIX = '.ticks'
+
+
+def tick_file_path_constructor(filename, dir_path):
+    """Construct a filepath object for a tick file in the tick store,
+    same layout as the clean store.
+
+    :param filename: regex "^[A-Z]{6}_20\\d{1,2}_\\d{1,2}" ex: "AUDCAD_2015_1"
+    :param dir_path: base path
+    :return: full path
+    """
+    store = pathlib.Path(dir_path)
+    symbol = filename[:6]
+    year = filename[7:11]
+    return store / symbol / year / (filename + TICK_FILE_SUFFIX)
+
+
+def read_clean_file(file_path):
+    """Read a clean FXCM file into an array of tick records, sorted by time
+    """
+    df = pd.read_csv(filepath_or_buffer=file_path,
+                     compression='gzip',
+                     sep=',',
+                     skiprows=1,
+                     names=['price_datetime', 'bid', 'ask'],
+                     float_precision='high',
+                     engine='c')
+
+    records = np.empty(len(df), dtype=TICK_RECORD)
+    records['time'] = fxcm_datetime_parser(df['price_datetime']).astype(np.int64)
+    records['bid'] = PriceParser.parse_array(df['bid'].values)
+    records['ask'] = PriceParser.parse_array(df['ask'].values)
+
+    return records[np.argsort(records['time'], kind='mergesort')]
+
+
+def build_tick_file(clean_file_path, store_dirpath, overwrite=False):
+    """Convert a clean FXCM .csv.gz file into a tick file.
+
+    :return: path of the tick file
+    """
+    clean_file_path = pathlib.Path(clean_file_path)
+    filename = clean_file_path.parts[-1][:-7]
+    tick_file_path = tick_file_path_constructor(filename, store_dirpath)
+
+    if tick_file_path.exists() and not overwrite:
+        return tick_file_path
+
+    records = read_clean_file(clean_file_path)
+
+    # other processes may build the same file
+    tick_file_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(tick_file_path) as f:
+        records.tofile(f)
+
+    logging.info('Tick file {} with {} ticks'.format(tick_file_path,
+                                                     len(records)))
+    return tick_file_path
+
+
+def build_tick_store(clean_dirpath=None, store_dirpath=None, overwrite=False):
+    """Convert all files in the clean store into the tick store.
+    Files already in the tick store are skipped unless overwrite.
+    """
+    if clean_dirpath is None:
+        clean_dirpath = AlgoSettings().store_clean_fxcm()
+    if store_dirpath is None:
+        store_dirpath = AlgoSettings().store_ticks_fxcm()
+
+    clean_files = in_store(clean_dirpath)
+    total = len(clean_files)
+    for counter, each_file in enumerate(clean_files, 1):
+        build_tick_file(each_file, store_dirpath, overwrite=overwrite)
+        logging.info('Doing {} out of {} - '
+                     '{:.3%}'.format(counter, total, counter / total))
+
+
+def open_tick_file(tick_file_path):
+    """Read only memory map of a tick file. Week files without ticks give
+    empty tick files, that can not be mapped: empty array.
+    """
+    if not os.path.getsize(tick_file_path):
+        return np.empty(0, dtype=TICK_RECORD)
+    return np.memmap(str(tick_file_path), dtype=TICK_RECORD, mode='r')
+
+
+def symbol_ticks(symbol, start_time, end_time, store_dirpath):
+    """Ticks of a symbol between start and end time.
+
+    :return: list of memory mapped record arrays, one per week file,
+             in time order. Slices, nothing is read or copied.
+    """
+    start = np.datetime64(start_time, 'ns').astype(np.int64)
+    end = np.datetime64(end_time, 'ns').astype(np.int64)
+
+    # FXCM weeks do not match exactly ISO weeks, look one week around
+    s_date = pd.Timestamp(start_time).date() - datetime.timedelta(weeks=1)
+    e_date = pd.Timestamp(end_time).date() + datetime.timedelta(weeks=1)
+
+    weeks = []
+    day = s_date
+    while day <= e_date:
+        year, week, _ = day.isocalendar()
+        if (year, week) not in weeks:
+            weeks.append((year, week))
+        day += datetime.timedelta(days=1)
+
+    ans = []
+    for year, week in weeks:
+        filename = '{}_{}_{}'.format(symbol, year, week)
+        tick_file_path = tick_file_path_constructor(filename, store_dirpath)
+        if not tick_file_path.exists():
+            continue
+
+        records = open_tick_file(tick_file_path)
+        lo, hi = np.searchsorted(records['time'], [start, end])
+        if hi > lo:
+            ans.append(records[lo:hi])
+
+    ans.sort(key=lambda x: x['time'][0])
+    return ans
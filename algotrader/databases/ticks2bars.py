@@ -3,8 +3,9 @@
 Converts ticks to bars
 """
 import datetime
-import itertools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 
@@ -12,6 +13,56 @@ import databases.influx_manager as db_man
 from common.utilities import iter_islast
 from log.log_settings import setup_logging, log_title
 
+logger = logging.getLogger('tick2bars')
+
+# Bar frequencies built together by the cascade, each one from the previous
+CASCADE_FREQUENCIES = ('1s', '1min', '5min', '15min', '1h', '1D')
+
+# Tags that define a series in the tick and bar tables
+SERIES_TAGS = ('provider', 'symbol', 'frequency')
+
+# How each tick column is aggregated into bar fields. OHLC of the mid price
+# are the open, high, low and close fields
+TICK_AGGREGATION = {'mid': ['first', 'max', 'min', 'last'],
+                    'bid': ['first', 'max', 'min', 'last'],
+                    'ask': ['first', 'max', 'min', 'last'],
+                    'spread': ['min', 'max', 'mean', 'count']}
+
+# Bar field of each (tick column, aggregation)
+BAR_FIELD_NAMES = {('mid', 'first'): 'open',
+                   ('mid', 'max'): 'high',
+                   ('mid', 'min'): 'low',
+                   ('mid', 'last'): 'close',
+                   ('bid', 'first'): 'bid_open',
+                   ('bid', 'max'): 'bid_high',
+                   ('bid', 'min'): 'bid_low',
+                   ('bid', 'last'): 'bid_close',
+                   ('ask', 'first'): 'ask_open',
+                   ('ask', 'max'): 'ask_high',
+                   ('ask', 'min'): 'ask_low',
+                   ('ask', 'last'): 'ask_close',
+                   ('spread', 'min'): 'spread_min',
+                   ('spread', 'max'): 'spread_max',
+                   ('spread', 'mean'): 'spread_mean',
+                   ('spread', 'count'): 'ticks'}
+
+# Fields of the bars table
+BAR_FIELDS = [BAR_FIELD_NAMES[(column, how)]
+              for column, hows in TICK_AGGREGATION.items() for how in hows]
+
+# How each bar field is aggregated into bars of a lower frequency.
+# spread_mean is weighted by the ticks, see bars_to_bars
+BAR_AGGREGATION = {BAR_FIELD_NAMES[(column, how)]: how
+                   for column, hows in TICK_AGGREGATION.items()
+                   for how in hows if column != 'spread'}
+BAR_AGGREGATION.update({'spread_min': 'min',
+                        'spread_max': 'max',
+                        'spread_sum': 'sum',
+                        'ticks': 'sum'})
+
+# Series info of each table for the run: {table: list}
+_series_info_cache = {}
+
 
 def one_minute_adjustment(datetime_to_adjust):
     """ Adjust a datetime to the start of the minute
@@ -76,82 +127,83 @@ def time_bounds(table, tags, position=('FIRST', 'LAST')):
     return ans
 
 
-def product_dict(dicts):
-    """Cartesian product of a dictionary of lists
-    https://stackoverflow.com/a/40623158/3512107
+def series_time_bounds(table, group_by=SERIES_TAGS):
+    """ First and last datetime of every series in a table, in two grouped
+    queries for the whole table. Only series that exist are returned.
 
-     >>> list(dict_product(dict(number=[1,2], character='ab')))
-    [{'character': 'a', 'number': 1},
-     {'character': 'a', 'number': 2},
-     {'character': 'b', 'number': 1},
-     {'character': 'b', 'number': 2}]
+    :param group_by: tags defining a series
+    :return: dict {tuple of tag values in group_by order: {'first', 'last'}}
     """
-    return (dict(zip(dicts, x)) for x in itertools.product(*dicts.values()))
+    # We need one field key to make the query and get the time, for select *
+    # returns UNIX time.
+    field_keys = get_field_keys(table)
+    if not field_keys:
+        return {}
+    field_key_to_qry = field_keys[0]['fieldKey']
 
+    group_cql = ', '.join('\"{}\"'.format(tag) for tag in group_by)
 
-def get_series_info(table):
-    """Returns tags of each series in a table
+    ans = {}
+    for each_position in ('FIRST', 'LAST'):
+        cql = 'SELECT {}(\"{}\") ' \
+              'FROM \"{}\" ' \
+              'GROUP BY {}'.format(each_position,
+                                   field_key_to_qry,
+                                   table,
+                                   group_cql)
 
-    :return: list of dictionaries
-    """
-    logger.info('Querying series info in table \'{}\''.format(table))
+        response = db_man.influx_qry(cql)
 
-    # get series by symbols - provider tags - frequency (if bars)
-    cql = 'SHOW TAG VALUES ON ' \
-          '"securities_master" FROM "{}" ' \
-          'WITH KEY IN (\"{}\", \"{}\", \"{}\")'.format(table,
-                                                        'provider',
-                                                        'symbol',
-                                                        'frequency')
+        # a tag not in the table, as frequency for ticks, groups as ''
+        for (_table, tags), points in response.items():
+            key = tuple(tags.get(tag, '') for tag in group_by)
+            time_on_db = pd.to_datetime(next(points)['time'])
 
-    response = db_man.influx_qry(cql).get_points()
+            # adjust to lower minute
+            ans.setdefault(key, {})[each_position.lower()] = \
+                one_minute_adjustment(time_on_db)
 
-    provs = []
-    symb = []
-    freq = []
-    for resp in response:
-        if resp['key'] == 'provider':
-            provs.append(resp['value'])
-        elif resp['key'] == 'symbol':
-            symb.append(resp['value'])
-        elif resp['key'] == 'frequency':
-            freq.append(resp['value'])
+    return ans
+
+
+def get_series_info(table, refresh=False):
+    """Returns tags of each series in a table. Asked once to the database
+    and kept for the rest of the run, unless refresh.
+
+    :return: list of dictionaries
+    """
+    if table in _series_info_cache and not refresh:
+        return _series_info_cache[table]
+
+    logger.info('Querying series info in table \'{}\''.format(table))
 
     # the fx_ticks table does not include a frequency tag, I was aware of its
     # utility after all series were inserted. At the moment influx does not
     # support adding tags to existing series. A request is open:
     # https://github.com/influxdata/influxdb/issues/3904
-    if not freq:
-        freq.append('')
-
-    series_tags = {'symbol': symb,
-                   'provider': provs,
-                   'frequency': freq}
-
-    # construct all possibilities
-    # Cartesian product of a dictionary of lists
-    product_series_tags = product_dict(series_tags)
+    bounds = series_time_bounds(table)
 
     ans = []
-    for tag_product in product_series_tags:
-        # add time bounds for each series
-        bounds = time_bounds(table, tags=tag_product)
-
-        ids = {'provider': tag_product['provider'],
-               'symbol': tag_product['symbol']}
-        data = {'first': bounds['first'],
-                'last': bounds['last'],
-                'frequency': tag_product['frequency']}
+    for (provider, symbol, frequency), each_bounds in sorted(bounds.items()):
+        ids = {'provider': provider,
+               'symbol': symbol}
+        data = {'first': each_bounds['first'],
+                'last': each_bounds['last'],
+                'frequency': frequency}
 
         # construct answer list of dictionaries
         ans.append({'id': ids,
                     'data': data})
 
+    _series_info_cache[table] = ans
     return ans
 
 
 def ticks_to_bars(ticks, freq):
-    """Re sample ticks [timestamp bid, ask) to bars OHLC of selected frequency
+    """Re sample ticks [timestamp bid, ask) to bars of selected frequency:
+    OHLC of the mid price (open, high, low, close), OHLC of bid and ask
+    (bid_open, ..., ask_close), min, max and mean spread (spread_min,
+    spread_max, spread_mean) and number of ticks (ticks). See BAR_FIELDS.
     https://stackoverflow.com/a/17001474/3512107
     :param ticks:
     :param freq:
@@ -185,30 +237,60 @@ def ticks_to_bars(ticks, freq):
                     U, us	microseconds
                     N	nanoseconds
     """
-    ticks['mid'] = ticks.mean(axis=1)
-    ticks.drop(['bid', 'ask'], axis=1, inplace=True)
+    ticks['mid'] = (ticks['bid'] + ticks['ask']) / 2
+    ticks['spread'] = ticks['ask'] - ticks['bid']
 
-    bars = ticks.resample(rule=freq, level=0).ohlc()
+    # all the fields of the bars in one resample
+    bars = ticks.resample(rule=freq, level=0).agg(TICK_AGGREGATION)
 
     # Drop N/A. When there are no tick, do not create a bar
     bars.dropna(inplace=True)
 
     # Drop multi-index, Influx write has problem with that
-    bars.columns = bars.columns.droplevel(0)
+    bars.columns = [BAR_FIELD_NAMES[column] for column in bars.columns]
 
-    return bars
+    return bars[BAR_FIELDS]
 
 
-def tick_resampling(input_table, output_table, tags, start_datetime,
-                    end_datetime):
-    """Re sample tick data in securities master to desired frequency
+def bars_to_bars(bars, freq):
+    """Re sample bars to bars of a lower frequency, ex: 1min to 5min
+    Same labels and alignment as ticks_to_bars.
 
+    :param bars: dataframe with the BAR_FIELDS columns
+    :param freq: pandas offset alias, see ticks_to_bars
     """
-    # Define the time extension of each query.
-    # The bigger the number, more RAM needed.
-    delta = datetime.timedelta(hours=24)
+    bars = bars.assign(spread_sum=bars['spread_mean'] * bars['ticks'])
+    bars = bars.resample(rule=freq).agg(BAR_AGGREGATION)
+
+    # When there are no bars, do not create a bar
+    bars.dropna(inplace=True)
+
+    bars['spread_mean'] = bars['spread_sum'] / bars['ticks']
+    return bars[BAR_FIELDS]
+
 
-    # Construct the intervals to obtain the data in chunks
+def cascade_bars(ticks, frequencies=CASCADE_FREQUENCIES):
+    """Re sample ticks to bars of several frequencies. Only the first
+    frequency is built from the ticks, each other from the one before.
+
+    :param ticks: dataframe [timestamp] bid, ask
+    :param frequencies: increasing bar frequencies, see ticks_to_bars
+    :return: dataframe with the bars of all frequencies and their
+             frequency in column 'frequency'
+    """
+    bars = ticks_to_bars(ticks=ticks, freq=frequencies[0])
+    ans = [bars.assign(frequency=frequencies[0])]
+    for freq in frequencies[1:]:
+        bars = bars_to_bars(bars=bars, freq=freq)
+        ans.append(bars.assign(frequency=freq))
+
+    return pd.concat(ans)
+
+
+def chunk_intervals(start_datetime, end_datetime, delta):
+    """Consecutive (start, end) intervals of length delta covering
+    start to end datetime
+    """
     chuncks = []
     init_dt = start_datetime
     while init_dt < end_datetime:
@@ -218,42 +300,208 @@ def tick_resampling(input_table, output_table, tags, start_datetime,
 
         init_dt = end_dt
 
-    # works with each query: re sampling and insert
-    for each_chunck in chuncks:
-
-        cql = 'SELECT time, bid, ask FROM {} ' \
-              'WHERE symbol=\'{}\' ' \
-              'AND provider=\'{}\' ' \
-              'AND time>=\'{}\' ' \
-              'AND time<\'{}\''.format(input_table,
-                                       tags['symbol'],
-                                       tags['provider'],
-                                       each_chunck[0],
-                                       each_chunck[1])
-
-        # Get the ticks requested
-        response = db_man.influx_qry(client_type='dataframe', cql=cql)
-
-        # check for the weekends --no data--
-        if not response:
-            logger.warning('No data for {} at {}'.format(tags.values(),
-                                                         each_chunck[0]))
-        else:
-            logger.info('Re sampling {} from {} delta {}'.format(tags.values(),
-                                                                 each_chunck[0],
-                                                                 delta))
-            ticks = response[input_table]
+    return chuncks
 
-            # Call the re sampling function
-            bars = ticks_to_bars(ticks=ticks, freq=tags['frequency'])
 
-            # Insert into securities master database
-            field_keys = ['open', 'high', 'low', 'close']
+def query_ticks(input_table, tags, start_datetime, end_datetime):
+    """Ticks of a series between start and end datetime
+
+    :return: dataframe [timestamp] bid, ask. None if there are no ticks
+    """
+    cql = 'SELECT time, bid, ask FROM {} ' \
+          'WHERE symbol=\'{}\' ' \
+          'AND provider=\'{}\' ' \
+          'AND time>=\'{}\' ' \
+          'AND time<\'{}\''.format(input_table,
+                                   tags['symbol'],
+                                   tags['provider'],
+                                   start_datetime,
+                                   end_datetime)
+
+    response = db_man.influx_qry(client_type='dataframe', cql=cql)
+    ticks = response.get(input_table) if response else None
+    if ticks is None or ticks.empty:
+        return None
+    return ticks
+
+
+def series_chunks(start_datetime, end_datetime, freq):
+    """Intervals of a series queried and re sampled at once.
+    For the cascade they are whole days from midnight, so daily bars are
+    complete.
+    """
+    # Define the time extension of each query.
+    # The bigger the number, more RAM needed.
+    delta = datetime.timedelta(hours=24)
+    if not isinstance(freq, str):
+        start_datetime = pd.Timestamp(start_datetime).floor('D')
+
+    return chunk_intervals(start_datetime, end_datetime, delta)
+
+
+def chunk_bars(input_table, tags, each_chunck, freq):
+    """Bars of one chunk of a series
+
+    :param tags: symbol and provider of the series
+    :param each_chunck: (start, end) datetimes
+    :param freq: bar frequency, or tuple of frequencies for the cascade
+    :return: dataframe, None if there are no ticks
+    """
+    ticks = query_ticks(input_table, tags, *each_chunck)
+
+    # check for the weekends --no data--
+    if ticks is None:
+        logger.warning('No data for {} at {}'.format(tags.values(),
+                                                     each_chunck[0]))
+        return None
+
+    logger.info('Re sampling {} from {} to {}'.format(tags.values(),
+                                                      each_chunck[0],
+                                                      freq))
+    if isinstance(freq, str):
+        return ticks_to_bars(ticks=ticks, freq=freq)
+    return cascade_bars(ticks=ticks, frequencies=freq)
+
+
+def write_bars(bars, output_table, tags, freq):
+    """Insert the bars of a chunk into securities master database, in one
+    write for all the frequencies
+    """
+    if isinstance(freq, str):
+        db_man.influx_line_writer(data=bars,
+                                  field_columns=BAR_FIELDS,
+                                  tags=dict(tags, frequency=freq),
+                                  into_table=output_table)
+    else:
+        db_man.influx_line_writer(data=bars,
+                                  field_columns=BAR_FIELDS,
+                                  tags=tags,
+                                  into_table=output_table,
+                                  tag_columns=['frequency'])
+
+
+def series_resampling(input_table, output_table, tags, start_datetime,
+                      end_datetime, freq):
+    """Re sample a series chunk by chunk, in time order
+
+    :param tags: symbol and provider of the series
+    :param freq: bar frequency, or tuple of frequencies for the cascade
+    """
+    for each_chunck in series_chunks(start_datetime, end_datetime, freq):
+        bars = chunk_bars(input_table, tags, each_chunck, freq)
+        if bars is not None:
+            write_bars(bars, output_table, tags, freq)
+
+
+def tick_resampling(input_table, output_table, tags, start_datetime,
+                    end_datetime):
+    """Re sample tick data in securities master to desired frequency
+
+    """
+    series_resampling(input_table=input_table,
+                      output_table=output_table,
+                      tags={'symbol': tags['symbol'],
+                            'provider': tags['provider']},
+                      start_datetime=start_datetime,
+                      end_datetime=end_datetime,
+                      freq=tags['frequency'])
+
+
+def cascade_resampling(input_table, output_table, tags, start_datetime,
+                       end_datetime, frequencies=CASCADE_FREQUENCIES):
+    """Re sample tick data in securities master to all the frequencies,
+    reading the ticks once. The bars of all frequencies of a chunk are
+    sent in one write, tagged by frequency.
+    """
+    series_resampling(input_table=input_table,
+                      output_table=output_table,
+                      tags=tags,
+                      start_datetime=start_datetime,
+                      end_datetime=end_datetime,
+                      freq=tuple(frequencies))
+
+
+class _WriteTurns:
+    """Chunks of a series are re sampled concurrently but write their bars
+    in time order, each one after the previous. If a chunk fails, the
+    later ones do not write: the bars in the database are always a
+    complete prefix of the series and date_comparison resumes from them.
+    """
+
+    def __init__(self, n):
+        self._done = [threading.Event() for _ in range(n)]
+        self._ok = [False] * n
+
+    def wait(self, position):
+        """Wait for the turn of a chunk, False if a previous chunk was not
+        written and this one must not write either
+        """
+        if not position:
+            return True
+        self._done[position - 1].wait()
+        return self._ok[position - 1]
+
+    def done(self, position, ok):
+        self._ok[position] = ok
+        self._done[position].set()
 
-            db_man.influx_writer(data=bars,
-                                 field_columns=field_keys,
-                                 tags=tags,
-                                 into_table=output_table)
+
+def _chunk_job(turns, position, input_table, output_table, tags,
+               each_chunck, freq):
+    """Re sample and insert one chunk of a series, in a worker thread
+    """
+    ok = False
+    try:
+        bars = chunk_bars(input_table, tags, each_chunck, freq)
+        if not turns.wait(position):
+            return False
+        if bars is not None:
+            write_bars(bars, output_table, tags, freq)
+        ok = True
+    finally:
+        turns.done(position, ok)
+    return ok
+
+
+def parallel_resampling(input_table, output_table, jobs, freq, workers):
+    """Re sample series concurrently, all their chunks in a pool of
+    threads, as each chunk is I/O bound against Influx.
+
+    Chunks are submitted in time order and the pool runs them first in
+    first out, so the chunk a write waits for is always running or done.
+
+    :param jobs: list of (tags, start_datetime, end_datetime)
+    :param workers: max number of chunks in process at the same time
+    """
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tags, start_datetime, end_datetime in jobs:
+            chunks = series_chunks(start_datetime, end_datetime, freq)
+            turns = _WriteTurns(len(chunks))
+            for position, each_chunck in enumerate(chunks):
+                futures.append(executor.submit(_chunk_job, turns, position,
+                                               input_table, output_table,
+                                               tags, each_chunck, freq))
+
+        total = len(futures)
+        failed = 0
+        for counter, future in enumerate(as_completed(futures), 1):
+            try:
+                if not future.result():
+                    failed += 1
+            except SystemError:
+                # already logged by the database functions
+                failed += 1
+            except Exception:
+                logger.exception('Error re sampling chunk')
+                failed += 1
+            logger.info('Doing {} out of {} - {:.3%}'.format(counter,
+                                                             total,
+                                                             counter / total))
+
+    if failed:
+        logger.error('{} chunks not inserted, run again to '
+                     'complete the series.'.format(failed))
 
 
 def date_comparison(input_series, output_series):
@@ -280,19 +528,27 @@ def date_comparison(input_series, output_series):
     return ans
 
 
-def load_all_series(input_table, output_table, freq):
+def load_all_series(input_table, output_table, freq, workers=1):
     """ Load all series of a table and call resampling
 
+    :param freq: bar frequency, or tuple of frequencies to build them all
+                 from one read of the ticks, see cascade_resampling
+    :param workers: number of chunks re sampled concurrently, all series
+                    together. 1 for one chunk after the other
     """
+    # Resume from the bars of the first frequency
+    first_freq = freq if isinstance(freq, str) else freq[0]
 
     # What series are in the tick table
-    tick_series = get_series_info(input_table)
+    tick_series = get_series_info(input_table, refresh=True)
     # What series are in the bars table
-    bar_series = get_series_info(output_table)
+    bar_series = [x for x in get_series_info(output_table, refresh=True)
+                  if x['data']['frequency'] == first_freq]
 
     # sub set of bar_series, share same order
     bar_ids = [x['id'] for x in bar_series]
 
+    jobs = []
     for each_tick_series in tick_series:
         # Compare them
         if each_tick_series['id'] in bar_ids:
@@ -320,19 +576,25 @@ def load_all_series(input_table, output_table, freq):
 
         # proceed if authorized
         if do_resampling:
-            tick_resampling(output_table=output_table,
-                            input_table=input_table,
-                            tags={'symbol': each_tick_series['id']['symbol'],
-                                  'provider': each_tick_series['id'][
-                                      'provider'],
-                                  'frequency': freq},
-                            start_datetime=start_datetime,
-                            end_datetime=end_datetime)
-
-
-
-
-
+            jobs.append(({'symbol': each_tick_series['id']['symbol'],
+                          'provider': each_tick_series['id']['provider']},
+                         start_datetime,
+                         end_datetime))
+
+    if workers > 1:
+        parallel_resampling(input_table=input_table,
+                            output_table=output_table,
+                            jobs=jobs,
+                            freq=freq,
+                            workers=workers)
+    else:
+        for tags, start_datetime, end_datetime in jobs:
+            series_resampling(input_table=input_table,
+                              output_table=output_table,
+                              tags=tags,
+                              start_datetime=start_datetime,
+                              end_datetime=end_datetime,
+                              freq=freq)
 
     logger.info('Insert all series finished.')
 
@@ -343,12 +605,11 @@ def main():
     log_title("START LOADING MULTIPLE BAR SERIES")
     load_all_series(input_table='fx_ticks',
                     output_table='bars',
-                    freq='1min')
+                    freq=CASCADE_FREQUENCIES,
+                    workers=4)
     logger.info('ticks to bars end running.')
 
 
 if __name__ == '__main__':
     setup_logging()
-    logger = logging.getLogger('tick2bars')
-
     main()
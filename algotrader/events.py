@@ -4,9 +4,27 @@
 """
 
 from enum import Enum
+
+import numpy as np
+
 from price_parser import PriceParser
 
-EventType = Enum("EventType", "TICK BAR SIGNAL ORDER FILL SENTIMENT")
+EventType = Enum("EventType", "TICK TICK_BATCH BAR SIGNAL ORDER FILL SENTIMENT")
+
+# Human-readable bar periods, by number of seconds
+PERIOD_READABLE = {1: "1sec",
+                   5: "5sec",
+                   10: "10sec",
+                   15: "15sec",
+                   30: "30sec",
+                   60: "1min",
+                   300: "5min",
+                   600: "10min",
+                   900: "15min",
+                   1800: "30min",
+                   3600: "1hr",
+                   86400: "1day",
+                   604800: "1wk"}
 
 
 class Event(object):
@@ -14,32 +32,86 @@ class Event(object):
     Event is base class providing an interface for all subsequent
     (inherited) events, that will trigger further events in the
     trading infrastructure.
+
+    Events are created by the million during a backtest: all of them use
+    __slots__ and keep their type as a class attribute.
     """
+    __slots__ = ()
 
     @property
     def typename(self):
         return self.type.name
 
 
+class EventPool(object):
+    """
+    Pool of recycled event instances of one class. Consumed events are
+    handed back with release() and acquire() fills them in place with new
+    values instead of allocating a new object.
+
+    Only for events that nobody keeps a reference to once consumed.
+    """
+
+    def __init__(self, event_class, max_size=1024):
+        self.event_class = event_class
+        self.max_size = max_size
+        # number of new instances, the rest were recycled
+        self.created = 0
+        self._free = []
+
+    def acquire(self, *args):
+        """Event initialised with args, recycled if any available
+        """
+        try:
+            event = self._free.pop()
+        except IndexError:
+            self.created += 1
+            return self.event_class(*args)
+        event.__init__(*args)
+        return event
+
+    def release(self, event):
+        """Hand back a consumed event for reuse
+        """
+        if len(self._free) < self.max_size:
+            self._free.append(event)
+
+
 class TickEvent(Event):
     """
     Handles the event of receiving a new market update tick,
     which is defined as a symbol symbol and associated best
     bid and ask from the top of the order book.
     """
+    __slots__ = ('symbol', 'provider', 'time', 'bid', 'ask')
+    type = EventType.TICK
 
-    def __init__(self, tick):
+    def __init__(self, symbol, provider, time, bid, ask):
         """Initialises the TickEvent.
 
-        :param tick: tick dictionary with time, symbol, bid, ask, provider data
+        :param symbol: symbol of the tick
+        :param provider: data provider
+        :param time: time of the tick
+        :param bid: bid price already parsed by the PriceParser
+        :param ask: ask price already parsed by the PriceParser
         """
+        self.symbol = symbol
+        self.provider = provider
+        self.time = time
+        self.bid = bid
+        self.ask = ask
 
-        self.type = EventType.TICK
-        self.symbol = tick['symbol']
-        self.provider = tick['provider']
-        self.time = tick['time']
-        self.bid = PriceParser.parse(tick['bid'])
-        self.ask = PriceParser.parse(tick['ask'])
+    @classmethod
+    def from_dict(cls, tick):
+        """Initialises the TickEvent from a tick dictionary.
+
+        :param tick: tick dictionary with time, symbol, bid, ask, provider data
+        """
+        return cls(tick['symbol'],
+                   tick['provider'],
+                   tick['time'],
+                   PriceParser.parse(tick['bid']),
+                   PriceParser.parse(tick['ask']))
 
     def __str__(self):
         return "Type: {}, " \
@@ -58,12 +130,113 @@ class TickEvent(Event):
         return str(self)
 
 
+class TickBatchEvent(Event):
+    """
+    Handles the event of receiving a block of consecutive market ticks
+    at once. Data is kept as a struct of arrays, one NumPy array per
+    field, so strategies can work on the whole block with vectorized
+    code instead of one TickEvent per tick.
+
+    Symbols are stored as integer codes, the position of the symbol
+    inside the 'symbols' tuple.
+    """
+    __slots__ = ('symbols', 'provider', 'symbol_code', 'time', 'bid', 'ask')
+    type = EventType.TICK_BATCH
+
+    def __init__(self, symbols, provider, symbol_code, time, bid, ask):
+        """Initialises the TickBatchEvent.
+
+        :param symbols: tuple of symbol names, index is the symbol code
+        :param provider: data provider of the ticks
+        :param symbol_code: int array with the symbol code of each tick
+        :param time: datetime64[ns] array with the time of each tick
+        :param bid: int64 array with bid prices already parsed
+        :param ask: int64 array with ask prices already parsed
+        """
+        self.symbols = tuple(symbols)
+        self.provider = provider
+        self.symbol_code = symbol_code
+        self.time = time
+        self.bid = bid
+        self.ask = ask
+
+    @classmethod
+    def from_ticks(cls, ticks, symbols, provider):
+        """Build a batch from a list of tick dictionaries as the ones
+        returned by the securities master.
+
+        :param ticks: list of dicts with time, symbol, bid, ask
+        :param symbols: list of symbols, defines the symbol codes
+        :param provider: data provider of the ticks
+        """
+        code_of = {symbol: code for code, symbol in enumerate(symbols)}
+        n = len(ticks)
+
+        symbol_code = np.empty(n, dtype=np.int16)
+        bid = np.empty(n, dtype=np.float64)
+        ask = np.empty(n, dtype=np.float64)
+        time = []
+        for i, tick in enumerate(ticks):
+            symbol_code[i] = code_of[tick['symbol']]
+            bid[i] = tick['bid']
+            ask[i] = tick['ask']
+            time.append(tick['time'])
+
+        if time and isinstance(time[0], str):
+            # Influx returns RFC3339 strings in UTC, numpy wants them naive
+            time = [t.rstrip('Z') for t in time]
+
+        return cls(symbols=symbols,
+                   provider=provider,
+                   symbol_code=symbol_code,
+                   time=np.array(time, dtype='datetime64[ns]'),
+                   bid=PriceParser.parse_array(bid),
+                   ask=PriceParser.parse_array(ask))
+
+    def __len__(self):
+        return len(self.time)
+
+    def symbol_mask(self, symbol):
+        """Boolean array selecting the ticks of a symbol
+        """
+        return self.symbol_code == self.symbols.index(symbol)
+
+    def ticks(self):
+        """Generator of TickEvents, one for each tick in the batch.
+        For consumers that still work tick by tick.
+        """
+        for code, time, bid, ask in zip(self.symbol_code.tolist(),
+                                        self.time,
+                                        self.bid.tolist(),
+                                        self.ask.tolist()):
+            yield TickEvent(self.symbols[code], self.provider, time, bid, ask)
+
+    def __str__(self):
+        return "Type: {}, " \
+               "Symbols: {}, " \
+               "Ticks: {}, " \
+               "From: {}, " \
+               "To: {}, " \
+               "Provider: {}".format(self.type,
+                                     self.symbols,
+                                     len(self),
+                                     self.time[0] if len(self) else None,
+                                     self.time[-1] if len(self) else None,
+                                     self.provider)
+
+    def __repr__(self):
+        return str(self)
+
+
 class BarEvent(Event):
     """
     Handles the event of receiving a new market
     open-high-low-close-volume bar, as would be generated
     via common data providers such as Yahoo Finance.
     """
+    __slots__ = ('symbol', 'time', 'period', 'open_price', 'high_price',
+                 'low_price', 'close_price', 'volume', 'adj_close_price')
+    type = EventType.BAR
 
     def __init__(self, symbol, time, period, open_price, high_price, low_price,
                  close_price, volume, adj_close_price=None):
@@ -86,7 +259,6 @@ class BarEvent(Event):
         of 'open_price', 'close_price' as 'open' is a reserved
         word in Python.
         """
-        self.type = EventType.BAR
         self.symbol = symbol
         self.time = time
         self.period = period
@@ -96,9 +268,9 @@ class BarEvent(Event):
         self.close_price = close_price
         self.volume = volume
         self.adj_close_price = adj_close_price
-        self.period_readable = self._readable_period()
 
-    def _readable_period(self):
+    @property
+    def period_readable(self):
         """
         Creates a human-readable period from the number
         of seconds specified for 'period'.
@@ -113,24 +285,8 @@ class BarEvent(Event):
         readable period is simply passed through from period,
         in seconds.
         """
-        lut = {1: "1sec",
-               5: "5sec",
-               10: "10sec",
-               15: "15sec",
-               30: "30sec",
-               60: "1min",
-               300: "5min",
-               600: "10min",
-               900: "15min",
-               1800: "30min",
-               3600: "1hr",
-               86400: "1day",
-               604800: "1wk"}
-
-        if self.period in lut:
-            return lut[self.period]
-        else:
-            return "%ssec".format(self.period)
+        return PERIOD_READABLE.get(self.period,
+                                   "{}sec".format(self.period))
 
     def __str__(self):
         format_str = "Type: {}, symbol: {}, Time: {:%Y-%m-%d %H:%M:%S}, Period: {}, " \
@@ -156,6 +312,8 @@ class SignalEvent(Event):
     Handles the event of sending a Signal from a Strategy object.
     This is received by a Portfolio object and acted upon.
     """
+    __slots__ = ('symbol', 'action', 'suggested_quantity')
+    type = EventType.SIGNAL
 
     def __init__(self, symbol, action, suggested_quantity=None):
         """
@@ -169,7 +327,6 @@ class SignalEvent(Event):
             of an asset to transact in, which is used by the
             PositionSizer and RiskManager.
         """
-        self.type = EventType.SIGNAL
         self.symbol = symbol
         self.action = action
         self.suggested_quantity = suggested_quantity
@@ -181,6 +338,8 @@ class OrderEvent(Event):
     The order contains a symbol (e.g. GOOG), action (BOT or SLD)
     and quantity.
     """
+    __slots__ = ('symbol', 'action', 'quantity')
+    type = EventType.ORDER
 
     def __init__(self, symbol, action, quantity):
         """
@@ -191,7 +350,6 @@ class OrderEvent(Event):
         action - 'BOT' (for long) or 'SLD' (for short).
         quantity - The quantity of shares to transact.
         """
-        self.type = EventType.ORDER
         self.symbol = symbol
         self.action = action
         self.quantity = quantity
@@ -218,6 +376,9 @@ class FillEvent(Event):
     different prices. This will be simulated by averaging
     the cost.
     """
+    __slots__ = ('timestamp', 'symbol', 'action', 'quantity', 'exchange',
+                 'price', 'commission')
+    type = EventType.FILL
 
     def __init__(self, timestamp, symbol, action, quantity, exchange, price, commission):
         """
@@ -231,7 +392,6 @@ class FillEvent(Event):
         price - The price at which the trade was filled
         commission - The brokerage commission for carrying out the trade.
         """
-        self.type = EventType.FILL
         self.timestamp = timestamp
         self.symbol = symbol
         self.action = action
@@ -247,6 +407,8 @@ class SentimentEvent(Event):
     with a symbol. Can be used for a generic "date-symbol-sentiment"
     service, often provided by many data vendors.
     """
+    __slots__ = ('timestamp', 'symbol', 'sentiment')
+    type = EventType.SENTIMENT
 
     def __init__(self, timestamp, symbol, sentiment):
         """
@@ -258,7 +420,6 @@ class SentimentEvent(Event):
         sentiment - A string, float or integer value of "sentiment",
             e.g. "bullish", -1, 5.4, etc.
         """
-        self.type = EventType.SENTIMENT
         self.timestamp = timestamp
         self.symbol = symbol
         self.sentiment = sentiment
@@ -1,19 +1,47 @@
 # coding=utf-8
 
+import gc
 import logging
 import queue
+from collections import deque
+from events import BarEvent, EventPool, EventType, TickEvent
+from price_handlers.background import BackgroundPriceHandler
 from price_handlers.historic_sec_master import HistoricFxTickPriceHandler, HistoricBarPriceHandler
 from log.log_settings import setup_logging
 import datetime
 
+logger = logging.getLogger('Backtester')
+
+
+class EventDeque(deque):
+    """
+    Events queue for single-threaded backtests. Same put/get interface as
+    queue.Queue without paying for locks on every call.
+    """
+    put = deque.append
+    get = deque.popleft
+
 
 class Backtester:
     """
     Encapsulates the settings and components for carrying out
     an event-driven backtest.
+
+    Events are dispatched by type to the handlers registered for it. The
+    events queue is only used from the backtest thread, background producers
+    hand their events over in stream_next, so with fast_loop it is an
+    EventDeque instead of a queue.Queue.
+
+    With event_pool, tick and bar events are handed back to a pool once
+    dispatched and recycled by the price handler (not with a producer).
+    Handlers must then not keep references to tick or bar events.
+    With pause_gc, the garbage collector is disabled while the queue runs.
     """
     def __init__(self, strategy, provider, symbol_list, start_time,
-                 end_time, frequency, initial_capital, execution_handler, portfolio):
+                 end_time, frequency, initial_capital, execution_handler, portfolio,
+                 batch_size=None, use_cache=False, merge_streams=False,
+                 producer=None, producer_queue_size=1000, fast_loop=False,
+                 event_pool=False, pause_gc=False):
 
         self.strategy = strategy
         self.provider = provider
@@ -25,14 +53,43 @@ class Backtester:
         self.initial_capital = initial_capital
         self.execution_handler = execution_handler
         self.portfolio = portfolio
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.merge_streams = merge_streams
+        self.producer = producer
+        self.producer_queue_size = producer_queue_size
+        self.fast_loop = fast_loop
+        self.pause_gc = pause_gc
+
+        # Pools of recycled events, by type
+        self._event_pools = {}
+        if event_pool and not self.producer:
+            self._event_pools = {EventType.TICK: EventPool(TickEvent),
+                                 EventType.BAR: EventPool(BarEvent)}
+
+        if self.fast_loop:
+            self.events_queue = EventDeque()
+        else:
+            self.events_queue = queue.Queue()
 
-        self.events_queue = queue.Queue()
+        self._handlers = {event_type: [] for event_type in EventType}
+        self._register_components()
 
         logger.info('Instantiating {} data handler'.format(self.frequency))
         if self.frequency == 'ticks':
-            self.data_handler = HistoricFxTickPriceHandler(data_provider=self.provider, symbols_list=self.symbol_list,
-                                                           start_time=self.start_time, end_time=self.end_time,
-                                                           events_queue=self.events_queue)
+            handler_kwargs = dict(data_provider=self.provider, symbols_list=self.symbol_list,
+                                  start_time=self.start_time, end_time=self.end_time,
+                                  batch_size=self.batch_size, use_cache=self.use_cache,
+                                  merge_streams=self.merge_streams)
+            if self.producer:
+                # price handler runs in a background thread/process
+                self.data_handler = BackgroundPriceHandler(HistoricFxTickPriceHandler, handler_kwargs,
+                                                           events_queue=self.events_queue, mode=self.producer,
+                                                           max_size=self.producer_queue_size)
+            else:
+                self.data_handler = HistoricFxTickPriceHandler(events_queue=self.events_queue,
+                                                               event_pool=self.event_pool(EventType.TICK),
+                                                               **handler_kwargs)
         else:
             pass
             # self.data_handler = HistoricBarPriceHandler(data_provider=self.provider, symbols_list=self.symbol_list,
@@ -41,12 +98,79 @@ class Backtester:
         logger.info('DataHandler ready. {}'.format(self.data_handler))
 
 
-    def run_the_queue(self):
-
+    def event_pool(self, event_type):
+        """Pool of recycled events of a type, None if not pooled
+        """
+        return self._event_pools.get(event_type)
+
+    def register_handler(self, event_type, handler):
+        """Register a callable to be called with every event of a type
+        """
+        self._handlers[event_type].append(handler)
+
+    def _register_components(self):
+        """Register the backtest components to the events they handle
+        """
+        if self.strategy is not None:
+            for event_type in (EventType.TICK, EventType.TICK_BATCH, EventType.BAR):
+                self.register_handler(event_type, self.strategy.calculate_signals)
+        if self.portfolio is not None:
+            self.register_handler(EventType.SIGNAL, self.portfolio.update_signal)
+            self.register_handler(EventType.FILL, self.portfolio.update_fill)
+        if self.execution_handler is not None:
+            self.register_handler(EventType.ORDER, self.execution_handler.execute_order)
+
+    def _dispatch(self, event):
+        for handler in self._handlers[event.type]:
+            handler(event)
+        pool = self._event_pools.get(event.type)
+        if pool is not None:
+            pool.release(event)
+
+    def _run_queue_loop(self):
         while True:
             self.data_handler.stream_next()
-            event = self.events_queue.get()
+            while not self.events_queue.empty():
+                self._dispatch(self.events_queue.get())
+            if not self.data_handler.continue_backtest:
+                break
+
+    def _run_fast_loop(self):
+        # local names, avoid attribute lookups on every event
+        events = self.events_queue
+        handlers = self._handlers
+        pools = self._event_pools
+        data_handler = self.data_handler
+        stream_next = data_handler.stream_next
+
+        while True:
+            stream_next()
+            while events:
+                event = events.popleft()
+                for handler in handlers[event.type]:
+                    handler(event)
+                if pools:
+                    pool = pools.get(event.type)
+                    if pool is not None:
+                        pool.release(event)
+            if not data_handler.continue_backtest:
+                break
+
+    def run_the_queue(self):
 
+        gc_was_enabled = gc.isenabled()
+        if self.pause_gc:
+            gc.disable()
+        try:
+            if self.fast_loop:
+                self._run_fast_loop()
+            else:
+                self._run_queue_loop()
+        finally:
+            if self.producer:
+                self.data_handler.close()
+            if gc_was_enabled:
+                gc.enable()
 
 
 
@@ -54,7 +178,6 @@ class Backtester:
 
 if __name__ == '__main__':
     setup_logging()
-    logger = logging.getLogger('Backtester')
 
     start = datetime.datetime.now()
     symbols = ['AUDCHF', 'AUDCAD']
@@ -0,0 +1,156 @@
+#
+import logging
+import multiprocessing
+import queue
+import threading
+import traceback
+
+# Marks the end of the data in the buffer
+_END_OF_DATA = None
+
+# Seconds waiting for an event before checking the producer is alive
+_POLL_TIMEOUT = 0.5
+
+
+class _ProducerError:
+    """Exception raised inside the producer, passed to the consumer as text
+    so it can cross process boundaries.
+    """
+
+    def __init__(self, trace):
+        self.trace = trace
+
+
+class _StoppableQueue:
+    """Bounded queue whose put blocks while full (backpressure) until there
+    is room or the stop flag is set.
+    """
+
+    def __init__(self, buffer, stop):
+        self.buffer = buffer
+        self.stop = stop
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+def _produce(handler_class, handler_kwargs, buffer, stop):
+    """Body of the producer thread or process. Builds the price handler
+    and streams all its events into the buffer.
+    """
+    out = _StoppableQueue(buffer, stop)
+    try:
+        handler = handler_class(events_queue=out, **handler_kwargs)
+        while handler.continue_backtest and not stop.is_set():
+            handler.stream_next()
+        out.put(_END_OF_DATA)
+    except Exception:
+        out.put(_ProducerError(traceback.format_exc()))
+
+
+class BackgroundPriceHandler:
+    """BackgroundPriceHandler runs a price handler as a producer in a
+    separate thread or process, so database fetch, decoding and event
+    construction overlap with strategy and portfolio work.
+
+    Events are pushed into a bounded buffer; when it is full the producer
+    waits for the backtest to catch up. stream_next moves the next ready
+    event onto the events queue, the same interface as the wrapped handler.
+
+    The price handler is built inside the producer, from its class and
+    keyword arguments, as database clients can not be shared across
+    processes.
+    """
+
+    def __init__(self, handler_class, handler_kwargs, events_queue,
+                 mode='thread', max_size=1000):
+        """
+        :param handler_class: price handler class, ex: HistoricFxTickPriceHandler
+        :param handler_kwargs: arguments of the handler but events_queue
+        :param events_queue: backtest events queue
+        :param mode: 'thread' / 'process'
+        :param max_size: max number of events waiting in the buffer
+        """
+        self.events_queue = events_queue
+        self.continue_backtest = True
+        self.mode = mode
+
+        if mode == 'thread':
+            self._buffer = queue.Queue(maxsize=max_size)
+            self._stop = threading.Event()
+            worker = threading.Thread
+        elif mode == 'process':
+            self._buffer = multiprocessing.Queue(maxsize=max_size)
+            self._stop = multiprocessing.Event()
+            worker = multiprocessing.Process
+        else:
+            raise ValueError('Unknown producer mode {}'.format(mode))
+
+        self._worker = worker(target=_produce,
+                              args=(handler_class, handler_kwargs,
+                                    self._buffer, self._stop),
+                              daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def is_tick():
+        return True
+
+    @staticmethod
+    def is_bar():
+        return False
+
+    def stream_next(self):
+        """Place the next event from the producer onto the event queue.
+        """
+        if not self.continue_backtest:
+            return
+
+        event = self._next_event()
+        if event is _END_OF_DATA:
+            self.close()
+            return
+        if isinstance(event, _ProducerError):
+            self.close()
+            logging.error('Price handler producer failed:\n'
+                          '{}'.format(event.trace))
+            raise SystemError
+
+        self.events_queue.put(event)
+
+    def _next_event(self):
+        """Wait for the next event in the buffer. A producer killed before
+        it could report (OOM, SIGKILL) raises SystemError instead of
+        waiting forever.
+        """
+        producer_gone = False
+        while True:
+            try:
+                return self._buffer.get(timeout=_POLL_TIMEOUT)
+            except queue.Empty:
+                if producer_gone:
+                    break
+                # one more wait, events put just before the producer ended
+                # may still be on their way
+                producer_gone = not self._worker.is_alive()
+
+        self.close()
+        logging.error('Price handler producer ended without finishing, '
+                      'exit code {}'.format(getattr(self._worker,
+                                                    'exitcode', None)))
+        raise SystemError
+
+    def close(self, timeout=5):
+        """Stop the producer and wait for it to finish.
+        """
+        self.continue_backtest = False
+        self._stop.set()
+        self._worker.join(timeout)
+        if self.mode == 'process' and self._worker.is_alive():
+            self._worker.terminate()
@@ -1,9 +1,16 @@
 #
-import logging
-from common.utilities import iter_islast
+import heapq
+from itertools import chain, islice
+from operator import itemgetter
+
+import numpy as np
+
+from common.utilities import threaded_prefetch
 from databases.influx_manager import influx_client
-from influxdb.exceptions import *
-from events import TickEvent
+from databases.tick_cache import TickCache
+from databases.tick_pages import tick_pages
+from events import TickEvent, TickBatchEvent
+from price_parser import PriceParser
 
 
 class HistoricFxTickPriceHandler:
@@ -13,10 +20,32 @@ class HistoricFxTickPriceHandler:
     to a live trading interface.
 
     Works with FX symbols.
+
+    If batch_size is given, the ticks are placed onto the queue as
+    TickBatchEvents of up to batch_size ticks instead of one TickEvent
+    per tick.
+
+    If use_cache is True, ticks are read from the local TickCache, which
+    is filled from the database only on a miss.
+
+    If merge_streams is True, each symbol is queried on its own in pages
+    fetched concurrently in background threads, and the streams are merged
+    by time.
+
+    Tick times are numpy.datetime64[ns] UTC whatever the mode, as the
+    times of TickBatchEvents and BarEvents.
+
+    Ticks from the database are fetched in pages of page_size ticks, with up
+    to prefetch_depth pages per stream buffered ahead of the backtest.
+
+    If an EventPool of TickEvents is given, tick events are recycled from
+    it instead of created.
     """
 
     def __init__(self, symbols_list, data_provider, start_time,
-                 end_time, events_queue):
+                 end_time, events_queue, batch_size=None, use_cache=False,
+                 merge_streams=False, page_size=10000, prefetch_depth=2,
+                 event_pool=None):
 
         self.symbols_list = symbols_list
         self.data_provider = data_provider
@@ -24,13 +53,28 @@ class HistoricFxTickPriceHandler:
         self.end_time = end_time
         self.continue_backtest = True
         self.events_queue = events_queue
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.merge_streams = merge_streams
+        self.page_size = page_size
+        self.prefetch_depth = prefetch_depth
+        self.event_pool = event_pool
         self._sec_master_data = None
+        self._cache_position = 0
         self._tick_table = 'fx_ticks'
         self.symbol = {}
 
-        self. _database_query(self.symbols_list,
+        if self.use_cache:
+            self._cache_query(self.symbols_list,
                               self.start_time,
                               self.end_time)
+        elif self.merge_streams:
+            # streams are opened lazily in _get_streaming_ticks
+            pass
+        else:
+            self._database_query(self.symbols_list,
+                                 self.start_time,
+                                 self.end_time)
 
         self.tick_stream = self._get_streaming_ticks()
 
@@ -42,62 +86,106 @@ class HistoricFxTickPriceHandler:
     def is_bar():
         return False
 
-    def _query_constructor(self, symbols_list, s_time, e_time):
-        """CQL statement constructor for multiple symbols
-        """
-        all_symbols = ''
-        for each_symbol, islast in iter_islast(symbols_list):
-            str_to_add = "symbol=\'{}\'".format(each_symbol)
-
-            all_symbols += str_to_add
-
-            if not islast:
-                all_symbols += ' OR '
-
-        final_statement = "SELECT time, ask, bid, provider, symbol " \
-                          "FROM \"{}\" " \
-                          "WHERE provider=\'{}\' " \
-                          "AND time >= \'{}\' " \
-                          "AND time < \'{}\' ".format(self._tick_table,
-                                                      self.data_provider,
-                                                      s_time,
-                                                      e_time)
-
-        return final_statement + " AND (" + all_symbols + ")"
-
     def _database_query(self, symbols_list, s_time, e_time):
-        """Get tick data for a selected symbol over a period of time
+        """Get tick data for the selected symbols over a period of time.
+        Pages of ticks are fetched on demand with a time cursor, up to
+        prefetch_depth pages ahead in a background thread, so memory is
+        bounded whatever the length of the period.
 
         :param symbols_list: the symbols to query about
         :param s_time: start datetime object/string
         :param e_time: end datetime object/string
 
-        :return Influx ResultSet
+        :return generator of pages of ticks
         """
-        try:
-            client = influx_client(client_type='client', user_type='reader')
-            final_statement = self._query_constructor(symbols_list,
-                                                      s_time,
-                                                      e_time)
-            self._sec_master_data = client.query(query=final_statement,
-                                                 chunked=True,
-                                                 chunk_size=1000)
-            client.close()
-        except (InfluxDBClientError, InfluxDBServerError):
-            logging.exception('Can not query securities master.')
-            raise SystemError
+        pages = tick_pages(table=self._tick_table,
+                           provider=self.data_provider,
+                           symbols_list=symbols_list,
+                           start_time=s_time,
+                           end_time=e_time,
+                           page_size=self.page_size,
+                           epoch='ns')
+        self._sec_master_data = threaded_prefetch(pages,
+                                                  depth=self.prefetch_depth)
+
+    def _cache_query(self, symbols_list, s_time, e_time):
+        """Get tick data for the selected symbols from the local tick cache
+
+        :return dict of arrays
+        """
+        cache = TickCache(table=self._tick_table)
+        self._sec_master_data = cache.ticks(provider=self.data_provider,
+                                            symbols_list=symbols_list,
+                                            start_time=s_time,
+                                            end_time=e_time)
 
     def _get_streaming_ticks(self):
         """Generator that returns the latest tick from the data feed.
         """
-        return self._sec_master_data.get_points()
+        if self.use_cache:
+            return self._cached_ticks()
+        if self.merge_streams:
+            return self._merged_streams()
+        return chain.from_iterable(self._sec_master_data)
 
-    @staticmethod
-    def _create_event(tick):
+    def _symbol_stream(self, symbol):
+        """Ticks of one symbol, pages fetched ahead in a background thread
+        """
+        pages = tick_pages(table=self._tick_table,
+                           provider=self.data_provider,
+                           symbols_list=[symbol],
+                           start_time=self.start_time,
+                           end_time=self.end_time,
+                           page_size=self.page_size,
+                           epoch='ns')
+        return chain.from_iterable(threaded_prefetch(pages,
+                                                     depth=self.prefetch_depth))
+
+    def _merged_streams(self):
+        """K-way merge by time of the streams of every symbol
+        """
+        streams = [self._symbol_stream(each_symbol)
+                   for each_symbol in self.symbols_list]
+        return heapq.merge(*streams, key=itemgetter('time'))
+
+    def _cached_ticks(self):
+        """Generator of tick dictionaries from the cached arrays
+        """
+        data = self._sec_master_data
+        for code, time, bid, ask in zip(data['symbol_code'].tolist(),
+                                        data['time'],
+                                        data['bid'].tolist(),
+                                        data['ask'].tolist()):
+            yield {'symbol': self.symbols_list[code],
+                   'provider': self.data_provider,
+                   'time': time,
+                   'bid': bid,
+                   'ask': ask}
+
+    def _create_event(self, tick):
         """Obtain all elements of the tick from the tick dictionary
         and returns a tick event
         """
-        return TickEvent(tick)
+        # integer ns from the database, datetime64 from the cache
+        time = np.datetime64(tick['time'], 'ns')
+        if self.event_pool is None:
+            return TickEvent(tick['symbol'],
+                             tick['provider'],
+                             time,
+                             PriceParser.parse(tick['bid']),
+                             PriceParser.parse(tick['ask']))
+        return self.event_pool.acquire(tick['symbol'],
+                                       tick['provider'],
+                                       time,
+                                       PriceParser.parse(tick['bid']),
+                                       PriceParser.parse(tick['ask']))
+
+    def _create_batch_event(self, ticks):
+        """Returns a tick batch event from a list of tick dictionaries
+        """
+        return TickBatchEvent.from_ticks(ticks,
+                                         symbols=self.symbols_list,
+                                         provider=self.data_provider)
 
     # def _store_event(self, event):
     #     """Store price event for bid/ask
@@ -111,6 +199,10 @@ class HistoricFxTickPriceHandler:
     def stream_next(self):
         """Place the next TickEvent onto the event queue.
         """
+        if self.batch_size:
+            self.stream_next_batch()
+            return
+
         try:
             tick = next(self.tick_stream)
         except StopIteration:
@@ -123,6 +215,38 @@ class HistoricFxTickPriceHandler:
         # self._store_event(tick_ev)
         self.events_queue.put(tick_ev)
 
+    def stream_next_batch(self):
+        """Place the next TickBatchEvent onto the event queue.
+        """
+        if self.use_cache:
+            self._stream_next_cached_batch()
+            return
+
+        ticks = list(islice(self.tick_stream, self.batch_size or 1))
+        if not ticks:
+            self.continue_backtest = False
+            return
+
+        self.events_queue.put(self._create_batch_event(ticks))
+
+    def _stream_next_cached_batch(self):
+        """Slice the next TickBatchEvent straight from the cached arrays
+        """
+        data = self._sec_master_data
+        start = self._cache_position
+        end = start + self.batch_size
+        if start >= len(data['time']):
+            self.continue_backtest = False
+            return
+
+        self._cache_position = end
+        self.events_queue.put(TickBatchEvent(symbols=self.symbols_list,
+                                             provider=self.data_provider,
+                                             symbol_code=data['symbol_code'][start:end],
+                                             time=data['time'][start:end],
+                                             bid=data['bid'][start:end],
+                                             ask=data['ask'][start:end]))
+
 
 class HistoricBarPriceHandler:
     """
@@ -0,0 +1,107 @@
+#
+import numpy as np
+
+from common.settings import AlgoSettings
+from databases.tick_store import symbol_ticks
+from events import TickBatchEvent
+
+
+class TickStoreFxTickPriceHandler:
+    """TickStoreFxTickPriceHandler replays ticks from the memory mapped
+    tick store instead of the Securities Master Database.
+
+    Ticks of all symbols are merged in time order and placed onto the
+    queue as TickBatchEvents of about batch_size ticks, sliced from the
+    memory maps. There is no parsing and no Python object per tick.
+
+    Works with FX symbols.
+    """
+
+    def __init__(self, symbols_list, data_provider, start_time,
+                 end_time, events_queue, batch_size=10000,
+                 store_dirpath=None):
+
+        self.symbols_list = symbols_list
+        self.data_provider = data_provider
+        self.start_time = start_time
+        self.end_time = end_time
+        self.continue_backtest = True
+        self.events_queue = events_queue
+        self.batch_size = batch_size
+        self.symbol = {}
+
+        if store_dirpath is None:
+            store_dirpath = AlgoSettings().store_ticks_fxcm()
+        self.store_dirpath = store_dirpath
+
+        # For each symbol: list of week segments, current segment and
+        # position inside it.
+        self._segments = [symbol_ticks(symbol=each_symbol,
+                                       start_time=self.start_time,
+                                       end_time=self.end_time,
+                                       store_dirpath=self.store_dirpath)
+                          for each_symbol in self.symbols_list]
+        self._segment_idx = [0] * len(self.symbols_list)
+        self._position = [0] * len(self.symbols_list)
+
+    @staticmethod
+    def is_tick():
+        return True
+
+    @staticmethod
+    def is_bar():
+        return False
+
+    def _current_segment(self, code):
+        """Current week segment for a symbol code, None when exhausted
+        """
+        segments = self._segments[code]
+        while self._segment_idx[code] < len(segments):
+            segment = segments[self._segment_idx[code]]
+            if self._position[code] < len(segment):
+                return segment
+            self._segment_idx[code] += 1
+            self._position[code] = 0
+        return None
+
+    def stream_next(self):
+        """Place the next TickBatchEvent onto the event queue.
+        """
+        active = [(code, self._current_segment(code))
+                  for code in range(len(self.symbols_list))]
+        active = [(code, segment) for code, segment in active
+                  if segment is not None]
+
+        if not active:
+            self.continue_backtest = False
+            return
+
+        # Time cut: every tick before it, for all symbols, goes in this
+        # batch. Taken as the earliest among the batch_size-th tick of each
+        # symbol, it is always inside the current segment of every symbol.
+        cut = min(segment['time'][min(self._position[code] + self.batch_size,
+                                      len(segment)) - 1]
+                  for code, segment in active)
+
+        pieces = []
+        codes = []
+        for code, segment in active:
+            pos = self._position[code]
+            end = pos + np.searchsorted(segment['time'][pos:pos + self.batch_size],
+                                        cut, side='right')
+            if end > pos:
+                pieces.append(segment[pos:end])
+                codes.append(np.full(end - pos, code, dtype=np.int16))
+                self._position[code] = end
+
+        records = np.concatenate(pieces)
+        symbol_code = np.concatenate(codes)
+        order = np.argsort(records['time'], kind='mergesort')
+        records = records[order]
+
+        self.events_queue.put(TickBatchEvent(symbols=self.symbols_list,
+                                             provider=self.data_provider,
+                                             symbol_code=symbol_code[order],
+                                             time=records['time'].view('datetime64[ns]'),
+                                             bid=records['bid'],
+                                             ask=records['ask']))
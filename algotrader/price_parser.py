@@ -26,38 +26,78 @@ class PriceParser(object):
     """Parse Methods. Multiplies a float out into an int if needed."""
 
     @staticmethod
-    @dispatch(int_t)
     def parse(x):
+        # Fast path for the common types, skips multipledispatch
+        x_type = type(x)
+        if x_type is float:
+            return int(x * PriceParser.PRICE_MULTIPLIER)
+        elif x_type is str:
+            return int(float(x) * PriceParser.PRICE_MULTIPLIER)
+        elif x_type is int:
+            return x
+        return PriceParser._parse_dispatch(x)
+
+    @staticmethod
+    @dispatch(int_t)
+    def _parse_dispatch(x):
         return x
 
     @staticmethod
     @dispatch(str)
-    def parse(x):
+    def _parse_dispatch(x):
         return int(float(x) * PriceParser.PRICE_MULTIPLIER)
 
     @staticmethod
     @dispatch(float)
-    def parse(x):
+    def _parse_dispatch(x):
         return int(x * PriceParser.PRICE_MULTIPLIER)
 
-    """Display Methods. Multiplies a float out into an int if needed."""
-
     @staticmethod
-    @dispatch(int_t)
-    def display(x):
-        return round(x / PriceParser.PRICE_MULTIPLIER, 2)
+    def parse_array(x):
+        """Parse a whole column of prices at once.
+
+        :param x: NumPy array, pandas Series or sequence of floats/strings
+        :return: int64 NumPy array
+        """
+        values = np.asarray(x)
+        if values.dtype.kind in 'iu':
+            return values.astype(np.int64, copy=False)
+        if values.dtype.kind != 'f':
+            # strings as read from CSV files or objects
+            values = values.astype(np.float64)
+        return (values * PriceParser.PRICE_MULTIPLIER).astype(np.int64)
+
+    """Display Methods. Multiplies a float out into an int if needed."""
 
     @staticmethod
-    @dispatch(float)
-    def display(x):
-        return round(x, 2)
+    def display(x, dp=2):
+        # Fast path for the common types, skips multipledispatch
+        x_type = type(x)
+        if x_type is int:
+            return round(x / PriceParser.PRICE_MULTIPLIER, dp)
+        elif x_type is float:
+            return round(x, dp)
+        return PriceParser._display_dispatch(x, dp)
 
     @staticmethod
     @dispatch(int_t, int)
-    def display(x, dp):
+    def _display_dispatch(x, dp):
         return round(x / PriceParser.PRICE_MULTIPLIER, dp)
 
     @staticmethod
     @dispatch(float, int)
-    def display(x, dp):
+    def _display_dispatch(x, dp):
         return round(x, dp)
+
+    @staticmethod
+    def display_array(x, dp=2):
+        """Display a whole column of parsed prices at once.
+
+        :param x: int64 NumPy array or pandas Series
+        :param dp: decimal places
+        :return: float64 NumPy array
+        """
+        values = np.asarray(x)
+        if values.dtype.kind in 'iu':
+            values = values / PriceParser.PRICE_MULTIPLIER
+        return np.round(values, dp)
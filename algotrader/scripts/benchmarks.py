@@ -0,0 +1,304 @@
+# coding=utf-8
+"""
+Micro benchmarks of the backtest hot paths on synthetic data.
+No database needed.
+
+Run from the algotrader directory:
+    python -m scripts.benchmarks [name ...]
+"""
+import datetime
+import gc
+import gzip
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BarAggregator
+from databases.fxcm_tick_insert import fxcm_datetime_parser, my_date_parser
+from databases.influx_manager import line_protocol
+from databases.ticks2bars import ticks_to_bars
+from events import BarEvent, EventType, TickBatchEvent, TickEvent
+from execution_handlers.backtester import Backtester
+from price_parser import PriceParser
+
+
+def best_time(function, repeat=3):
+    """Best wall time in seconds of a few runs of function
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def synthetic_ticks(n, symbols=('EURUSD', 'GBPUSD')):
+    """List of n tick dictionaries as returned by the securities master
+    """
+    return [{'time': '2018-02-06T15:00:{:02d}.{:03d}Z'.format(i // 1000 % 60,
+                                                               i % 1000),
+             'symbol': symbols[i % len(symbols)],
+             'provider': 'fxcm',
+             'bid': 1.23456 + i % 100 * 1e-5,
+             'ask': 1.23466 + i % 100 * 1e-5}
+            for i in range(n)]
+
+
+def synthetic_fxcm_week_file(file_path, n):
+    """Write a FXCM like clean week file with n ticks
+    """
+    start = datetime.datetime(2018, 2, 4, 22)
+    steps = np.cumsum(np.random.RandomState(0).randint(1, 600, n))
+    times = pd.to_datetime(start) + pd.to_timedelta(steps, unit='ms')
+    prices = 1.2345 + np.random.RandomState(1).randint(0, 100, n) * 1e-5
+
+    with gzip.open(file_path, 'wt') as f:
+        f.write('DateTime,Bid,Ask\n')
+        for t, p in zip(times, prices):
+            f.write('{},{:.5f},{:.5f}\n'.format(
+                t.strftime('%m/%d/%Y %H:%M:%S.%f')[:-3], p, p + 1e-4))
+
+
+class SyntheticTickPriceHandler:
+    """Price handler placing pre built TickEvents onto the queue
+    """
+
+    def __init__(self, events, events_queue):
+        self.tick_stream = iter(events)
+        self.events_queue = events_queue
+        self.continue_backtest = True
+
+    def stream_next(self):
+        try:
+            event = next(self.tick_stream)
+        except StopIteration:
+            self.continue_backtest = False
+            return
+        self.events_queue.put(event)
+
+
+class SyntheticParsedTickPriceHandler:
+    """Price handler creating TickEvents from parsed values, recycled from
+    an event pool if given
+    """
+
+    def __init__(self, parsed_ticks, events_queue, event_pool=None):
+        self.tick_stream = iter(parsed_ticks)
+        self.events_queue = events_queue
+        self.event_pool = event_pool
+        self.continue_backtest = True
+
+    def stream_next(self):
+        try:
+            tick = next(self.tick_stream)
+        except StopIteration:
+            self.continue_backtest = False
+            return
+        if self.event_pool is None:
+            self.events_queue.put(TickEvent(*tick))
+        else:
+            self.events_queue.put(self.event_pool.acquire(*tick))
+
+
+class _CountingStrategy:
+    def __init__(self):
+        self.count = 0
+
+    def calculate_signals(self, event):
+        self.count += 1
+
+
+def bench_event_loop(n=200000):
+    """Events per second of the Backtester loop, queue.Queue vs EventDeque
+    """
+    events = [TickEvent.from_dict(tick) for tick in synthetic_ticks(n)]
+
+    for fast_loop in (False, True):
+        strategy = _CountingStrategy()
+        backtester = Backtester(strategy=strategy, provider='fxcm',
+                                symbol_list=['EURUSD', 'GBPUSD'],
+                                start_time=None, end_time=None,
+                                frequency='synthetic', initial_capital=100,
+                                execution_handler=None, portfolio=None,
+                                fast_loop=fast_loop)
+        backtester.data_handler = SyntheticTickPriceHandler(
+            events, backtester.events_queue)
+
+        elapsed = best_time(backtester.run_the_queue, repeat=1)
+        assert strategy.count == n
+        print('event loop {:>12}: {:>12,.0f} events/s'.format(
+            'EventDeque' if fast_loop else 'queue.Queue', n / elapsed))
+
+
+def bench_event_creation(n=200000):
+    """Cost of creating TickEvents and BarEvents
+    """
+    ticks = synthetic_ticks(n)
+    parsed = [(t['symbol'], t['provider'], t['time'],
+               12345600, 12346600) for t in ticks]
+
+    elapsed = best_time(lambda: [TickEvent.from_dict(t) for t in ticks])
+    print('TickEvent.from_dict: {:>8.0f} ns/event'.format(elapsed / n * 1e9))
+
+    elapsed = best_time(lambda: [TickEvent(*p) for p in parsed])
+    print('TickEvent parsed:    {:>8.0f} ns/event'.format(elapsed / n * 1e9))
+
+    elapsed = best_time(
+        lambda: [BarEvent(p[0], p[2], 60, p[3], p[4], p[3], p[4], 0)
+                 for p in parsed])
+    print('BarEvent:            {:>8.0f} ns/event'.format(elapsed / n * 1e9))
+
+
+def bench_event_pool(n=1000000):
+    """Backtest loop with and without recycling events, and with the
+    garbage collector paused. Wall time is measured without tracemalloc,
+    the allocations in a second run with it.
+    """
+    parsed = [(t['symbol'], t['provider'], t['time'], 12345600, 12346600)
+              for t in synthetic_ticks(n)]
+
+    def backtest(event_pool, pause_gc):
+        strategy = _CountingStrategy()
+        backtester = Backtester(strategy=strategy, provider='fxcm',
+                                symbol_list=['EURUSD', 'GBPUSD'],
+                                start_time=None, end_time=None,
+                                frequency='synthetic', initial_capital=100,
+                                execution_handler=None, portfolio=None,
+                                fast_loop=True, event_pool=event_pool,
+                                pause_gc=pause_gc)
+        backtester.data_handler = SyntheticParsedTickPriceHandler(
+            parsed, backtester.events_queue,
+            event_pool=backtester.event_pool(EventType.TICK))
+        return backtester, strategy
+
+    for event_pool, pause_gc in ((False, False), (False, True),
+                                 (True, False), (True, True)):
+        elapsed = []
+        collections = gc.get_stats()[0]['collections']
+        for _ in range(3):
+            backtester, strategy = backtest(event_pool, pause_gc)
+            elapsed.append(best_time(backtester.run_the_queue, repeat=1))
+            assert strategy.count == n
+        collections = gc.get_stats()[0]['collections'] - collections
+
+        backtester, strategy = backtest(event_pool, pause_gc)
+        pool = backtester.event_pool(EventType.TICK)
+        tracemalloc.start()
+        backtester.run_the_queue()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        created = n if pool is None else pool.created
+        print('pool={!s:<5} pause_gc={!s:<5}: {:>7.3f} s, {:>9,} events '
+              'allocated, {:>5,} B peak, {:>5,} gen0 '
+              'collections'.format(event_pool, pause_gc, min(elapsed),
+                                   created, peak, collections))
+
+
+def bench_fxcm_date_parser(n=1000000):
+    """my_date_parser row by row vs fxcm_datetime_parser on the datetime
+    column of a week file with n ticks
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'EURUSD_2018_6.csv.gz')
+        synthetic_fxcm_week_file(file_path, n)
+        column = pd.read_csv(file_path, skiprows=1, usecols=[0],
+                             names=['price_datetime'])['price_datetime']
+
+    elapsed = best_time(lambda: column.map(my_date_parser), repeat=1)
+    print('my_date_parser:       {:>8.3f} s'.format(elapsed))
+    elapsed = best_time(lambda: fxcm_datetime_parser(column))
+    print('fxcm_datetime_parser: {:>8.3f} s'.format(elapsed))
+
+
+def bench_line_protocol(n=200000):
+    """Points per second building the gzipped line protocol payload of a
+    tick dataframe, versus the DataFrameClient json conversion used by
+    influx_writer (private influxdb client API).
+    """
+    index = pd.date_range('2018-02-04 22:00', periods=n, freq='250ms',
+                          tz='UTC')
+    prices = 1.2345 + np.random.RandomState(1).randint(0, 100, n) * 1e-5
+    data = pd.DataFrame({'bid': prices, 'ask': prices + 1e-4}, index=index)
+    tags = {'symbol': 'EURUSD', 'provider': 'fxcm',
+            'filename': 'EURUSD_2018_6'}
+
+    elapsed = best_time(lambda: gzip.compress(
+        line_protocol(data, ['bid', 'ask'], tags, 'fx_ticks').encode('utf-8'),
+        compresslevel=1), repeat=1)
+    print('line_protocol + gzip: {:>12,.0f} points/s'.format(n / elapsed))
+
+    try:
+        from influxdb import DataFrameClient
+        from influxdb.line_protocol import make_lines
+        client = DataFrameClient()
+        # much slower, a sample is enough
+        sample = data.iloc[:n // 10]
+        elapsed = best_time(lambda: make_lines({'points': client._convert_dataframe_to_json(
+            sample, measurement='fx_ticks', field_columns=['bid', 'ask'],
+            tags=tags, time_precision='u')}), repeat=1)
+        print('DataFrameClient json: {:>12,.0f} points/s'.format(len(sample) / elapsed))
+    except (ImportError, AttributeError, TypeError):
+        print('DataFrameClient json conversion not available')
+
+
+def bench_bar_aggregator(n=1000000):
+    """Ticks per second building 1min bars of one symbol: pandas resample
+    of ticks2bars vs BarAggregator tick by tick and in batches
+    """
+    times = (np.datetime64('2018-02-05', 'ns').astype(np.int64) +
+             np.cumsum(np.random.RandomState(0).randint(1, 600, n)) * 10 ** 6)
+    prices = 1.2345 + np.random.RandomState(1).randint(0, 100, n) * 1e-5
+    data = pd.DataFrame({'bid': prices, 'ask': prices + 1e-4},
+                        index=pd.to_datetime(times))
+
+    elapsed = best_time(lambda: ticks_to_bars(data.copy(), '1min'))
+    print('ticks_to_bars:          {:>12,.0f} ticks/s'.format(n / elapsed))
+
+    bid = PriceParser.parse_array(prices)
+    ask = PriceParser.parse_array(prices + 1e-4)
+    ticks = list(zip(times.tolist(), bid.tolist(), ask.tolist()))
+
+    def tick_by_tick():
+        aggregator = BarAggregator(periods=(60,))
+        for time, b, a in ticks:
+            aggregator.update('EURUSD', time, b, a)
+        aggregator.flush()
+
+    elapsed = best_time(tick_by_tick, repeat=1)
+    print('BarAggregator ticks:    {:>12,.0f} ticks/s'.format(n / elapsed))
+
+    batch_size = 10000
+    batches = [TickBatchEvent(('EURUSD',), 'fxcm',
+                              np.zeros(len(times[i:i + batch_size]),
+                                       dtype=np.int16),
+                              times[i:i + batch_size].astype('datetime64[ns]'),
+                              bid[i:i + batch_size], ask[i:i + batch_size])
+               for i in range(0, n, batch_size)]
+
+    def in_batches():
+        aggregator = BarAggregator(periods=(60,))
+        for batch in batches:
+            aggregator.update_batch(batch)
+        aggregator.flush()
+
+    elapsed = best_time(in_batches)
+    print('BarAggregator batches:  {:>12,.0f} ticks/s'.format(n / elapsed))
+
+
+BENCHMARKS = {'event_loop': bench_event_loop,
+              'event_creation': bench_event_creation,
+              'event_pool': bench_event_pool,
+              'fxcm_date_parser': bench_fxcm_date_parser,
+              'line_protocol': bench_line_protocol,
+              'bar_aggregator': bench_bar_aggregator}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+"""
+Shared test setup. Modules of the package import each other from the
+algotrader directory, as when run from it: "from events import TickEvent".
+"""
+import http.server
+import os
+import re
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'algotrader'))
+
+
+class FakeTickClient:
+    """Influx client answering the tick page queries of tick_pages from a
+    list of points sorted by time, with integer times
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.queries = []
+
+    def query(self, query, epoch=None):
+        self.queries.append(query)
+        cursor = int(re.search(r'time >= (\d+)', query).group(1))
+        end = int(re.search(r'time < (\d+)', query).group(1))
+        symbols = re.findall(r"symbol='(\w+)'", query)
+        limit = int(re.search(r'LIMIT (\d+)', query).group(1))
+        points = [p for p in self.points
+                  if cursor <= p['time'] < end and p['symbol'] in symbols]
+        return FakeResultSet(points[:limit])
+
+
+class FakeResultSet:
+
+    def __init__(self, points):
+        self.points = points
+
+    def get_points(self):
+        return iter(self.points)
+
+
+@pytest.fixture
+def tick_client(monkeypatch):
+    """Install a FakeTickClient for the tick pages, filled with ticks
+    """
+    import databases.tick_pages
+
+    client = FakeTickClient([])
+    monkeypatch.setattr(databases.tick_pages, 'pooled_client',
+                        lambda **kwargs: client)
+    return client
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.files, with Range support unless server.ranges is
+    False. With server.cut_at the connection is closed after that many
+    bytes of the body.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and server.ranges:
+            start = int(range_header[len('bytes='):-1])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if server.cut_at is not None:
+            body = body[:server.cut_at]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server():
+    """Local http server of the files put in its files dictionary, by url
+    path
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    server.files = {}
+    server.ranges = True
+    server.cut_at = None
+    server.requests = []
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,),
+                              daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,97 @@
+import os
+import queue
+import signal
+
+import pytest
+
+from price_handlers.background import BackgroundPriceHandler
+
+
+class CountingHandler:
+    """Price handler putting the integers up to n onto its queue
+    """
+
+    def __init__(self, events_queue, n, fail_at=None, kill_at=None):
+        self.events_queue = events_queue
+        self.n = n
+        self.fail_at = fail_at
+        self.kill_at = kill_at
+        self.i = 0
+        self.continue_backtest = True
+
+    def stream_next(self):
+        if self.i == self.fail_at:
+            raise ValueError('broken feed')
+        if self.i == self.kill_at:
+            os.kill(os.getpid(), signal.SIGKILL)
+        if self.i == self.n:
+            self.continue_backtest = False
+            return
+        self.events_queue.put(self.i)
+        self.i += 1
+
+
+def drain(handler, events):
+    received = []
+    while handler.continue_backtest:
+        handler.stream_next()
+        while not events.empty():
+            received.append(events.get())
+    return received
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_events_in_order(mode):
+    events = queue.Queue()
+    handler = BackgroundPriceHandler(CountingHandler, {'n': 500}, events,
+                                     mode=mode, max_size=10)
+
+    assert drain(handler, events) == list(range(500))
+    assert not handler._worker.is_alive()
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_producer_error_raised(mode):
+    events = queue.Queue()
+    handler = BackgroundPriceHandler(CountingHandler,
+                                     {'n': 500, 'fail_at': 20}, events,
+                                     mode=mode, max_size=10)
+
+    with pytest.raises(SystemError):
+        drain(handler, events)
+
+
+def test_killed_producer_raised():
+    events = queue.Queue()
+    handler = BackgroundPriceHandler(CountingHandler,
+                                     {'n': 500, 'kill_at': 20}, events,
+                                     mode='process', max_size=10)
+
+    received = []
+    with pytest.raises(SystemError):
+        while handler.continue_backtest:
+            handler.stream_next()
+            received.append(events.get())
+
+    # events not flushed by the killed process are lost, no others
+    assert received == list(range(len(received)))
+    assert not handler.continue_backtest
+    assert handler._worker.exitcode == -signal.SIGKILL
+
+
+def test_close_stops_blocked_producer():
+    events = queue.Queue()
+    handler = BackgroundPriceHandler(CountingHandler, {'n': 10 ** 9}, events,
+                                     max_size=5)
+    handler.stream_next()
+
+    handler.close(timeout=2)
+
+    assert not handler._worker.is_alive()
+    assert not handler.continue_backtest
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        BackgroundPriceHandler(CountingHandler, {'n': 1}, queue.Queue(),
+                               mode='fiber')
@@ -0,0 +1,126 @@
+import gc
+
+import numpy as np
+import pytest
+
+from events import EventPool, EventType, TickEvent
+from execution_handlers.backtester import Backtester, EventDeque
+
+
+class RecordingStrategy:
+
+    def __init__(self):
+        self.events = []
+
+    def calculate_signals(self, event):
+        self.events.append(event)
+
+
+def run_backtest(tick_client, **kwargs):
+    tick_client.points = [{'time': t, 'symbol': ('EURUSD', 'USDJPY')[t % 2],
+                           'provider': 'fxcm', 'bid': 1.2, 'ask': 1.2002}
+                          for t in range(300)]
+    strategy = RecordingStrategy()
+    backtest = Backtester(strategy=strategy, provider='fxcm',
+                          symbol_list=['EURUSD', 'USDJPY'], start_time=0,
+                          end_time=300, frequency='ticks',
+                          initial_capital=100, execution_handler=None,
+                          portfolio=None, **kwargs)
+    backtest.run_the_queue()
+    return backtest, strategy.events
+
+
+def test_event_deque():
+    events = EventDeque()
+    events.put(1)
+    events.put(2)
+
+    assert events.get() == 1
+    assert len(events) == 1
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'batch_size': 64},
+                                    {'producer': 'thread'}])
+def test_fast_loop_same_events(tick_client, kwargs):
+    _, slow = run_backtest(tick_client, **kwargs)
+    backtest, fast = run_backtest(tick_client, fast_loop=True, **kwargs)
+
+    assert isinstance(backtest.events_queue, EventDeque)
+    assert [e.type for e in fast] == [e.type for e in slow]
+    if kwargs.get('batch_size'):
+        assert all(e.type is EventType.TICK_BATCH for e in fast)
+        assert sum(len(e) for e in fast) == 300
+    else:
+        assert [e.time for e in fast] == [np.datetime64(t, 'ns')
+                                          for t in range(300)]
+
+
+def test_handlers_by_event_type(tick_client):
+    backtest, _ = run_backtest(tick_client, fast_loop=True)
+    signals = []
+    backtest.register_handler(EventType.SIGNAL, signals.append)
+
+    backtest._dispatch(type('Signal', (), {'type': EventType.SIGNAL})())
+
+    assert len(signals) == 1
+
+
+def test_pause_gc_restores_collector(tick_client):
+    enabled = []
+
+    class GcStrategy(RecordingStrategy):
+        def calculate_signals(self, event):
+            enabled.append(gc.isenabled())
+
+    tick_client.points = [{'time': t, 'symbol': 'EURUSD', 'provider': 'fxcm',
+                           'bid': 1.2, 'ask': 1.2002} for t in range(10)]
+    backtest = Backtester(strategy=GcStrategy(), provider='fxcm',
+                          symbol_list=['EURUSD'], start_time=0, end_time=10,
+                          frequency='ticks', initial_capital=100,
+                          execution_handler=None, portfolio=None,
+                          fast_loop=True, pause_gc=True)
+    backtest.run_the_queue()
+
+    assert enabled == [False] * 10
+    assert gc.isenabled()
+
+
+def test_event_pool_recycles():
+    pool = EventPool(TickEvent, max_size=1)
+    first = pool.acquire('EURUSD', 'fxcm', 1, 100, 102)
+    pool.release(first)
+    pool.release(TickEvent('EURUSD', 'fxcm', 2, 100, 102))
+
+    second = pool.acquire('USDJPY', 'fxcm', 3, 200, 202)
+
+    assert second is first
+    assert (second.symbol, second.time, second.bid) == ('USDJPY', 3, 200)
+    assert pool.created == 1
+
+
+def test_event_pool_same_ticks(tick_client):
+    seen = []
+
+    class CopyingStrategy(RecordingStrategy):
+        def calculate_signals(self, event):
+            seen.append((event.symbol, event.time, event.bid, event.ask))
+
+    tick_client.points = [{'time': t, 'symbol': ('EURUSD', 'USDJPY')[t % 2],
+                           'provider': 'fxcm', 'bid': 1.2, 'ask': 1.2002}
+                          for t in range(300)]
+    ticks = {}
+    for event_pool in (False, True):
+        seen = []
+        backtest = Backtester(strategy=CopyingStrategy(), provider='fxcm',
+                              symbol_list=['EURUSD', 'USDJPY'], start_time=0,
+                              end_time=300, frequency='ticks',
+                              initial_capital=100, execution_handler=None,
+                              portfolio=None, fast_loop=True,
+                              event_pool=event_pool)
+        backtest.run_the_queue()
+        ticks[event_pool] = seen
+
+    assert ticks[True] == ticks[False]
+    assert len(ticks[True]) == 300
+    # one event in flight at a time
+    assert backtest.event_pool(EventType.TICK).created == 1
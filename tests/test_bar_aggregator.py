@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bar_aggregator import BarAggregator
+from databases.ticks2bars import ticks_to_bars
+from events import TickBatchEvent
+from price_parser import PriceParser
+
+SYMBOLS = ('EURUSD', 'USDJPY')
+
+
+def synthetic_ticks(n=3000, seed=7):
+    """Ticks of two symbols at random times over about 3 hours, with gaps
+    """
+    rng = np.random.RandomState(seed)
+    steps = rng.exponential(3.5, n).astype('timedelta64[s]')
+    steps[n // 2] += np.timedelta64(2, 'h')
+    times = np.datetime64('2018-01-02T00:00:00', 'ns') + np.cumsum(
+        steps.astype('timedelta64[ns]'))
+    codes = rng.randint(0, 2, n).astype(np.int16)
+    bids = np.round(np.where(codes, 112.5, 1.2) +
+                    np.cumsum(rng.normal(0, 1e-4, n)), 5)
+    asks = np.round(bids + rng.randint(1, 30, n) * 1e-5, 5)
+    return times, codes, bids, asks
+
+
+def batch(times, codes, bids, asks):
+    return TickBatchEvent(SYMBOLS, 'fxcm', codes, times,
+                          PriceParser.parse_array(bids),
+                          PriceParser.parse_array(asks))
+
+
+def by_symbol_and_start(bars):
+    return {(b.symbol, b.period, b.time): b for b in bars}
+
+
+@pytest.mark.parametrize('period, freq', [(60, '1min'), (300, '5min')])
+def test_same_bars_as_ticks_to_bars(period, freq):
+    times, codes, bids, asks = synthetic_ticks()
+    aggregator = BarAggregator(periods=(period,))
+
+    bars = []
+    for t, c, b, a in zip(times, codes.tolist(), bids.tolist(), asks.tolist()):
+        bars.extend(aggregator.update(SYMBOLS[c], t, PriceParser.parse(b),
+                                      PriceParser.parse(a)))
+    bars.extend(aggregator.flush())
+    bars = by_symbol_and_start(bars)
+
+    for code, symbol in enumerate(SYMBOLS):
+        mask = codes == code
+        ticks = pd.DataFrame({'bid': bids[mask], 'ask': asks[mask]},
+                             index=pd.DatetimeIndex(times[mask]))
+        expected = ticks_to_bars(ticks, freq)
+
+        assert len([k for k in bars if k[0] == symbol]) == len(expected)
+        for start, row in expected.iterrows():
+            bar = bars[(symbol, period, np.datetime64(start.value, 'ns'))]
+            # mid prices differ by the truncation of the parsed prices
+            for field, value in (('open_price', row['open']),
+                                 ('high_price', row['high']),
+                                 ('low_price', row['low']),
+                                 ('close_price', row['close'])):
+                assert abs(getattr(bar, field) -
+                           value * PriceParser.PRICE_MULTIPLIER) <= 1.5
+            assert bar.volume == row['ticks']
+
+
+def test_batches_same_as_ticks():
+    times, codes, bids, asks = synthetic_ticks()
+    by_tick = BarAggregator(periods=(60, 900))
+    by_batch = BarAggregator(periods=(60, 900))
+
+    tick_bars = []
+    for tick in batch(times, codes, bids, asks).ticks():
+        tick_bars.extend(by_tick.on_tick(tick))
+    tick_bars.extend(by_tick.flush())
+
+    batch_bars = []
+    for start in range(0, len(times), 97):
+        end = start + 97
+        batch_bars.extend(by_batch.on_tick(batch(times[start:end],
+                                                 codes[start:end],
+                                                 bids[start:end],
+                                                 asks[start:end])))
+    batch_bars.extend(by_batch.flush())
+
+    def fields(bar):
+        return (bar.symbol, bar.period, bar.time, bar.open_price,
+                bar.high_price, bar.low_price, bar.close_price, bar.volume)
+
+    assert sorted(map(fields, batch_bars)) == sorted(map(fields, tick_bars))
+
+
+def test_bars_closed_in_end_time_order():
+    times, codes, bids, asks = synthetic_ticks()
+    aggregator = BarAggregator(periods=(60, 300))
+
+    bars = aggregator.update_batch(batch(times, codes, bids, asks))
+    ends = [b.time + np.timedelta64(b.period, 's') for b in bars]
+
+    assert ends == sorted(ends)
+    assert all(end <= times[-1] for end in ends)
+
+
+def test_bars_put_onto_queue():
+    events = []
+    queue = type('Queue', (), {'put': lambda self, e: events.append(e)})()
+    aggregator = BarAggregator(periods=(60,), events_queue=queue)
+
+    aggregator.update('EURUSD', '2018-01-02T00:00:01Z', 12000000, 12000200)
+    closed = aggregator.update('EURUSD', '2018-01-02T00:01:01Z', 12000000,
+                               12000200)
+
+    assert events == closed
+    assert len(closed) == 1
+
+
+@pytest.mark.parametrize('period', [0, 7, 86401])
+def test_period_must_divide_a_day(period):
+    with pytest.raises(ValueError):
+        BarAggregator(periods=(period,))
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from events import (BarEvent, EventType, FillEvent, OrderEvent,
+                    SentimentEvent, SignalEvent, TickBatchEvent, TickEvent)
+from price_parser import PriceParser
+
+TICKS = [{'time': '2018-01-01T00:00:00.1Z', 'symbol': 'EURUSD',
+          'bid': 1.2001, 'ask': 1.2003},
+         {'time': '2018-01-01T00:00:00.2Z', 'symbol': 'USDJPY',
+          'bid': 112.501, 'ask': 112.505},
+         {'time': '2018-01-01T00:00:01Z', 'symbol': 'EURUSD',
+          'bid': 1.2002, 'ask': 1.2004}]
+
+
+def test_batch_from_ticks():
+    batch = TickBatchEvent.from_ticks(TICKS, ['EURUSD', 'USDJPY'], 'fxcm')
+
+    assert batch.type is EventType.TICK_BATCH
+    assert len(batch) == 3
+    assert batch.symbol_code.tolist() == [0, 1, 0]
+    assert batch.time.dtype == np.dtype('datetime64[ns]')
+    assert batch.time[2] == np.datetime64('2018-01-01T00:00:01', 'ns')
+    assert batch.bid.dtype == np.int64
+    assert batch.bid.tolist() == [PriceParser.parse(t['bid']) for t in TICKS]
+    assert batch.ask.tolist() == [PriceParser.parse(t['ask']) for t in TICKS]
+    assert batch.symbol_mask('EURUSD').tolist() == [True, False, True]
+
+
+def test_batch_ticks_match_tick_events():
+    batch = TickBatchEvent.from_ticks(TICKS, ['EURUSD', 'USDJPY'], 'fxcm')
+
+    ticks = list(batch.ticks())
+    expected = [TickEvent.from_dict(dict(t, provider='fxcm')) for t in TICKS]
+
+    assert len(ticks) == len(expected)
+    for tick, other in zip(ticks, expected):
+        assert tick.type is EventType.TICK
+        assert tick.symbol == other.symbol
+        assert tick.provider == 'fxcm'
+        assert tick.bid == other.bid
+        assert tick.ask == other.ask
+        assert tick.time == np.datetime64(other.time.rstrip('Z'), 'ns')
+
+
+def test_empty_batch():
+    batch = TickBatchEvent.from_ticks([], ['EURUSD'], 'fxcm')
+
+    assert len(batch) == 0
+    assert list(batch.ticks()) == []
+    assert 'Ticks: 0' in str(batch)
+
+
+def test_events_have_slots_and_class_type():
+    events = [TickEvent('EURUSD', 'fxcm', 0, 1, 2),
+              BarEvent('EURUSD', 0, 60, 1, 2, 0, 1, 10),
+              SignalEvent('EURUSD', 'BOT'),
+              OrderEvent('EURUSD', 'BOT', 100),
+              FillEvent(0, 'EURUSD', 'BOT', 100, 'fxcm', 1, 0),
+              SentimentEvent(0, 'EURUSD', 1.0)]
+
+    for event in events:
+        assert not hasattr(event, '__dict__')
+        assert 'type' not in event.__slots__
+        assert event.type is type(event).type
+        assert event.typename == event.type.name
+        with pytest.raises(AttributeError):
+            event.unknown = 1
@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from data_acquisition.fxcm_manifest import (ManifestBuilder, build_manifest,
+                                            get_manifest, manifest_path,
+                                            read_manifest, row_count)
+
+ROWS = ['01/07/2018 22:00:01.123,1.2001,1.2003',
+        '01/07/2018 22:00:02.000,1.2002,1.2004',
+        '01/12/2018 21:59:59.999,1.2101,1.2104']
+
+
+def write_clean_file(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wb') as f:
+        f.write(content)
+
+
+def content(rows, end=b'\n'):
+    return b'\n'.join([b'DateTime,Bid,Ask'] +
+                      [r.encode() for r in rows]) + end
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 10 ** 6])
+def test_builder_same_manifest_for_any_chunks(chunk_size):
+    data = content(ROWS)
+    builder = ManifestBuilder()
+    for start in range(0, len(data), chunk_size):
+        builder.update(data[start:start + chunk_size])
+
+    ans = builder.manifest()
+
+    assert ans['rows'] == 3
+    assert ans['first'] == '2018-01-07T22:00:01.123000Z'
+    assert ans['last'] == '2018-01-12T21:59:59.999000Z'
+
+
+@pytest.mark.parametrize('data, rows', [
+    (content(ROWS, end=b''), 3),
+    (content(ROWS[:1], end=b''), 1),
+    (content([]), 0),
+    (b'', 0)])
+def test_builder_rows_like_line_count(data, rows):
+    builder = ManifestBuilder()
+    builder.update(data)
+
+    ans = builder.manifest()
+
+    # same count as iterating the lines, minus the header
+    assert ans['rows'] == max(len(data.splitlines()) - 1, 0) == rows
+    if rows:
+        assert ans['first'] == '2018-01-07T22:00:01.123000Z'
+    else:
+        assert ans['first'] is None and ans['last'] is None
+
+
+def test_build_and_read_manifest(tmp_path):
+    clean = tmp_path / 'EURUSD' / '2018' / 'EURUSD_2018_2.csv.gz'
+    write_clean_file(clean, content(ROWS))
+
+    assert read_manifest(clean) is None
+    built = build_manifest(clean)
+
+    assert manifest_path(clean) == clean.parent / 'EURUSD_2018_2.manifest'
+    assert read_manifest(clean) == built
+    assert built['filename'] == 'EURUSD_2018_2'
+    assert built['size'] == clean.stat().st_size
+    assert row_count(clean) == 3
+    assert not list(clean.parent.glob('*.tmp'))
+
+
+def test_stale_manifest_rebuilt(tmp_path):
+    clean = tmp_path / 'EURUSD_2018_2.csv.gz'
+    write_clean_file(clean, content(ROWS))
+    build_manifest(clean)
+
+    write_clean_file(clean, content(ROWS[:2]))
+    stat = clean.stat()
+    os.utime(clean, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert read_manifest(clean) is None
+    assert get_manifest(clean)['rows'] == 2
+    assert row_count(clean) == 2
+
+
+def test_broken_manifest_ignored(tmp_path):
+    clean = tmp_path / 'EURUSD_2018_2.csv.gz'
+    write_clean_file(clean, content(ROWS))
+    manifest_path(clean).write_text('{"rows": 3')
+
+    assert read_manifest(clean) is None
+    assert row_count(clean) == 3
+    assert json.loads(manifest_path(clean).read_text())['rows'] == 3
@@ -0,0 +1,103 @@
+import gzip
+import threading
+import time
+
+import pandas as pd
+import pytest
+from influxdb.resultset import ResultSet
+
+import common.settings as settings
+import data_acquisition.fxcm_pipeline as fxcm_pipeline
+import databases.fxcm_tick_insert as fti
+
+CSV = ('DateTime,Bid,Ask\r\n' +
+       ''.join('01/05/2015 10:00:{:02d}.{:03d},1.20{:02d},1.21{:02d}\r\n'.format(
+           i // 100, i % 100, i % 100, i % 100) for i in range(500)))
+
+
+class FakeDatabase:
+    """Database of the row count of each filename, as written by
+    influx_line_writer
+    """
+
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.count_queries = []
+        self.writing = 0
+        self.most_writing = 0
+        self._lock = threading.Lock()
+
+    def influx_qry(self, cql):
+        series = [{'name': 'fx_ticks', 'tags': {'filename': filename},
+                   'columns': ['time', 'count'],
+                   'values': [['1970-01-01T00:00:00Z', count]]}
+                  for filename, count in self.rows.items()]
+        return ResultSet({'statement_id': 0, 'series': series})
+
+    def pooled_client(self, **kwargs):
+        return self
+
+    def query(self, query):
+        self.count_queries.append(query)
+        filename = query.split("filename='")[1].split("'")[0]
+        return {'fx_ticks': pd.DataFrame({'count': [self.rows[filename]]})}
+
+    def delete_series(self, tags):
+        self.rows.pop(tags['filename'], None)
+
+    def influx_line_writer(self, data, tags, into_table, field_columns):
+        with self._lock:
+            self.writing += 1
+            self.most_writing = max(self.most_writing, self.writing)
+        time.sleep(0.05)
+        with self._lock:
+            self.writing -= 1
+            self.rows[tags['filename']] = len(data)
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch, file_server):
+    """Config file with the stores in tmp_path and the local server as
+    FXCM server
+    """
+    path = tmp_path / 'trading.conf'
+    path.write_text('fxcm_data:\n'
+                    '    hostname: {}\n'
+                    '    store_originals: {}\n'
+                    '    store_clean: {}\n'.format(file_server.url,
+                                                   tmp_path / 'originals',
+                                                   tmp_path / 'clean'))
+    monkeypatch.setattr(settings, 'FILE_SETTINGS', str(path))
+    settings.AlgoSettings.reload()
+    yield tmp_path
+    settings.AlgoSettings.reload()
+
+
+def test_pipeline_inserts_files_of_server(stores, file_server, monkeypatch):
+    original = gzip.compress(CSV.encode('utf-16-le'))
+    for symbol in ['EURUSD', 'GBPUSD', 'USDJPY']:
+        file_server.files['/{}/2015/1.csv.gz'.format(symbol)] = original
+    # partly inserted file
+    database = FakeDatabase({'EURUSD_2015_1': 3})
+    for name in ['influx_qry', 'pooled_client', 'delete_series',
+                 'influx_line_writer']:
+        monkeypatch.setattr(fti.db_man, name, getattr(database, name))
+
+    pipeline = fxcm_pipeline.FxcmPipeline(write_workers=3, max_writers=1,
+                                          rate=1000)
+    failed = pipeline.run('2015-01-07')
+
+    assert failed == []
+    # files of the other symbols are not in the server
+    assert database.rows == {'EURUSD_2015_1': 500, 'GBPUSD_2015_1': 500,
+                             'USDJPY_2015_1': 500}
+    # counts of pending_files reused, only the post insert validations
+    assert len(database.count_queries) == 3
+    assert database.most_writing == 1
+    clean = stores / 'clean' / 'GBPUSD' / '2015' / 'GBPUSD_2015_1.csv.gz'
+    assert gzip.decompress(clean.read_bytes()) == CSV.encode()
+
+    # nothing left to do but the files not in the server
+    pending = pipeline.pending_files('2015-01-07')
+    assert len(pending) == 18
+    assert not {item['filename'] for item in pending} & set(database.rows)
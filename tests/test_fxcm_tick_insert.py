@@ -0,0 +1,163 @@
+import multiprocessing
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from influxdb.resultset import ResultSet
+
+import databases.fxcm_tick_insert as fti
+
+
+def test_worker_reports_any_error(monkeypatch):
+    def broken(*args):
+        raise ValueError('bad csv')
+
+    monkeypatch.setattr(fti, 'load_tick_file', broken)
+
+    ans = fti._load_tick_file_worker((pathlib.Path('EURUSD_2018_1.csv.gz'),
+                                      'fxcm', 'fx_ticks', None, 0))
+
+    assert ans['value'] == 'Error'
+
+
+def test_parallel_load_caps_writers(monkeypatch):
+    files = [pathlib.Path('/store/EURUSD/2018/EURUSD_2018_{}.csv.gz'.format(i))
+             for i in range(1, 7)]
+    writing = multiprocessing.Value('i', 0)
+    most_writing = multiprocessing.Value('i', 0)
+    written = multiprocessing.Value('i', 0)
+
+    def prepare(each_file, provider, into_table, rows_in_db):
+        # counts of the bulk validation, not asked again
+        assert rows_in_db == 0
+        tags = {'symbol': 'EURUSD', 'provider': provider,
+                'filename': each_file.parts[-1][:-7]}
+        if tags['filename'] == 'EURUSD_2018_3':
+            raise ValueError('bad csv')
+        return tags, 'data', {'value': 'Not in DB'}
+
+    def write(**kwargs):
+        with writing.get_lock():
+            writing.value += 1
+            most_writing.value = max(most_writing.value, writing.value)
+        time.sleep(0.05)
+        with writing.get_lock():
+            writing.value -= 1
+            written.value += 1
+
+    monkeypatch.setattr(fti, 'get_files_to_load', lambda **kwargs: files)
+    monkeypatch.setattr(fti, 'prepare_tick_file', prepare)
+    monkeypatch.setattr(fti.db_man, 'delete_series', lambda tags: None)
+    monkeypatch.setattr(fti.db_man, 'influx_line_writer', write)
+    monkeypatch.setattr(fti, 'insert_validation',
+                        lambda **kwargs: {'value': 'Exact', 'diff': 0,
+                                          'sec_master': 1})
+
+    fti.load_multiple_tick_files('/store', 'fxcm', 'fx_ticks', workers=3,
+                                 max_writers=1, validation_type='full')
+
+    # the bad file does not stop the others
+    assert written.value == 5
+    assert most_writing.value == 1
+    assert writing.value == 0
+
+
+def test_parallel_load_needs_full_validation(monkeypatch):
+    monkeypatch.setattr(fti, 'get_files_to_load', None)
+
+    with pytest.raises(ValueError):
+        fti.load_multiple_tick_files('/store', 'fxcm', 'fx_ticks', workers=3,
+                                     validation_type='fast')
+
+
+@pytest.mark.parametrize('validation_type, deleted, loaded', [
+    ('fast', ['EURUSD_2018_2'], [2, 3]), ('full', [], [3])])
+def test_files_to_load_keeps_validated_series(monkeypatch, tmp_path,
+                                              validation_type, deleted,
+                                              loaded):
+    files = [tmp_path / 'EURUSD' / '2018' / 'EURUSD_2018_{}.csv.gz'.format(i)
+             for i in range(1, 4)]
+    in_db = {'EURUSD_2018_1': files[0], 'EURUSD_2018_2': files[1]}
+    deletes = []
+    monkeypatch.setattr(fti, 'in_store', lambda dir_path: list(files))
+    monkeypatch.setattr(fti, 'series_by_filename',
+                        lambda **kwargs: dict(in_db))
+    monkeypatch.setattr(fti, 'series_by_filename_row',
+                        lambda **kwargs: dict(in_db))
+    monkeypatch.setattr(fti.db_man, 'delete_series',
+                        lambda tags: deletes.append(tags['filename']))
+
+    ans = fti.get_files_to_load(tmp_path, 'fx_ticks', overwrite=False,
+                                validation_type=validation_type)
+
+    assert deletes == deleted
+    assert ans == [files[i - 1] for i in loaded]
+
+
+FXCM_FORMAT = '%m/%d/%Y %H:%M:%S.%f'
+
+
+def test_datetime_parser_fixed_width():
+    column = pd.Series(['01/07/2018 22:00:01.123', '02/28/2016 00:00:00.000',
+                        '12/31/2019 23:59:59.999', '02/29/2016 12:30:45.050'])
+
+    ans = fti.fxcm_datetime_parser(column)
+
+    expected = pd.to_datetime(column, format=FXCM_FORMAT).values
+    assert ans.dtype == np.dtype('datetime64[ns]')
+    assert ans.tolist() == expected.astype('datetime64[ns]').tolist()
+
+
+def test_datetime_parser_longer_strings():
+    # a longer fraction of second must not be cut to 23 characters
+    column = np.array(['01/07/2018 22:00:01.123', '01/07/2018 22:00:01.1234',
+                       '01/07/2018 22:00:01.123456'])
+
+    ans = fti.fxcm_datetime_parser(column)
+
+    expected = pd.to_datetime(column, format=FXCM_FORMAT).values
+    assert ans.tolist() == expected.astype('datetime64[ns]').tolist()
+    assert ans[2] - ans[0] == np.timedelta64(456, 'us')
+
+
+def test_datetime_parser_other_format_of_same_width():
+    column = np.array(['01/07/2018 22:00:01.123', '01/07/2018T22:00:01.123'])
+
+    with pytest.raises(ValueError):
+        fti.fxcm_datetime_parser(column)
+
+
+def test_datetime_parser_empty():
+    assert len(fti.fxcm_datetime_parser(np.array([], dtype=str))) == 0
+
+
+def fake_counts_query(counts, queries):
+    """influx_qry of a table with a series per filename in counts"""
+    def query(cql):
+        queries.append(cql)
+        limit, offset = (int(n) for n in cql.split()[-3::2])
+        series = [{'name': 'fx_ticks',
+                   'tags': {'filename': filename},
+                   'columns': ['time', 'count'],
+                   'values': [['1970-01-01T00:00:00Z', count]]}
+                  for filename, count in counts[offset:offset + limit]]
+        return ResultSet({'statement_id': 0, 'series': series})
+    return query
+
+
+@pytest.mark.parametrize('files, queries_expected', [
+    (0, 1), (3, 2), (5, 2), (6, 3)])
+def test_row_counts_by_filename_pages(monkeypatch, files, queries_expected):
+    counts = [('EURUSD_2018_{}'.format(i), 1000 + i) for i in range(files)]
+    queries = []
+    monkeypatch.setattr(fti.db_man, 'influx_qry',
+                        fake_counts_query(counts, queries))
+
+    ans = fti.row_counts_by_filename('fx_ticks', page_size=3)
+
+    assert list(ans.items()) == counts
+    assert len(queries) == queries_expected
+    assert queries[-1].endswith(
+        'SLIMIT 3 SOFFSET {}'.format(3 * (queries_expected - 1)))
@@ -0,0 +1,141 @@
+import gzip
+
+import pytest
+import requests
+
+import data_acquisition.fxmc as fxmc
+from data_acquisition.fxcm_manifest import read_manifest
+
+CSV = ('DateTime,Bid,Ask\r\n' +
+       ''.join('01/07/2018 22:00:{:02d}.123,1.20{:02d},1.21{:02d}\r\n'.format(
+           i % 60, i % 100, i % 100) for i in range(500)))
+
+
+def write_original(path, text=CSV):
+    """FXCM originals are UTF-16 LE, ASCII text with NUL bytes between"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(gzip.compress(text.encode('utf-16-le')))
+    return path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 999, fxmc.CLEAN_CHUNK_SIZE])
+def test_clean_file_same_as_whole_file(tmp_path, chunk_size):
+    original = write_original(tmp_path / 'o' / 'EURUSD_2018_2.csv.gz')
+    clean = tmp_path / 'c' / 'EURUSD' / '2018' / 'EURUSD_2018_2.csv.gz'
+
+    assert fxmc.clean_fxcm_file(original, clean, chunk_size) == clean
+
+    expected = gzip.decompress(original.read_bytes()).replace(b'\x00', b'')
+    assert gzip.decompress(clean.read_bytes()) == expected == CSV.encode()
+    assert read_manifest(clean)['rows'] == 500
+    assert not list(clean.parent.glob('*.tmp'))
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:10] + bytes(b ^ 0xff for b in data[10:40]) + data[40:]])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_bad_original_reported_as_failed(tmp_path, damage, workers):
+    originals = tmp_path / 'originals'
+    store = tmp_path / 'clean'
+    write_original(originals / 'EURUSD' / '2018' / 'EURUSD_2018_2.csv.gz')
+    bad = write_original(originals / 'EURUSD' / '2018' / 'EURUSD_2018_3.csv.gz')
+    bad.write_bytes(damage(bad.read_bytes()))
+
+    failed = fxmc.clean_fxcm_originals(originals, store, workers=workers)
+
+    assert failed == [bad]
+    clean_dir = store / 'EURUSD' / '2018'
+    assert sorted(p.name for p in clean_dir.iterdir()) == [
+        'EURUSD_2018_2.csv.gz', 'EURUSD_2018_2.manifest']
+
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def file_server(file_server):
+    file_server.files['/EURUSD/2018/2.csv.gz'] = DATA
+    return file_server
+
+
+def download(server, file_path, path='/EURUSD/2018/2.csv.gz'):
+    with requests.Session() as session:
+        return fxmc.download_file(session, server.url + path, file_path,
+                                  fxmc.TokenBucket(rate=1000),
+                                  chunk_size=1000)
+
+
+def test_download_not_in_server(file_server, tmp_path):
+    urls = {'EURUSD_2018_3.csv.gz': {
+        'url': file_server.url + '/EURUSD/2018/3.csv.gz',
+        'file_path': tmp_path / 'EURUSD_2018_3.csv.gz'}}
+
+    failed = fxmc.get_files(urls, rate=1000)
+
+    assert failed == ['EURUSD_2018_3.csv.gz']
+    assert len(file_server.requests) == 1
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_resumes_part(file_server, tmp_path):
+    file_path = tmp_path / 'EURUSD_2018_2.csv.gz'
+    file_path.with_suffix(fxmc.PART_SUFFIX).write_bytes(DATA[:1000])
+
+    assert download(file_server, file_path) == file_path
+
+    assert file_server.requests == ['bytes=1000-']
+    assert file_path.read_bytes() == DATA
+    assert not file_path.with_suffix(fxmc.PART_SUFFIX).exists()
+
+
+def test_download_server_ignores_range(file_server, tmp_path):
+    file_server.ranges = False
+    file_path = tmp_path / 'EURUSD_2018_2.csv.gz'
+    file_path.with_suffix(fxmc.PART_SUFFIX).write_bytes(DATA[:1000])
+
+    download(file_server, file_path)
+
+    assert file_server.requests == ['bytes=1000-']
+    assert file_path.read_bytes() == DATA
+
+
+def test_download_part_already_complete(file_server, tmp_path):
+    file_path = tmp_path / 'EURUSD_2018_2.csv.gz'
+    file_path.with_suffix(fxmc.PART_SUFFIX).write_bytes(DATA)
+
+    download(file_server, file_path)
+
+    assert file_path.read_bytes() == DATA
+
+
+def test_download_part_larger_than_file(file_server, tmp_path):
+    file_path = tmp_path / 'EURUSD_2018_2.csv.gz'
+    part_path = file_path.with_suffix(fxmc.PART_SUFFIX)
+    part_path.write_bytes(DATA + b'more')
+
+    with pytest.raises(fxmc.IncompleteDownload):
+        download(file_server, file_path)
+
+    # the next try starts again
+    assert not part_path.exists() and not file_path.exists()
+    download(file_server, file_path)
+    assert file_path.read_bytes() == DATA
+
+
+def test_download_cut_keeps_part_to_resume(file_server, tmp_path):
+    file_server.cut_at = 3000
+    file_path = tmp_path / 'EURUSD_2018_2.csv.gz'
+    part_path = file_path.with_suffix(fxmc.PART_SUFFIX)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        download(file_server, file_path)
+
+    assert not file_path.exists()
+    assert part_path.read_bytes() == DATA[:3000]
+
+    file_server.cut_at = None
+    download(file_server, file_path)
+
+    assert file_server.requests == [None, 'bytes=3000-']
+    assert file_path.read_bytes() == DATA
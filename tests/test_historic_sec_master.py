@@ -0,0 +1,93 @@
+import queue
+import time
+
+import numpy as np
+import pytest
+
+import price_handlers.historic_sec_master as historic_sec_master
+from events import EventType
+from price_handlers.historic_sec_master import HistoricFxTickPriceHandler
+
+
+def fill(tick_client, n):
+    tick_client.points = [{'time': t, 'symbol': ('EURUSD', 'USDJPY')[t % 2],
+                           'provider': 'fxcm', 'bid': 1.2, 'ask': 1.2002}
+                          for t in range(n)]
+
+
+def drain(handler, events):
+    received = []
+    while handler.continue_backtest:
+        handler.stream_next()
+        while not events.empty():
+            received.append(events.get())
+    return received
+
+
+def test_ticks_streamed_page_by_page(tick_client):
+    fill(tick_client, 1000)
+    events = queue.Queue()
+    handler = HistoricFxTickPriceHandler(['EURUSD', 'USDJPY'], 'fxcm', 0,
+                                         1000, events, page_size=10,
+                                         prefetch_depth=2)
+    handler.stream_next()
+    time.sleep(0.2)
+
+    # only the pages buffered ahead were asked for
+    assert len(tick_client.queries) <= 2 + 2
+
+    received = [events.get()] + drain(handler, events)
+    assert [e.time for e in received] == [np.datetime64(t, 'ns')
+                                          for t in range(1000)]
+    assert all(e.type is EventType.TICK for e in received)
+
+
+def test_batches_from_pages(tick_client):
+    fill(tick_client, 95)
+    events = queue.Queue()
+    handler = HistoricFxTickPriceHandler(['EURUSD', 'USDJPY'], 'fxcm', 0,
+                                         1000, events, batch_size=20,
+                                         page_size=7)
+
+    batches = drain(handler, events)
+
+    assert [len(b) for b in batches] == [20, 20, 20, 20, 15]
+    assert all(b.type is EventType.TICK_BATCH for b in batches)
+    assert batches[0].symbol_code[:4].tolist() == [0, 1, 0, 1]
+
+
+class FakeTickCache:
+    """TickCache answering with the ticks of the tick client
+    """
+
+    points = []
+
+    def __init__(self, table):
+        pass
+
+    def ticks(self, provider, symbols_list, start_time, end_time):
+        points = self.points
+        return {'time': np.array([p['time'] for p in points],
+                                 dtype='datetime64[ns]'),
+                'symbol_code': np.array([symbols_list.index(p['symbol'])
+                                         for p in points], dtype=np.int16),
+                'bid': np.array([120000] * len(points), dtype=np.int64),
+                'ask': np.array([120020] * len(points), dtype=np.int64)}
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'merge_streams': True},
+                                    {'use_cache': True}])
+def test_tick_time_same_type_in_every_mode(tick_client, monkeypatch,
+                                           kwargs):
+    fill(tick_client, 10)
+    FakeTickCache.points = tick_client.points
+    monkeypatch.setattr(historic_sec_master, 'TickCache', FakeTickCache)
+    events = queue.Queue()
+    handler = HistoricFxTickPriceHandler(['EURUSD', 'USDJPY'], 'fxcm', 0,
+                                         1000, events, **kwargs)
+
+    received = drain(handler, events)
+
+    assert all(type(e.time) is np.datetime64 for e in received)
+    assert [e.time for e in received] == [np.datetime64(t, 'ns')
+                                          for t in range(10)]
@@ -0,0 +1,162 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from influxdb.line_protocol import make_lines
+
+import databases.influx_manager as influx_manager
+from databases.influx_manager import line_protocol
+
+
+def reference_lines(data, field_columns, tags, into_table, tag_columns=()):
+    """Lines of the influxdb client for the same points, non-finite fields
+    left out and rows without fields dropped
+    """
+    times = data.index.values.astype('datetime64[ns]').astype(np.int64)
+    points = []
+    for i, time in enumerate(times.tolist()):
+        fields = {}
+        for column in field_columns:
+            value = data[column].values[i].item()
+            if isinstance(value, float) and not np.isfinite(value):
+                continue
+            fields[column] = value
+        if not fields:
+            continue
+        point_tags = dict(tags)
+        point_tags.update({c: data[c].values[i] for c in tag_columns})
+        points.append({'measurement': into_table, 'tags': point_tags,
+                       'fields': fields, 'time': time // 1000})
+    return make_lines({'points': points}, precision='u').rstrip('\n')
+
+
+def frame():
+    index = pd.DatetimeIndex(['2018-01-01 00:00:00.000001',
+                              '2018-01-01 00:00:01.5',
+                              '2018-01-01 00:00:02',
+                              '2018-01-01 00:00:03',
+                              '2018-01-02 12:00:00'], tz='UTC')
+    return pd.DataFrame({'ask': [1.20015, np.nan, 1.3, np.nan, 1e-05],
+                         'bid': [1.2001, 1.25, np.inf, np.nan, -np.inf],
+                         'ticks': np.array([5, 7, 0, 3, 2], dtype=np.int64),
+                         'frequency': ['1min', '1 min', 'a,b', 'c=d',
+                                       'back\\slash']},
+                        index=index)
+
+
+def test_same_lines_as_influxdb_client():
+    data = frame()
+    tags = {'provider': 'fx cm', 'symbol': 'EUR,USD', 'filename': 'a=b'}
+
+    ans = line_protocol(data, ['ask', 'bid', 'ticks'], tags, 'fx ticks',
+                        tag_columns=['frequency'])
+
+    assert ans == reference_lines(data, ['ask', 'bid', 'ticks'], tags,
+                                  'fx ticks', tag_columns=['frequency'])
+    assert 'nan' not in ans and 'inf' not in ans
+
+
+def test_rows_without_finite_fields_dropped():
+    data = frame()
+
+    ans = line_protocol(data, ['ask', 'bid'], {'symbol': 'EURUSD'},
+                        'fx_ticks')
+
+    lines = ans.split('\n')
+    # the fourth row has NaN in both fields
+    assert len(lines) == 4
+    assert lines == reference_lines(data, ['ask', 'bid'],
+                                    {'symbol': 'EURUSD'},
+                                    'fx_ticks').split('\n')
+    assert lines[1] == 'fx_ticks,symbol=EURUSD bid=1.25 1514764801500000'
+
+
+def test_all_rows_dropped():
+    data = frame()
+    data['ask'] = np.nan
+    data['bid'] = np.nan
+
+    assert line_protocol(data, ['ask', 'bid'], {'symbol': 'EURUSD'},
+                         'fx_ticks') == ''
+
+
+class FakeClient:
+
+    def __init__(self, client_type, user_type):
+        self.client_type = client_type
+        self.user_type = user_type
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client_pool(monkeypatch):
+    clients = []
+
+    def fake_client(client_type='client', user_type='reader'):
+        clients.append(FakeClient(client_type, user_type))
+        return clients[-1]
+
+    monkeypatch.setattr(influx_manager, 'influx_client', fake_client)
+    pool = influx_manager.InfluxClientPool()
+    yield pool, clients
+    pool.close_all()
+
+
+def test_pool_reuses_client_of_thread(client_pool):
+    pool, clients = client_pool
+
+    first = pool.get('client', 'reader')
+
+    assert pool.get('client', 'reader') is first
+    assert pool.get('dataframe', 'reader') is not first
+    assert pool.get('client', 'writer') is not first
+    assert pool.stats() == {'opened': 3, 'reused': 1}
+
+
+def test_pool_closes_clients_of_ended_threads(client_pool):
+    pool, clients = client_pool
+    seen = []
+
+    def work():
+        seen.append(pool.get('client', 'reader'))
+        seen.append(pool.get('client', 'reader'))
+
+    for _ in range(3):
+        threads = [threading.Thread(target=work) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(clients) == 30
+    assert len({id(c) for c in seen}) == 30
+    assert all(c.closed for c in clients)
+    assert pool.stats() == {'opened': 30, 'reused': 30}
+
+
+def test_pool_close_all(client_pool):
+    pool, clients = client_pool
+    main_client = pool.get('client', 'reader')
+    started = threading.Event()
+    finish = threading.Event()
+
+    def work():
+        pool.get('client', 'writer')
+        started.set()
+        finish.wait()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+
+    pool.close_all()
+    finish.set()
+    thread.join()
+
+    assert all(c.closed for c in clients)
+    # a new client after the pool was closed
+    assert pool.get('client', 'reader') is not main_client
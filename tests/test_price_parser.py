@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from price_parser import PriceParser
+
+
+def test_parse_fast_path_matches_dispatch():
+    for value in (1.23456, '1.23456', 12345, np.int64(12345), 0.1):
+        assert PriceParser.parse(value) == PriceParser._parse_dispatch(value)
+
+
+def test_parse_array_matches_parse():
+    prices = [1.20015, 1.2, 0.00001, 112.505, 0.1]
+
+    expected = [PriceParser.parse(p) for p in prices]
+
+    assert PriceParser.parse_array(prices).tolist() == expected
+    assert PriceParser.parse_array(np.array(prices)).tolist() == expected
+    assert PriceParser.parse_array(pd.Series(prices)).tolist() == expected
+    assert PriceParser.parse_array([str(p) for p in prices]).tolist() == \
+        expected
+
+
+def test_parse_array_keeps_parsed_prices():
+    parsed = np.array([12001500, 12000000], dtype=np.int64)
+
+    ans = PriceParser.parse_array(parsed)
+
+    assert ans.dtype == np.int64
+    assert ans.tolist() == parsed.tolist()
+
+
+def test_display_array_matches_display():
+    parsed = [12001500, 12000000, 1125050000]
+
+    for dp in (2, 5):
+        expected = [PriceParser.display(p, dp) for p in parsed]
+        assert PriceParser.display_array(np.array(parsed), dp).tolist() == \
+            expected
+
+
+def test_display_fast_path_matches_dispatch():
+    for value in (12001500, np.int64(12001500), 1.23456):
+        assert PriceParser.display(value, 3) == \
+            PriceParser._display_dispatch(value, 3)
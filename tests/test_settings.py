@@ -0,0 +1,61 @@
+import os
+import pickle
+
+import pytest
+
+import common.settings as settings
+
+CONFIG = """
+influx:
+    host: 127.0.0.1
+    port: 8086
+    database: securities_master
+fxcm_data:
+    store_clean: /data/clean
+symbols:
+    - EURUSD
+    - USDJPY
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / 'trading.conf'
+    path.write_text(CONFIG)
+    monkeypatch.setattr(settings, 'FILE_SETTINGS', str(path))
+    settings.AlgoSettings.reload()
+    yield path
+    settings.AlgoSettings.reload()
+
+
+def test_parsed_once(config_file, monkeypatch):
+    settings.AlgoSettings()
+    monkeypatch.setattr(settings.yaml, 'safe_load', None)
+
+    assert settings.AlgoSettings().influx_config()['port'] == 8086
+
+
+def test_parsed_again_when_modified(config_file):
+    assert settings.AlgoSettings().store_clean_fxcm() == '/data/clean'
+
+    config_file.write_text(CONFIG.replace('/data/clean', '/data/other'))
+    stat = config_file.stat()
+    os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert settings.AlgoSettings().store_clean_fxcm() == '/data/other'
+
+
+def test_plain_copies(config_file):
+    first = settings.AlgoSettings()
+    config = first.influx_config()
+
+    assert type(config) is dict
+    assert type(first.stream['symbols']) is list
+    assert pickle.loads(pickle.dumps(config)) == config
+
+    # changing a copy does not change the settings of other instances
+    config['host'] = 'example.com'
+    first.stream['symbols'].append('GBPUSD')
+    second = settings.AlgoSettings()
+    assert second.influx_config()['host'] == '127.0.0.1'
+    assert second.stream['symbols'] == ['EURUSD', 'USDJPY']
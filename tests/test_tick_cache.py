@@ -0,0 +1,132 @@
+import datetime
+import os
+import threading
+
+import numpy as np
+
+from databases.tick_cache import TickCache
+
+
+class FakeCache(TickCache):
+    """Tick cache with one tick per hour until last_tick, counting the
+    database queries
+    """
+
+    def __init__(self, *args, last_tick=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if last_tick is None:
+            last_tick = np.datetime64(datetime.datetime.utcnow(), 'ns')
+        self.last_tick = np.datetime64(last_tick, 'ns').astype(np.int64)
+        self.queries = []
+        self.last_tick_queries = []
+
+    def _database_last_tick(self, provider, symbol):
+        self.last_tick_queries.append(symbol)
+        return int(self.last_tick)
+
+    def _database_query(self, provider, symbol, day):
+        self.queries.append((symbol, day))
+        start = np.datetime64(day, 'ns').astype(np.int64)
+        if start > self.last_tick:
+            empty = np.empty(0, dtype=np.int64)
+            return {'time': empty, 'bid': empty, 'ask': empty}
+        start = np.datetime64(day, 'ns').astype(np.int64)
+        offset = 0 if symbol == 'EURUSD' else 1
+        return {'time': start + np.arange(24, dtype=np.int64) * 3600 * 10 ** 9
+                        + offset,
+                'bid': np.arange(24, dtype=np.int64) + 1000 * offset,
+                'ask': np.arange(24, dtype=np.int64) + 1000 * offset + 2}
+
+
+def test_miss_then_hit(tmp_path):
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9)
+    day = datetime.date(2018, 1, 2)
+
+    first = cache.read_partition('fxcm', 'EURUSD', day)
+    second = cache.read_partition('fxcm', 'EURUSD', day)
+
+    assert cache.queries == [('EURUSD', day)]
+    assert cache.partition_path('fxcm', 'EURUSD', day).exists()
+    for column in ('time', 'bid', 'ask'):
+        assert np.array_equal(first[column], second[column])
+    assert not list(tmp_path.glob('**/*.tmp'))
+
+
+def test_today_is_not_cached(tmp_path):
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9)
+    today = datetime.datetime.utcnow().date()
+
+    cache.read_partition('fxcm', 'EURUSD', today)
+
+    assert not cache.partition_path('fxcm', 'EURUSD', today).exists()
+
+
+def test_days_not_in_database_are_not_cached(tmp_path):
+    # week loaded until the middle of 2018-01-03
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9,
+                      last_tick='2018-01-03T12:00')
+    days = [datetime.date(2018, 1, d) for d in (2, 3, 4)]
+
+    for day in days:
+        cache.read_partition('fxcm', 'EURUSD', day)
+
+    cached = [day for day in days
+              if cache.partition_path('fxcm', 'EURUSD', day).exists()]
+    # partial and empty days are asked again once their week is loaded
+    assert cached == [datetime.date(2018, 1, 2)]
+    assert cache.last_tick_queries == ['EURUSD']
+
+
+def test_ticks_merged_and_windowed(tmp_path):
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9)
+
+    ans = cache.ticks('fxcm', ['EURUSD', 'USDJPY'],
+                      '2018-01-02T12:00', '2018-01-03T06:00')
+
+    # 12 hours of the first day and 6 of the second, for both symbols
+    assert len(ans['time']) == 2 * 18
+    assert ans['time'].dtype == np.dtype('datetime64[ns]')
+    assert np.all(np.diff(ans['time'].astype(np.int64)) > 0)
+    assert ans['symbol_code'][:2].tolist() == [0, 1]
+    assert ans['time'][0] == np.datetime64('2018-01-02T12:00', 'ns')
+
+
+def test_eviction_keeps_disk_budget(tmp_path):
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9)
+    day = datetime.date(2018, 1, 2)
+    cache.read_partition('fxcm', 'EURUSD', day)
+    size = cache.partition_path('fxcm', 'EURUSD', day).stat().st_size
+
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=2 * size)
+    for i in range(1, 4):
+        cache.read_partition('fxcm', 'EURUSD',
+                             day + datetime.timedelta(days=i))
+
+    kept = sorted(p.name for p in tmp_path.glob('**/*.npz'))
+    assert kept == ['2018-01-04.npz', '2018-01-05.npz']
+
+
+def test_concurrent_writes_of_same_partition(tmp_path):
+    cache = FakeCache(cache_dir=tmp_path, max_bytes=10 ** 9)
+    day = datetime.date(2018, 1, 2)
+    path = cache.partition_path('fxcm', 'EURUSD', day)
+    partition = cache._database_query('fxcm', 'EURUSD', day)
+    errors = []
+
+    def write():
+        try:
+            for _ in range(20):
+                cache._write_partition(path, partition)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert os.listdir(path.parent) == [path.name]
+    with np.load(path) as stored:
+        assert np.array_equal(stored['time'], partition['time'])
@@ -0,0 +1,92 @@
+import queue
+import time
+
+import numpy as np
+import pytest
+
+from common.utilities import threaded_prefetch
+from databases.tick_pages import tick_pages
+from price_handlers.historic_sec_master import HistoricFxTickPriceHandler
+
+
+def ticks(symbol, times):
+    return [{'time': t, 'symbol': symbol, 'provider': 'fxcm',
+             'bid': 1.2, 'ask': 1.2002} for t in times]
+
+
+def test_pages_skip_points_already_returned(tick_client):
+    # runs of equal timestamps across the page boundaries
+    times = [1, 2, 3, 3, 3, 3, 4, 5, 5, 6, 7, 7, 7, 7, 7, 8]
+    tick_client.points = ticks('EURUSD', times)
+
+    pages = list(tick_pages('fx_ticks', 'fxcm', ['EURUSD'], 0, 100,
+                            page_size=3))
+
+    assert [p['time'] for page in pages for p in page] == times
+    assert all(len(page) <= 3 for page in pages)
+
+
+def test_pages_end_time_excluded(tick_client):
+    tick_client.points = ticks('EURUSD', range(10))
+
+    pages = list(tick_pages('fx_ticks', 'fxcm', ['EURUSD'], 2, 7,
+                            page_size=2))
+
+    assert [p['time'] for page in pages for p in page] == [2, 3, 4, 5, 6]
+
+
+def test_threaded_prefetch_keeps_order():
+    assert list(threaded_prefetch(range(100), depth=3)) == list(range(100))
+
+
+def test_threaded_prefetch_raises_in_consumer():
+    def failing():
+        yield 1
+        raise ValueError('broken feed')
+
+    stream = threaded_prefetch(failing())
+
+    assert next(stream) == 1
+    with pytest.raises(ValueError):
+        next(stream)
+
+
+def test_threaded_prefetch_close_stops_producer():
+    produced = []
+
+    def endless():
+        i = 0
+        while True:
+            produced.append(i)
+            yield i
+            i += 1
+
+    stream = threaded_prefetch(endless(), depth=2)
+    assert next(stream) == 0
+    stream.close()
+    time.sleep(0.3)
+    seen = len(produced)
+    time.sleep(0.3)
+
+    # at most the buffer and the item being put were produced ahead
+    assert len(produced) == seen
+    assert seen <= 1 + 2 + 2
+
+
+def test_merged_streams_in_time_order(tick_client):
+    tick_client.points = sorted(ticks('EURUSD', range(0, 60, 2)) +
+                                ticks('USDJPY', range(1, 60, 3)),
+                                key=lambda p: p['time'])
+    events = queue.Queue()
+    handler = HistoricFxTickPriceHandler(['EURUSD', 'USDJPY'], 'fxcm', 0, 60,
+                                         events, merge_streams=True,
+                                         page_size=4)
+
+    while handler.continue_backtest:
+        handler.stream_next()
+    received = [events.get() for _ in range(events.qsize())]
+
+    assert [e.time for e in received] == \
+        [np.datetime64(p['time'], 'ns') for p in tick_client.points]
+    # one query per symbol and page
+    assert all(q.count('symbol=') == 1 for q in tick_client.queries)
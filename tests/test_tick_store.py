@@ -0,0 +1,117 @@
+import gzip
+import queue
+
+import numpy as np
+import pandas as pd
+
+from databases.tick_store import (build_tick_file, open_tick_file,
+                                  symbol_ticks, tick_file_path_constructor)
+from price_handlers.historic_tick_store import TickStoreFxTickPriceHandler
+from price_parser import PriceParser
+
+
+def write_clean_file(path, times, bids, asks):
+    """Clean FXCM file: header and 'MM/DD/YYYY HH:MM:SS.fff,bid,ask' rows
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt') as f:
+        f.write('DateTime,Bid,Ask\n')
+        for time, bid, ask in zip(times, bids, asks):
+            f.write('{},{},{}\n'.format(
+                pd.Timestamp(time).strftime('%m/%d/%Y %H:%M:%S.%f')[:-3],
+                bid, ask))
+
+
+def week_ticks(start, n, step='1min', offset='0s'):
+    times = pd.date_range(start, periods=n, freq=step) + \
+        pd.Timedelta(offset)
+    bids = np.round(1.2 + np.arange(n) * 1e-5, 5)
+    return times, bids, np.round(bids + 2e-5, 5)
+
+
+def test_build_and_open_tick_file(tmp_path):
+    times, bids, asks = week_ticks('2018-01-07 22:00', 100)
+    # unsorted rows come out in time order
+    order = np.r_[50:100, 0:50]
+    clean = tmp_path / 'clean' / 'EURUSD_2018_2.csv.gz'
+    write_clean_file(clean, times[order], bids[order], asks[order])
+
+    path = build_tick_file(clean, tmp_path / 'ticks')
+    records = open_tick_file(path)
+
+    assert path == tick_file_path_constructor('EURUSD_2018_2',
+                                              tmp_path / 'ticks')
+    assert records['time'].tolist() == \
+        times.values.astype('datetime64[ns]').astype(np.int64).tolist()
+    assert records['bid'].tolist() == PriceParser.parse_array(bids).tolist()
+    assert records['ask'].tolist() == PriceParser.parse_array(asks).tolist()
+    assert not list(path.parent.glob('*.tmp'))
+
+
+def test_symbol_ticks_slices_weeks(tmp_path):
+    store = tmp_path / 'ticks'
+    for week, start in ((1, '2018-01-01'), (2, '2018-01-08')):
+        times, bids, asks = week_ticks(start, 7 * 24, step='1h')
+        clean = tmp_path / 'EURUSD_2018_{}.csv.gz'.format(week)
+        write_clean_file(clean, times, bids, asks)
+        build_tick_file(clean, store)
+
+    segments = symbol_ticks('EURUSD', '2018-01-05', '2018-01-10', store)
+
+    times = np.concatenate([s['time'] for s in segments])
+    assert len(segments) == 2
+    assert len(times) == 5 * 24
+    assert times[0] == np.datetime64('2018-01-05', 'ns').astype(np.int64)
+    assert np.all(np.diff(times) > 0)
+
+
+def test_week_without_ticks(tmp_path):
+    store = tmp_path / 'ticks'
+    empty = tmp_path / 'EURUSD_2018_1.csv.gz'
+    write_clean_file(empty, [], [], [])
+    times, bids, asks = week_ticks('2018-01-08', 10, step='1h')
+    clean = tmp_path / 'EURUSD_2018_2.csv.gz'
+    write_clean_file(clean, times, bids, asks)
+
+    path = build_tick_file(empty, store)
+    build_tick_file(clean, store)
+
+    assert path.stat().st_size == 0
+    assert len(open_tick_file(path)) == 0
+    segments = symbol_ticks('EURUSD', '2018-01-01', '2018-01-09', store)
+    assert [len(s) for s in segments] == [10]
+
+    events = queue.Queue()
+    handler = TickStoreFxTickPriceHandler(['EURUSD'], 'fxcm', '2018-01-01',
+                                          '2018-01-02', events,
+                                          store_dirpath=store)
+    while handler.continue_backtest:
+        handler.stream_next()
+    assert events.empty()
+
+
+def test_replay_merges_symbols_in_batches(tmp_path):
+    store = tmp_path / 'ticks'
+    for symbol, offset in (('EURUSD', '0s'), ('USDJPY', '30s')):
+        times, bids, asks = week_ticks('2018-01-01', 1000, offset=offset)
+        clean = tmp_path / '{}_2018_1.csv.gz'.format(symbol)
+        write_clean_file(clean, times, bids, asks)
+        build_tick_file(clean, store)
+
+    events = queue.Queue()
+    handler = TickStoreFxTickPriceHandler(['EURUSD', 'USDJPY'], 'fxcm',
+                                          '2018-01-01', '2018-01-02',
+                                          events, batch_size=64,
+                                          store_dirpath=store)
+    batches = []
+    while handler.continue_backtest:
+        handler.stream_next()
+        while not events.empty():
+            batches.append(events.get())
+
+    times = np.concatenate([b.time for b in batches])
+    codes = np.concatenate([b.symbol_code for b in batches])
+    assert all(len(b) <= 2 * 64 for b in batches)
+    assert len(times) == 2000
+    assert np.all(np.diff(times.astype(np.int64)) > 0)
+    assert codes[:4].tolist() == [0, 1, 0, 1]
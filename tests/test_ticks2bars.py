@@ -0,0 +1,242 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from influxdb.resultset import ResultSet
+
+import databases.ticks2bars as tb
+
+
+def synthetic_ticks(n=20000, seed=3):
+    """Ticks over about two days, with a gap of some hours
+    """
+    rng = np.random.RandomState(seed)
+    steps = rng.exponential(9, n)
+    steps[n // 3] += 5 * 3600
+    times = pd.Timestamp('2018-01-02') + pd.to_timedelta(np.cumsum(steps),
+                                                         unit='s')
+    bids = np.round(1.2 + np.cumsum(rng.normal(0, 1e-4, n)), 5)
+    asks = np.round(bids + rng.randint(1, 30, n) * 1e-5, 5)
+    return pd.DataFrame({'bid': bids, 'ask': asks},
+                        index=pd.DatetimeIndex(times, name='time'))
+
+
+def test_cascade_same_bars_as_from_ticks():
+    ticks = synthetic_ticks()
+
+    cascade = tb.cascade_bars(ticks.copy())
+
+    assert set(cascade['frequency']) == set(tb.CASCADE_FREQUENCIES)
+    for freq in tb.CASCADE_FREQUENCIES:
+        bars = cascade[cascade['frequency'] == freq][tb.BAR_FIELDS]
+        expected = tb.ticks_to_bars(ticks.copy(), freq)
+
+        assert bars.index.equals(expected.index)
+        exact = [f for f in tb.BAR_FIELDS if f != 'spread_mean']
+        np.testing.assert_array_equal(bars[exact].values.astype(float),
+                                      expected[exact].values.astype(float))
+        np.testing.assert_allclose(bars['spread_mean'],
+                                   expected['spread_mean'])
+
+
+# no measurement, or an empty dataframe of it
+@pytest.mark.parametrize('response', [
+    {}, {'fx_ticks': pd.DataFrame(columns=['bid', 'ask'])}])
+def test_no_ticks_in_chunk(monkeypatch, response):
+    writes = []
+    monkeypatch.setattr(tb.db_man, 'influx_qry', lambda **kwargs: response)
+    monkeypatch.setattr(tb.db_man, 'influx_line_writer',
+                        lambda **kwargs: writes.append(kwargs))
+
+    assert tb.query_ticks('fx_ticks', {'symbol': 'EURUSD',
+                                       'provider': 'fxcm'},
+                          '2018-01-06', '2018-01-07') is None
+
+    tb.cascade_resampling('fx_ticks', 'bars',
+                          {'symbol': 'EURUSD', 'provider': 'fxcm'},
+                          pd.Timestamp('2018-01-06'),
+                          pd.Timestamp('2018-01-08'))
+    tb.tick_resampling('fx_ticks', 'bars',
+                       {'symbol': 'EURUSD', 'provider': 'fxcm',
+                        'frequency': '1min'},
+                       pd.Timestamp('2018-01-06'),
+                       pd.Timestamp('2018-01-08'))
+    assert writes == []
+
+
+def test_cascade_writes_all_frequencies_at_once(monkeypatch):
+    ticks = synthetic_ticks()
+    writes = []
+
+    def query(cql, client_type):
+        start = pd.Timestamp(cql.split('time>=\'')[1].split('\'')[0])
+        end = pd.Timestamp(cql.split('time<\'')[1].split('\'')[0])
+        return {'fx_ticks': ticks[(ticks.index >= start) &
+                                  (ticks.index < end)].copy()}
+
+    monkeypatch.setattr(tb.db_man, 'influx_qry', query)
+    monkeypatch.setattr(tb.db_man, 'influx_line_writer',
+                        lambda **kwargs: writes.append(kwargs))
+
+    tb.cascade_resampling('fx_ticks', 'bars',
+                          {'symbol': 'EURUSD', 'provider': 'fxcm'},
+                          ticks.index[0], ticks.index[-1] + pd.Timedelta('1s'))
+
+    # one write per day
+    assert len(writes) == len(ticks.index.normalize().unique())
+    for write in writes:
+        assert write['tag_columns'] == ['frequency']
+        assert write['field_columns'] == tb.BAR_FIELDS
+        assert set(write['data']['frequency']) == \
+            set(tb.CASCADE_FREQUENCIES)
+    daily = pd.concat([w['data'] for w in writes])
+    daily = daily[daily['frequency'] == '1D']
+    assert daily['ticks'].sum() == len(ticks)
+
+
+def test_parallel_writes_each_series_in_time_order(monkeypatch):
+    rng = np.random.RandomState(5)
+    writes = []
+
+    def chunk_bars(input_table, tags, each_chunck, freq):
+        time.sleep(rng.uniform(0, 0.01))
+        if tags['symbol'] == 'USDJPY' and \
+                each_chunck[0] == pd.Timestamp('2018-01-04'):
+            raise SystemError
+        return pd.DataFrame({'start': [each_chunck[0]]})
+
+    monkeypatch.setattr(tb, 'chunk_bars', chunk_bars)
+    monkeypatch.setattr(tb, 'write_bars',
+                        lambda bars, output_table, tags, freq: writes.append(
+                            (tags['symbol'], bars['start'][0])))
+
+    jobs = [({'symbol': symbol, 'provider': 'fxcm'},
+             pd.Timestamp('2018-01-01'), pd.Timestamp('2018-01-11'))
+            for symbol in ('EURUSD', 'USDJPY', 'GBPUSD')]
+    tb.parallel_resampling('fx_ticks', 'bars', jobs, freq='1min', workers=6)
+
+    days = list(pd.date_range('2018-01-01', periods=10, freq='D'))
+    for symbol in ('EURUSD', 'GBPUSD'):
+        assert [s for w, s in writes if w == symbol] == days
+    # a failed chunk stops the later ones of its series only
+    assert [s for w, s in writes if w == 'USDJPY'] == days[:3]
+
+
+def test_write_turns():
+    turns = tb._WriteTurns(3)
+
+    assert turns.wait(0)
+    turns.done(0, True)
+    assert turns.wait(1)
+    turns.done(1, False)
+    assert not turns.wait(2)
+
+
+def result_set(series):
+    return ResultSet({'statement_id': 0, 'series': series})
+
+
+def fake_bounds_query(cql):
+    if cql.startswith('SHOW FIELD KEYS'):
+        return result_set([{'name': 'fx_ticks',
+                            'columns': ['fieldKey', 'fieldType'],
+                            'values': [['ask', 'float'], ['bid', 'float']]}])
+    position = 'first' if cql.startswith('SELECT FIRST') else 'last'
+    times = {('EURUSD', 'first'): '2018-01-01T22:00:05.123Z',
+             ('EURUSD', 'last'): '2018-01-05T21:59:58Z',
+             ('USDJPY', 'first'): '2018-01-02T00:00:01Z',
+             ('USDJPY', 'last'): '2018-01-03T10:30:00Z'}
+    return result_set([{'name': 'fx_ticks',
+                        'tags': {'provider': 'fxcm', 'symbol': symbol},
+                        'columns': ['time', position],
+                        'values': [[times[(symbol, position)], 1.2]]}
+                       for symbol in ('EURUSD', 'USDJPY')])
+
+
+def test_series_time_bounds_grouped(monkeypatch):
+    queries = []
+
+    def query(cql):
+        queries.append(cql)
+        return fake_bounds_query(cql)
+
+    monkeypatch.setattr(tb.db_man, 'influx_qry', query)
+
+    bounds = tb.series_time_bounds('fx_ticks')
+
+    # field keys and one grouped query per position
+    assert len(queries) == 3
+    assert 'GROUP BY "provider", "symbol", "frequency"' in queries[1]
+    assert bounds == {
+        ('fxcm', 'EURUSD', ''): {'first': pd.Timestamp('2018-01-01 22:00'),
+                                 'last': pd.Timestamp('2018-01-05 21:00')},
+        ('fxcm', 'USDJPY', ''): {'first': pd.Timestamp('2018-01-02 00:00'),
+                                 'last': pd.Timestamp('2018-01-03 10:00')}}
+
+
+def test_series_info_asked_once(monkeypatch):
+    queries = []
+
+    def query(cql):
+        queries.append(cql)
+        return fake_bounds_query(cql)
+
+    monkeypatch.setattr(tb.db_man, 'influx_qry', query)
+    monkeypatch.setattr(tb, '_series_info_cache', {})
+
+    info = tb.get_series_info('fx_ticks')
+    assert tb.get_series_info('fx_ticks') is info
+    assert len(queries) == 3
+    tb.get_series_info('fx_ticks', refresh=True)
+    assert len(queries) == 6
+
+    assert [i['id'] for i in info] == [
+        {'provider': 'fxcm', 'symbol': 'EURUSD'},
+        {'provider': 'fxcm', 'symbol': 'USDJPY'}]
+    assert info[0]['data']['frequency'] == ''
+
+
+def test_no_series_in_table(monkeypatch):
+    monkeypatch.setattr(tb.db_man, 'influx_qry',
+                        lambda cql: result_set([]))
+
+    assert tb.series_time_bounds('bars') == {}
+
+
+def test_bar_fields():
+    ticks = pd.DataFrame({'bid': [1.0, 1.2, 0.9, 1.1, 2.0],
+                          'ask': [1.2, 1.3, 1.0, 1.4, 2.2]},
+                         index=pd.DatetimeIndex(['2018-01-02 00:00:01',
+                                                 '2018-01-02 00:00:20',
+                                                 '2018-01-02 00:00:30',
+                                                 '2018-01-02 00:00:59',
+                                                 '2018-01-02 00:03:00']))
+
+    bars = tb.ticks_to_bars(ticks, '1min')
+
+    assert list(bars.columns) == tb.BAR_FIELDS
+    # no bar for the minutes without ticks
+    assert len(bars) == 2
+    first = bars.iloc[0]
+    expected = {'open': 1.1, 'high': 1.25, 'low': 0.95, 'close': 1.25,
+                'bid_open': 1.0, 'bid_high': 1.2, 'bid_low': 0.9,
+                'bid_close': 1.1, 'ask_open': 1.2, 'ask_high': 1.4,
+                'ask_low': 1.0, 'ask_close': 1.4, 'spread_min': 0.1,
+                'spread_max': 0.3, 'spread_mean': 0.175, 'ticks': 4}
+    for field, value in expected.items():
+        assert first[field] == pytest.approx(value), field
+
+
+def test_bars_to_bars_weights_spread_by_ticks():
+    bars = pd.DataFrame({field: [1.0, 1.0] for field in tb.BAR_FIELDS},
+                        index=pd.DatetimeIndex(['2018-01-02 00:00',
+                                                '2018-01-02 00:01']))
+    bars['spread_mean'] = [0.1, 0.4]
+    bars['ticks'] = [3, 1]
+
+    ans = tb.bars_to_bars(bars, '5min')
+
+    assert len(ans) == 1
+    assert ans['ticks'].iloc[0] == 4
+    assert ans['spread_mean'].iloc[0] == pytest.approx((0.3 + 0.4) / 4)
@@ -0,0 +1,29 @@
+import pytest
+
+from common.utilities import atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'old')
+
+    with atomic_write(path) as f:
+        f.write(b'new')
+        # readers still see the old file
+        assert path.read_bytes() == b'old'
+
+    assert path.read_bytes() == b'new'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_error_keeps_old_file(tmp_path):
+    path = tmp_path / 'data.txt'
+    path.write_text('old')
+
+    with pytest.raises(ValueError):
+        with atomic_write(path, mode='wt') as f:
+            f.write('half')
+            raise ValueError('broken')
+
+    assert path.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [path]